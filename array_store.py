@@ -0,0 +1,391 @@
+"""Assignment 2: Array-backed treemap store
+
+=== Module Description ===
+This module contains ArrayTreeStore, an alternative representation of a
+TMTree for very large trees. Instead of one object per node, every field of
+every node is kept in a contiguous NumPy array, so computing data sizes and
+rectangles becomes a handful of vectorized operations per level of the tree
+rather than a Python loop over every node.
+
+Nodes are stored in breadth-first order. This keeps the subtrees of every
+node contiguous, so each node only needs the index of its first subtree and
+its number of subtrees, and it keeps each level of the tree contiguous, so
+a whole level can be laid out at once.
+
+TMTree-like views of individual nodes are only created on demand, e.g. to
+show the path of the selected node in the visualiser.
+
+This module requires NumPy; the rest of the treemap does not.
+"""
+from __future__ import annotations
+from typing import Callable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from tm_trees import TMTree
+
+
+class ArrayTreeStore:
+    """A tree stored as a struct of arrays, with nodes in breadth-first order.
+    Node 0 is the root.
+
+    === Public Attributes ===
+    parent:
+        The index of the parent of each node, or -1 for the root.
+    first_child:
+        The index of the first subtree of each node.
+    child_count:
+        The number of subtrees of each node.
+    data_size:
+        The data_size of each node.
+    x, y, width, height:
+        The components of the rect of each node.
+    expanded:
+        Whether or not each node is expanded for visualization.
+    colour:
+        The colour of each node, packed as 0xRRGGBB.
+
+    === Private Attributes ===
+    _names:
+        The name of each node.
+    _levels:
+        The index of the first node of each level of the tree, followed by
+        the number of nodes.
+    _dfs_order:
+        The indices of the nodes in preorder, the order get_rectangles
+        reports them in.
+    _separator:
+        The separator used between names in a path.
+    _suffix:
+        The get_suffix method of the class of the tree this store was built
+        from.
+    _unlisted:
+        The index of each node whose tree had not created its subtrees yet,
+        such as a pending folder of a lazily scanned FileSystemTree, so that
+        get_suffix can tell those trees from leaves.
+
+    === Representation Invariants ===
+    - The subtrees of node i are the nodes first_child[i] to
+      first_child[i] + child_count[i] - 1, in order.
+    - If child_count[i] > 0, then data_size[i] is the sum of the data_size
+      of its subtrees.
+    """
+    parent: np.ndarray
+    first_child: np.ndarray
+    child_count: np.ndarray
+    data_size: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    width: np.ndarray
+    height: np.ndarray
+    expanded: np.ndarray
+    colour: np.ndarray
+    _names: List[Optional[str]]
+    _levels: List[int]
+    _dfs_order: np.ndarray
+    _separator: str
+    _suffix: Callable[[object], str]
+    _unlisted: Set[int]
+
+    def __init__(self, tree: TMTree) -> None:
+        """Initialize a new store holding a copy of <tree>: its structure,
+        data sizes, rectangles, colours and expanded state.
+        """
+        nodes = [tree]
+        parents = [-1]
+        first_child = []
+        self._levels = [0]
+        level_end = 1
+        for i, node in enumerate(nodes):
+            if i == level_end:
+                self._levels.append(i)
+                level_end = len(nodes)
+            first_child.append(len(nodes))
+            nodes.extend(node._subtrees)
+            parents.extend([i] * len(node._subtrees))
+        self._levels.append(len(nodes))
+
+        self.parent = np.array(parents, dtype=np.int64)
+        self.first_child = np.array(first_child, dtype=np.int64)
+        self.child_count = np.array([len(node._subtrees) for node in nodes],
+                                    dtype=np.int64)
+        self.data_size = np.array([node.data_size for node in nodes],
+                                  dtype=np.int64)
+        self.x = np.array([node._x for node in nodes], dtype=np.int64)
+        self.y = np.array([node._y for node in nodes], dtype=np.int64)
+        self.width = np.array([node._w for node in nodes], dtype=np.int64)
+        self.height = np.array([node._h for node in nodes], dtype=np.int64)
+        self.expanded = np.array([node._expanded for node in nodes],
+                                 dtype=bool)
+        self.colour = np.array([node._get_rgb() for node in nodes],
+                               dtype=np.uint32)
+        self._names = [node._name for node in nodes]
+        self._separator = tree.get_separator()
+        self._suffix = type(tree).get_suffix
+        self._unlisted = {i for i, node in enumerate(nodes)
+                          if node._is_unlisted()}
+
+        index = {id(node): i for i, node in enumerate(nodes)}
+        dfs_order = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            dfs_order.append(index[id(node)])
+            stack.extend(reversed(node._subtrees))
+        self._dfs_order = np.array(dfs_order, dtype=np.int64)
+
+    def __len__(self) -> int:
+        """Return the number of nodes in this store.
+        """
+        return len(self._names)
+
+    def update_data_sizes(self) -> int:
+        """Update the data_size of every node that has subtrees to the sum of
+        the data sizes of its subtrees, and return the new size of the root.
+
+        The levels are summed from the deepest up, each with one segmented
+        sum over its contiguous runs of siblings.
+        """
+        for level in range(len(self._levels) - 2, 0, -1):
+            start = self._levels[level]
+            parents = np.arange(self._levels[level - 1], start)
+            parents = parents[self.child_count[parents] > 0]
+            self.data_size[parents] = np.add.reduceat(
+                self.data_size[start:self._levels[level + 1]],
+                self.first_child[parents] - start)
+        return int(self.data_size[0])
+
+    def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles of every node using the same slice-and-dice
+        treemap algorithm as TMTree.update_rectangles, giving identical
+        rectangles, to fill the area defined by pygame rectangle <rect>.
+        """
+        if self._names[0] is None:
+            rect = (0, 0, 0, 0)
+        self.x[0], self.y[0], self.width[0], self.height[0] = rect
+        for level in range(1, len(self._levels) - 1):
+            self._layout_level(level)
+
+    def _layout_level(self, level: int) -> None:
+        """Compute the rects of the nodes of <level> of the tree from the
+        rects of their parents.
+
+        Data sizes are assumed to be below 2 ** 53, so that dividing them as
+        floats gives the same proportions as TMTree.
+        """
+        start = self._levels[level]
+        end = self._levels[level + 1]
+        parents = np.arange(self._levels[level - 1], start)
+        parents = parents[self.child_count[parents] > 0]
+        counts = self.child_count[parents]
+        pw = self.width[parents]
+        ph = self.height[parents]
+        horizontal = (pw > ph).astype(np.int64)
+        length = horizontal * pw + (1 - horizontal) * ph
+
+        # The extent of each subtree along the side its parent is sliced on,
+        # computed with the same float operations as TMTree so the floors
+        # agree. Subtrees of a tree with no data get no space.
+        parent_sizes = np.repeat(self.data_size[parents], counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            extent = np.floor(np.repeat(length, counts) *
+                              (self.data_size[start:end] / parent_sizes))
+        extent = np.where(parent_sizes > 0, extent, 0).astype(np.int64)
+
+        # The offset of each subtree within its parent is the sum of the
+        # extents of its earlier siblings.
+        first = self.first_child[parents] - start
+        offset = np.cumsum(extent) - extent
+        offset -= np.repeat(offset[first], counts)
+
+        # The last subtree takes whatever is left of its parent.
+        last = first + counts - 1
+        extent[last] = length - offset[last]
+
+        horizontal = np.repeat(horizontal, counts)
+        vertical = 1 - horizontal
+        x = np.repeat(self.x[parents], counts) + horizontal * offset
+        y = np.repeat(self.y[parents], counts) + vertical * offset
+        width = horizontal * extent + vertical * np.repeat(pw, counts)
+        height = vertical * extent + horizontal * np.repeat(ph, counts)
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.width[start:end] = width
+        self.height[start:end] = height
+
+    def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
+                                           Tuple[int, int, int]]]:
+        """Return the same list as TMTree.get_rectangles: the rectangle and
+        colour of every leaf of the displayed-tree, in preorder.
+        """
+        displayed = self._displayed_leaves()
+        order = self._dfs_order[displayed[self._dfs_order]]
+        colour = self.colour[order]
+        return list(zip(
+            zip(self.x[order].tolist(), self.y[order].tolist(),
+                self.width[order].tolist(), self.height[order].tolist()),
+            zip((colour >> 16).tolist(), ((colour >> 8) & 0xFF).tolist(),
+                (colour & 0xFF).tolist())))
+
+    def get_tree_at_position(self, pos: Tuple[int, int]) -> \
+            Optional[ArrayTreeView]:
+        """Return a view of the same leaf TMTree.get_tree_at_position returns
+        for <pos>, or None if there is no displayed leaf at <pos>.
+        """
+        order = self._dfs_order[self._displayed_leaves()[self._dfs_order]]
+        x = self.x[order]
+        y = self.y[order]
+        hit = (x <= pos[0]) & (pos[0] <= x + self.width[order]) & \
+              (y <= pos[1]) & (pos[1] <= y + self.height[order])
+        if not hit.any():
+            return None
+        distance = x[hit] ** 2 + y[hit] ** 2
+        return self.view(int(order[hit][np.argmin(distance)]))
+
+    def expand_all(self) -> None:
+        """Expand every node that has subtrees.
+        """
+        self.expanded = self.child_count > 0
+
+    def view(self, index: int) -> ArrayTreeView:
+        """Return a TMTree-like view of node <index>.
+        """
+        return ArrayTreeView(self, index)
+
+    def _displayed_leaves(self) -> np.ndarray:
+        """Return a mask of the nodes get_rectangles reports: nodes that are
+        not expanded, have a non-zero data_size, and whose ancestors are all
+        expanded.
+        """
+        reachable = np.zeros(len(self), dtype=bool)
+        reachable[0] = True
+        for level in range(1, len(self._levels) - 1):
+            start = self._levels[level]
+            end = self._levels[level + 1]
+            parent = self.parent[start:end]
+            reachable[start:end] = reachable[parent] & self.expanded[parent]
+        return reachable & ~self.expanded & (self.data_size != 0)
+
+
+class ArrayTreeView:
+    """A TMTree-like view of one node of an ArrayTreeStore, with the parts of
+    the TMTree interface the visualiser needs to display a selected node.
+
+    === Private Attributes ===
+    _store:
+        The store this view reads from.
+    _index:
+        The index of the viewed node in _store.
+    """
+    __slots__ = ('_store', '_index')
+    _store: ArrayTreeStore
+    _index: int
+
+    def __init__(self, store: ArrayTreeStore, index: int) -> None:
+        """Initialize a new view of node <index> of <store>.
+        """
+        self._store = store
+        self._index = index
+
+    def __eq__(self, other: object) -> bool:
+        """Return whether <other> is a view of the same node.
+        """
+        return isinstance(other, ArrayTreeView) and \
+            self._store is other._store and self._index == other._index
+
+    def __hash__(self) -> int:
+        """Return a hash of the viewed node.
+        """
+        return hash((id(self._store), self._index))
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        """The pygame rectangle of the viewed node.
+        """
+        i = self._index
+        store = self._store
+        return (int(store.x[i]), int(store.y[i]), int(store.width[i]),
+                int(store.height[i]))
+
+    @property
+    def data_size(self) -> int:
+        """The data_size of the viewed node.
+        """
+        return int(self._store.data_size[self._index])
+
+    @property
+    def _name(self) -> Optional[str]:
+        """The name of the viewed node.
+        """
+        return self._store._names[self._index]
+
+    @property
+    def _colour(self) -> Tuple[int, int, int]:
+        """The colour of the viewed node.
+        """
+        rgb = int(self._store.colour[self._index])
+        return (rgb >> 16, (rgb >> 8) & 0xFF, rgb & 0xFF)
+
+    @property
+    def _expanded(self) -> bool:
+        """Whether or not the viewed node is expanded.
+        """
+        return bool(self._store.expanded[self._index])
+
+    def _is_unlisted(self) -> bool:
+        """Return whether the tree the store was built from had not created
+        the subtrees of the viewed node yet.
+        """
+        return self._index in self._store._unlisted
+
+    @property
+    def _parent_tree(self) -> Optional[ArrayTreeView]:
+        """A view of the parent of the viewed node, or None for the root.
+        """
+        parent = int(self._store.parent[self._index])
+        if parent < 0:
+            return None
+        return ArrayTreeView(self._store, parent)
+
+    @property
+    def _subtrees(self) -> List[ArrayTreeView]:
+        """Views of the subtrees of the viewed node.
+        """
+        first = int(self._store.first_child[self._index])
+        count = int(self._store.child_count[self._index])
+        return [ArrayTreeView(self._store, i)
+                for i in range(first, first + count)]
+
+    def is_empty(self) -> bool:
+        """Return True iff the viewed node is an empty tree.
+        """
+        return self._name is None
+
+    def get_separator(self) -> str:
+        """Return the separator of the tree the store was built from.
+        """
+        return self._store._separator
+
+    def get_suffix(self) -> str:
+        """Return the suffix the tree the store was built from would use for
+        the viewed node.
+        """
+        return self._store._suffix(self)
+
+    def get_path_string(self, final_node: bool = True) -> str:
+        """Return the same path string TMTree.get_path_string would for the
+        viewed node.
+        """
+        store = self._store
+        parts = []
+        i = self._index
+        while store.parent[i] >= 0:
+            parts.append(store._names[i])
+            parts.append(store._separator)
+            i = int(store.parent[i])
+        parts.append(store._names[i])
+        path_str = ''.join(reversed(parts))
+        if final_node or (self._index != 0 and
+                          store.child_count[self._index] == 0):
+            path_str += self.get_suffix()
+        return path_str
@@ -0,0 +1,237 @@
+"""Assignment 2: Benchmark suite for catching performance regressions
+
+=== Module Description ===
+This module times the main TMTree operations on trees of configurable shape
+and size, and saves the results to a baseline file that a later run can be
+compared against.
+
+For each shape and size it times building the tree (TMTree.__init__ for
+every node), update_data_sizes, update_rectangles, expand_all,
+get_rectangles, get_tree_at_position and, unless --no-render is given,
+render_display on a headless pygame display. It also times building a
+FileSystemTree over a generated temporary directory.
+
+Examples, run from the directory that contains cs1_papers.csv:
+    python benchmark_suite.py --save baseline.json
+    python benchmark_suite.py --compare baseline.json
+    python benchmark_suite.py --shapes deep skewed --sizes 1000 1000000
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import papers
+from benchmarks import TREEMAP_RECT, deep_tree, make_directory, \
+    replicate_papers, skewed_tree, synthetic_tree, time_call
+from tm_trees import TMTree, FileSystemTree
+
+# The shapes of tree the suite can build, and what they look like.
+SHAPES = {
+    'balanced': 'every folder has 10 subtrees',
+    'wide': 'every folder has 1000 subtrees',
+    'deep': 'a chain of folders with 9 leaves each',
+    'skewed': 'varying folder sizes and heavy-tailed leaf sizes',
+    'zeros': 'balanced, with half of the leaves of size 0',
+    'papers': 'cs1_papers.csv, replicated to the requested size',
+    'papers_1000': 'test_1000_inputs.csv, replicated to the requested size',
+}
+DEFAULT_SHAPES = ['balanced', 'wide', 'deep', 'skewed', 'zeros', 'papers']
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+# The number of files in the generated directory for FileSystemTree.
+DEFAULT_FILES = 10 ** 4
+# Results more than this many times slower than the baseline are reported
+# as regressions.
+DEFAULT_THRESHOLD = 1.25
+
+# The number of points get_tree_at_position is timed on.
+_HIT_TESTS = 1000
+# The number of times the faster operations are repeated; the best time is
+# kept.
+_REPEAT = 3
+
+
+def build_tree(shape: str, n_nodes: int, seed: int = 0) -> TMTree:
+    """Return a tree of the given <shape> with about <n_nodes> trees in it.
+    """
+    if shape == 'balanced':
+        return synthetic_tree(n_nodes * 9 // 10 or 1, seed=seed)
+    elif shape == 'wide':
+        return synthetic_tree(n_nodes, fanout=1000, seed=seed)
+    elif shape == 'deep':
+        return deep_tree(max(1, n_nodes // 10), leaves_per_level=9, seed=seed)
+    elif shape == 'skewed':
+        return skewed_tree(n_nodes * 19 // 20 or 1, seed=seed)
+    elif shape == 'zeros':
+        return synthetic_tree(n_nodes * 9 // 10 or 1, seed=seed,
+                              zero_fraction=0.5)
+    elif shape == 'papers':
+        return replicated_papers_tree('cs1_papers.csv', n_nodes)
+    elif shape == 'papers_1000':
+        return replicated_papers_tree('test_1000_inputs.csv', n_nodes)
+    raise ValueError('Unknown shape: {}'.format(shape))
+
+
+def replicated_papers_tree(data_file: str, n_nodes: int) -> TMTree:
+    """Return a PaperTree built from the papers in <data_file>, each
+    repeated enough times under a new title for the tree to have about
+    <n_nodes> trees in it, grouped by category as with by_year=False.
+    """
+    with open(data_file, newline='', encoding='utf-8-sig') as f:
+        n_rows = sum(1 for _ in csv.reader(f)) - 1
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'papers.csv')
+        replicate_papers(data_file, path, max(1, n_nodes // n_rows))
+        return papers.PaperDataset(path).build(('category',))
+    finally:
+        shutil.rmtree(folder)
+
+
+def run_suite(shapes: List[str], sizes: List[int], n_files: int,
+              render: bool) -> Dict[str, float]:
+    """Return the seconds taken by each operation for every shape and size,
+    keyed by '<shape>/<size>/<operation>', printing them as they are timed.
+    """
+    results = {}
+    screen = _headless_screen() if render else None
+    for shape in shapes:
+        for size in sizes:
+            prefix = '{}/{}/'.format(shape, size)
+            holder = []
+            _record(results, prefix + 'construct',
+                    time_call(lambda: holder.append(build_tree(shape, size))))
+            tree = holder[0]
+            _record(results, prefix + 'update_data_sizes',
+                    _best_time(tree.update_data_sizes))
+            _record(results, prefix + 'update_rectangles',
+                    _best_time(lambda: tree.update_rectangles(TREEMAP_RECT)))
+            _record(results, prefix + 'expand_all', time_call(tree.expand_all))
+            _record(results, prefix + 'get_rectangles',
+                    _best_time(tree.get_rectangles))
+            rng = random.Random(0)
+            points = [(rng.randint(0, TREEMAP_RECT[2]),
+                       rng.randint(0, TREEMAP_RECT[3]))
+                      for _ in range(_HIT_TESTS)]
+            _record(results, prefix + 'get_tree_at_position',
+                    _best_time(lambda: [tree.get_tree_at_position(pos)
+                                        for pos in points]) / len(points))
+            if screen is not None:
+                _record(results, prefix + 'render_display',
+                        _best_time(lambda: _render(screen, tree)))
+
+    if n_files > 0:
+        root = tempfile.mkdtemp()
+        try:
+            make_directory(root, n_files)
+            _record(results, 'filesystem/{}/construct'.format(n_files),
+                    _best_time(lambda: FileSystemTree(root)))
+        finally:
+            shutil.rmtree(root)
+    return results
+
+
+def save_results(results: Dict[str, float], path: str) -> None:
+    """Save <results> to the baseline file at <path>, with a description of
+    the machine they were measured on.
+    """
+    with open(path, 'w') as f:
+        json.dump({'python': sys.version, 'platform': platform.platform(),
+                   'results': results}, f, indent=1, sort_keys=True)
+
+
+def compare_results(results: Dict[str, float], path: str,
+                    threshold: float) -> List[str]:
+    """Print how <results> compare with the baseline file at <path>, and
+    return the keys of the results more than <threshold> times slower than
+    the baseline.
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print('{:<50} {:>12} {:>12} {:>8}'.format('', 'baseline', 'now', 'ratio'))
+    for key in sorted(results):
+        if key not in baseline or baseline[key] == 0:
+            continue
+        ratio = results[key] / baseline[key]
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('{:<50} {:>10.4g} s {:>10.4g} s {:>7.2f}x{}'.format(
+            key, baseline[key], results[key], ratio, flag))
+    return regressions
+
+
+def _record(results: Dict[str, float], key: str, seconds: float) -> None:
+    """Store <seconds> in <results> as the time for <key> and print it.
+    """
+    results[key] = seconds
+    print('{:<50} {:>12.6f} s'.format(key, seconds))
+
+
+def _best_time(function: Callable[[], object]) -> float:
+    """Return the smallest number of seconds calling <function> took, out of
+    _REPEAT calls.
+    """
+    return min(time_call(function) for _ in range(_REPEAT))
+
+
+def _headless_screen() -> object:
+    """Return a pygame display surface that is not shown on screen.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from treemap_visualiser import WIDTH, HEIGHT
+    pygame.init()
+    return pygame.display.set_mode((WIDTH, HEIGHT))
+
+
+def _render(screen: object, tree: TMTree) -> None:
+    """Draw <tree> on <screen> the way the visualiser does every frame.
+    """
+    from treemap_visualiser import render_display
+    render_display(screen, tree, None, None)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the suite with the command line arguments <argv>, and return 1
+    if a result regressed against the baseline, or 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=
+                                     argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', nargs='+', default=DEFAULT_SHAPES,
+                        choices=sorted(SHAPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='approximate numbers of trees, up to 10000000')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES,
+                        help='files in the generated directory; 0 to skip')
+    parser.add_argument('--no-render', action='store_true',
+                        help='do not time render_display')
+    parser.add_argument('--save', metavar='PATH',
+                        help='save the results as a baseline file')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results with a baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.shapes, args.sizes, args.files,
+                        not args.no_render)
+    if args.save:
+        save_results(results, args.save)
+    if args.compare:
+        if compare_results(results, args.compare, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1119 @@
+"""Assignment 2: Benchmarks for the treemap
+
+=== Module Description ===
+This module contains benchmarks for the performance-sensitive parts of the
+TMTree interface. Each bench_* function builds its trees, times the
+operations being compared and prints a small report.
+
+Run this module with the names of the benchmarks to run as arguments, e.g.
+    python benchmarks.py point_location
+or with no arguments to run all of them. Run it from the directory that
+contains cs1_papers.csv.
+"""
+from __future__ import annotations
+import csv
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import instrumentation
+import papers
+from fs_scan import ScanCache, ScanOptions, scan
+from fs_watch import FileSystemWatcher
+from tm_trees import TMTree, FileSystemTree, slice_and_dice_layout, \
+    squarified_layout
+from papers import PaperTree
+
+# The area the visualiser lays the treemap out in.
+TREEMAP_RECT = (0, 0, 800, 570)
+
+
+class _BenchTree(TMTree):
+    """A concrete TMTree used for the synthetic benchmark trees.
+    """
+
+    __slots__ = ()
+
+    def get_separator(self) -> str:
+        """Return the separator used between names in a path.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the suffix used at the end of a path.
+        """
+        if len(self._subtrees) == 0:
+            return ' (leaf)'
+        else:
+            return ' (node)'
+
+
+def synthetic_tree(n_leaves: int, fanout: int = 10, seed: int = 0,
+                   zero_fraction: float = 0.0) -> TMTree:
+    """Return a balanced tree with <n_leaves> leaves of random size, where
+    every internal node has at most <fanout> subtrees. About <zero_fraction>
+    of the leaves have a size of 0.
+    """
+    rng = random.Random(seed)
+    level = [_BenchTree('f{}'.format(i), [],
+                        0 if zero_fraction and rng.random() < zero_fraction
+                        else rng.randint(1, 10000))
+             for i in range(n_leaves)]
+    depth = 0
+    while len(level) > 1:
+        depth += 1
+        level = [_BenchTree('d{}_{}'.format(depth, i // fanout),
+                            level[i:i + fanout])
+                 for i in range(0, len(level), fanout)]
+    return level[0]
+
+
+def deep_tree(depth: int, leaves_per_level: int = 1,
+              seed: int = 0) -> TMTree:
+    """Return a tree of height <depth>: a chain of internal nodes, each with
+    <leaves_per_level> leaves of random size next to the rest of the chain.
+    """
+    rng = random.Random(seed)
+    tree = _BenchTree('leaf', [], 1)
+    for i in range(depth):
+        leaves = [_BenchTree('f{}_{}'.format(i, j), [], rng.randint(1, 10000))
+                  for j in range(leaves_per_level)]
+        tree = _BenchTree('d{}'.format(i), leaves + [tree])
+    return tree
+
+
+def skewed_tree(n_leaves: int, seed: int = 0) -> TMTree:
+    """Return a tree shaped like a file system, with <n_leaves> leaves: the
+    number of subtrees of each folder varies, and the leaf sizes follow a
+    heavy-tailed distribution, so a few files are much bigger than the rest.
+    """
+    rng = random.Random(seed)
+    level = [_BenchTree('f{}'.format(i), [],
+                        int(rng.paretovariate(1.2) * 1000))
+             for i in range(n_leaves)]
+    depth = 0
+    while len(level) > 1:
+        depth += 1
+        next_level = []
+        i = 0
+        while i < len(level):
+            fanout = rng.randint(2, 40)
+            next_level.append(_BenchTree(
+                'd{}_{}'.format(depth, len(next_level)), level[i:i + fanout]))
+            i += fanout
+        level = next_level
+    return level[0]
+
+
+def make_directory(root: str, n_files: int, fanout: int = 20,
+                   seed: int = 0) -> None:
+    """Fill the empty directory <root> with <n_files> files of random size,
+    in nested folders of at most <fanout> entries each.
+
+    The files are sparse, so they take almost no space on disk.
+    """
+    rng = random.Random(seed)
+    folders = [root]
+    n_folders = 1
+    while n_folders * fanout < n_files:
+        n_folders *= fanout
+    while len(folders) < n_folders:
+        parent = folders.pop(0)
+        for i in range(fanout):
+            folder = os.path.join(parent, 'dir{}'.format(i))
+            os.mkdir(folder)
+            folders.append(folder)
+    for i in range(n_files):
+        path = os.path.join(folders[i % len(folders)], 'file{}.txt'.format(i))
+        with open(path, 'wb') as f:
+            f.truncate(rng.randint(1, 100000))
+
+
+def papers_tree(by_year: bool = False) -> TMTree:
+    """Return the paper tree built from cs1_papers.csv.
+    """
+    return PaperTree('CS1', [], all_papers=True, by_year=by_year)
+
+
+def time_call(function: Callable[[], object]) -> float:
+    """Return the number of seconds it takes to call <function> once.
+    """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _peak_memory(function: Callable[[], object]) -> int:
+    """Return the peak number of bytes allocated while calling <function>
+    once, measured with tracemalloc.
+    """
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def _report(label: str, seconds: float, count: int = 1) -> None:
+    """Print the total and per-call time of an operation called <count>
+    times in <seconds>.
+    """
+    print('  {:<40} {:>10.4f} s total {:>14.2f} us/call'.format(
+        label, seconds, seconds / count * 1e6))
+
+
+##############################################################################
+# Baseline implementations, kept for comparison
+##############################################################################
+
+
+def _scan_tree_at_position(tree: TMTree, pos: Tuple[int, int]) -> \
+        Optional[TMTree]:
+    """The original get_tree_at_position: scan every subtree, then break
+    ties by distance to the origin.
+    """
+    if tree.data_size == 0:
+        return None
+    elif tree.rect[0] <= pos[0] <= (tree.rect[0] + tree.rect[2]) and \
+            tree.rect[1] <= pos[1] <= (tree.rect[1] + tree.rect[3]) \
+            and (tree._subtrees == [] or not tree._expanded):
+        return tree
+    else:
+        leaves = []
+        for sub in tree._subtrees:
+            leaves.append(_scan_tree_at_position(sub, pos))
+        leaves = [item for item in leaves if item is not None]
+        if len(leaves) == 0:
+            return None
+        smallest = math.sqrt((leaves[0].rect[0])**2 + (leaves[0].rect[1])**2)
+        i = 0
+        j = 0
+        for leaf in leaves[1:]:
+            j += 1
+            c = math.sqrt((leaf.rect[0])**2 + (leaf.rect[1])**2)
+            if c < smallest:
+                smallest = c
+                i = j
+        return leaves[i]
+
+
+def _recursive_update_rectangles(tree: TMTree,
+                                 rect: Tuple[int, int, int, int]) -> None:
+    """The original recursive update_rectangles.
+    """
+    if tree._name is None:
+        tree.rect = (0, 0, 0, 0)
+    elif tree._subtrees == []:
+        tree.rect = rect
+    elif tree.data_size > 0:
+        x, y, width, height = rect
+        tree.rect = rect
+        save_x = x
+        save_y = y
+        if width > height:
+            for i in tree._subtrees[:-1]:
+                proportion_i = i.data_size / tree.data_size
+                i.rect = (x, y, math.floor(width * proportion_i), height)
+                x += i.rect[2]
+                _recursive_update_rectangles(i, i.rect)
+            tree._subtrees[-1].rect = (x, y, save_x + width - x, height)
+            _recursive_update_rectangles(tree._subtrees[-1],
+                                         tree._subtrees[-1].rect)
+        else:
+            for j in tree._subtrees[:-1]:
+                proportion_j = j.data_size / tree.data_size
+                j.rect = (x, y, width, math.floor(height * proportion_j))
+                y += j.rect[3]
+                _recursive_update_rectangles(j, j.rect)
+            tree._subtrees[-1].rect = (x, y, width, save_y + height - y)
+            _recursive_update_rectangles(tree._subtrees[-1],
+                                         tree._subtrees[-1].rect)
+    elif tree.data_size == 0:
+        tree.rect = rect
+        x, y, width, height = rect
+        for i in tree._subtrees[:-1]:
+            if width > height:
+                i.rect = (x, y, 0, height)
+            else:
+                i.rect = (x, y, width, 0)
+            _recursive_update_rectangles(i, i.rect)
+        tree._subtrees[-1].rect = rect
+        _recursive_update_rectangles(tree._subtrees[-1], rect)
+
+
+def _recursive_get_rectangles(tree: TMTree) -> List[Tuple[Tuple, Tuple]]:
+    """The original recursive get_rectangles.
+    """
+    if tree._expanded is False and tree.data_size == 0:
+        return []
+    elif tree._expanded is False:
+        return [(tree.rect, tree._colour)]
+    else:
+        result = []
+        for sub in tree._subtrees:
+            result.extend(_recursive_get_rectangles(sub))
+        return result
+
+
+def _recursive_update_data_sizes(tree: TMTree) -> int:
+    """The original recursive update_data_sizes.
+    """
+    if tree._subtrees == []:
+        return tree.data_size
+    else:
+        tree.data_size = 0
+        for sub in tree._subtrees:
+            tree.data_size += _recursive_update_data_sizes(sub)
+        return tree.data_size
+
+
+def _recursive_expand_all(tree: TMTree) -> None:
+    """The original recursive expand_all.
+    """
+    if tree._subtrees != []:
+        tree._expanded = True
+        for sub in tree._subtrees:
+            _recursive_expand_all(sub)
+
+
+class _DictTree:
+    """A tree node laid out like TMTree was before it used __slots__: one
+    __dict__ per node, with rect and colour stored as tuples.
+    """
+
+    def __init__(self, name: str, subtrees: List[_DictTree],
+                 data_size: int = 0) -> None:
+        """Initialize a node the way the original TMTree.__init__ did.
+        """
+        self.rect = (0, 0, 0, 0)
+        self._name = name
+        self._subtrees = subtrees[:]
+        self._parent_tree = None
+        self._colour = (random.randint(0, 255), random.randint(0, 255),
+                        random.randint(0, 255))
+        if len(subtrees) == 0:
+            self.data_size = data_size
+        else:
+            self.data_size = 0
+            for subtree in subtrees:
+                self.data_size += subtree.data_size
+        for subtree in subtrees:
+            subtree._parent_tree = self
+        self._expanded = False
+
+
+class _RandintTree(_BenchTree):
+    """A _BenchTree that picks its colour with three randint calls when it
+    is created, as the original TMTree constructor did.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, name: str, subtrees: List[TMTree],
+                 data_size: int = 0) -> None:
+        """Initialize a new tree with a random colour.
+        """
+        _BenchTree.__init__(self, name, subtrees, data_size)
+        self._colour = (random.randint(0, 255), random.randint(0, 255),
+                        random.randint(0, 255))
+
+
+class _ListdirFileSystemTree(FileSystemTree):
+    """A FileSystemTree built the original way, with os.path.isdir,
+    os.listdir, os.path.join and os.path.getsize for every entry.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, path: str) -> None:
+        """Store the file tree structure contained in the given file or folder.
+        """
+        nodes = [self]
+        paths = [path]
+        subtrees = [[]]
+        i = 0
+        while i < len(nodes):
+            if os.path.isdir(paths[i]):
+                for f in os.listdir(paths[i]):
+                    child = FileSystemTree.__new__(type(self))
+                    subtrees[i].append(child)
+                    nodes.append(child)
+                    paths.append(os.path.join(paths[i], f))
+                    subtrees.append([])
+            i += 1
+        for i in range(len(nodes) - 1, -1, -1):
+            TMTree.__init__(nodes[i], os.path.basename(paths[i]), subtrees[i],
+                            os.path.getsize(paths[i]))
+            nodes[i]._pending = None
+            nodes[i]._lazy = None
+
+
+def _recursive_get_path_string(tree: TMTree, final_node: bool = True) -> str:
+    """The original recursive get_path_string.
+    """
+    if tree._parent_tree is None:
+        path_str = tree._name
+        if final_node:
+            path_str += tree.get_suffix()
+        return path_str
+    else:
+        path_str = (_recursive_get_path_string(tree._parent_tree, False) +
+                    tree.get_separator() + tree._name)
+        if final_node or len(tree._subtrees) == 0:
+            path_str += tree.get_suffix()
+        return path_str
+
+
+##############################################################################
+# Benchmarks
+##############################################################################
+
+
+def bench_point_location() -> None:
+    """Compare the binary-search get_tree_at_position with the original
+    full scan, on the papers tree and on a synthetic 1M-leaf tree.
+    """
+    cases = [('cs1_papers.csv', papers_tree, 2000, 200),
+             ('synthetic 1M leaves', lambda: synthetic_tree(10 ** 6), 2000, 3)]
+    for label, build, new_queries, old_queries in cases:
+        tree = build()
+        tree.expand_all()
+        tree.update_rectangles(TREEMAP_RECT)
+        rng = random.Random(1)
+        points = [(rng.randint(0, TREEMAP_RECT[2]),
+                   rng.randint(0, TREEMAP_RECT[3]))
+                  for _ in range(new_queries)]
+
+        for pos in points[:old_queries]:
+            assert tree.get_tree_at_position(pos) is \
+                _scan_tree_at_position(tree, pos)
+
+        print('{} (fully expanded)'.format(label))
+        _report('full scan',
+                time_call(lambda: [_scan_tree_at_position(tree, pos)
+                               for pos in points[:old_queries]]),
+                old_queries)
+        _report('binary search',
+                time_call(lambda: [tree.get_tree_at_position(pos)
+                               for pos in points]),
+                new_queries)
+
+
+def bench_traversal() -> None:
+    """Compare the iterative traversals with the original recursive
+    ones on a wide tree, a deep tree that still fits in the recursion limit,
+    and a tree far deeper than the recursion limit.
+    """
+    cases = [('wide: 1M leaves, fanout 1000',
+              lambda: synthetic_tree(10 ** 6, fanout=1000)),
+             ('deep: height 900, 200 leaves per level',
+              lambda: deep_tree(900, leaves_per_level=200)),
+             ('very deep: height 100000', lambda: deep_tree(100000))]
+    for label, build in cases:
+        tree = build()
+        print(label)
+        operations = [
+            ('update_rectangles',
+             lambda: _recursive_update_rectangles(tree, TREEMAP_RECT),
+             lambda: tree.update_rectangles(TREEMAP_RECT)),
+            ('expand_all', lambda: _recursive_expand_all(tree),
+             tree.expand_all),
+            ('get_rectangles', lambda: _recursive_get_rectangles(tree),
+             tree.get_rectangles),
+            ('update_data_sizes', lambda: _recursive_update_data_sizes(tree),
+             tree.update_data_sizes)]
+        for name, recursive, iterative in operations:
+            try:
+                _report(name + ' (recursive)', time_call(recursive))
+            except RecursionError:
+                print('  {:<40} RecursionError'.format(name + ' (recursive)'))
+            _report(name + ' (iterative)', time_call(iterative))
+
+
+def bench_memory() -> None:
+    """Report the bytes allocated per node, measured with tracemalloc, for
+    the slotted TMTree and for the original __dict__-based node layout.
+    """
+    n_leaves = 200000
+    for label, node_class in [('__dict__ nodes (original)', _DictTree),
+                              ('slotted TMTree', _BenchTree)]:
+        tracemalloc.start()
+        rng = random.Random(0)
+        level = [node_class('f{}'.format(i), [], rng.randint(1, 10000))
+                 for i in range(n_leaves)]
+        count = len(level)
+        while len(level) > 1:
+            level = [node_class('d', level[i:i + 10])
+                     for i in range(0, len(level), 10)]
+            count += len(level)
+        for node in _walk_dict_tree(level[0]):
+            node.rect = (rng.randint(0, 800), rng.randint(0, 570),
+                         rng.randint(0, 800), rng.randint(0, 570))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('  {:<40} {:>10.1f} bytes/node ({} nodes)'.format(
+            label, size / count, count))
+
+
+def _walk_dict_tree(tree: object) -> List[object]:
+    """Return every node of <tree>, which may be a TMTree or a _DictTree.
+    """
+    result = [tree]
+    for node in result:
+        result.extend(node._subtrees)
+    return result
+
+
+def bench_array_store() -> None:
+    """Compare laying out and summing a 1M-leaf tree as TMTree objects and
+    as a NumPy ArrayTreeStore.
+    """
+    from array_store import ArrayTreeStore
+
+    tree = synthetic_tree(10 ** 6)
+    store = ArrayTreeStore(tree)
+    print('synthetic 1M leaves')
+    _report('update_data_sizes (TMTree)', time_call(tree.update_data_sizes))
+    _report('update_data_sizes (ArrayTreeStore)',
+            time_call(store.update_data_sizes))
+    _report('update_rectangles (TMTree)',
+            time_call(lambda: tree.update_rectangles(TREEMAP_RECT)))
+    _report('update_rectangles (ArrayTreeStore)',
+            time_call(lambda: store.update_rectangles(TREEMAP_RECT)))
+    assert store.view(int(store._dfs_order[-1])).rect == \
+        _last_leaf(tree).rect
+
+
+def bench_layout() -> None:
+    """Compare the slice-and-dice and squarified layouts by runtime, the mean
+    aspect ratio of the displayed leaves, and the number of leaves that have
+    data but are drawn less than a pixel wide or high.
+    """
+    cases = [('cs1_papers.csv', papers_tree),
+             ('skewed file system, 100k leaves',
+              lambda: skewed_tree(10 ** 5))]
+    for label, build in cases:
+        tree = build()
+        tree.expand_all()
+        print('{} (fully expanded)'.format(label))
+        for name, strategy in [('slice_and_dice_layout',
+                                slice_and_dice_layout),
+                               ('squarified_layout', squarified_layout)]:
+            tree.set_layout_strategy(strategy)
+            _report(name, time_call(
+                lambda: tree.update_rectangles(TREEMAP_RECT)))
+            ratios = []
+            hidden = 0
+            for rect in _displayed_rects(tree):
+                if rect[2] == 0 or rect[3] == 0:
+                    hidden += 1
+                else:
+                    ratios.append(max(rect[2] / rect[3], rect[3] / rect[2]))
+            print('  {:<40} mean aspect ratio {:.2f}, {} of {} leaves under '
+                  'a pixel'.format(name, sum(ratios) / len(ratios), hidden,
+                                   hidden + len(ratios)))
+
+
+def _displayed_rects(tree: TMTree) -> List[Tuple[int, int, int, int]]:
+    """Return the rect of every displayed leaf of <tree> that has data.
+    """
+    return [node.rect for node in _walk_dict_tree(tree)
+            if not node._expanded and node.data_size > 0]
+
+
+def bench_rectangles() -> None:
+    """Compare the peak memory and time of collecting the displayed
+    rectangles with the original recursive get_rectangles, the list returned
+    by get_rectangles, and streaming them with iter_rectangles the way
+    render_display does.
+    """
+    cases = [('deep: height 900, 200 leaves per level',
+              lambda: deep_tree(900, leaves_per_level=200)),
+             ('wide: 1M leaves, fanout 10', lambda: synthetic_tree(10 ** 6))]
+    for label, build in cases:
+        tree = build()
+        tree.expand_all()
+        tree.update_rectangles(TREEMAP_RECT)
+        print('{} (fully expanded)'.format(label))
+        assert _recursive_get_rectangles(tree) == tree.get_rectangles()
+        for name, function in [
+                ('recursive get_rectangles',
+                 lambda: _recursive_get_rectangles(tree)),
+                ('get_rectangles', tree.get_rectangles),
+                ('iter_rectangles', lambda: _consume(tree.iter_rectangles()))]:
+            _report(name, time_call(function))
+            print('  {:<40} {:>10.1f} MiB peak'.format(
+                name, _peak_memory(function) / 2 ** 20))
+
+
+def bench_frontier() -> None:
+    """Compare a frame's worth of get_rectangles calls that walk the
+    displayed-tree with ones that read the cached frontier, and time the
+    expand and collapse calls that keep the frontier up to date.
+    """
+    cases = [('cs1_papers.csv (fully expanded)', papers_tree, True),
+             ('synthetic 1M leaves (fully expanded)',
+              lambda: synthetic_tree(10 ** 6), True),
+             ('synthetic 1M leaves (top 3 levels expanded)',
+              lambda: synthetic_tree(10 ** 6), False)]
+    for label, build, expand_all in cases:
+        tree = build()
+        if expand_all:
+            tree.expand_all()
+        else:
+            for node in _walk_dict_tree(tree)[:111]:
+                node.expand()
+        tree.update_rectangles(TREEMAP_RECT)
+        print(label)
+        _report('get_rectangles (original, walks tree)',
+                time_call(lambda: _recursive_get_rectangles(tree)))
+        tree.get_rectangles()
+        _report('get_rectangles (cached frontier)',
+                time_call(tree.get_rectangles))
+        node = _last_leaf(tree)._parent_tree
+        _report('collapse (patch frontier)',
+                time_call(node._subtrees[0].collapse))
+        _report('expand (patch frontier)', time_call(node.expand))
+        leaves = [leaf for leaf in node._subtrees if leaf._subtrees == []]
+        destination = tree._subtrees[0]
+        while destination._subtrees[-1]._subtrees != []:
+            destination = destination._subtrees[-1]
+        _report('move (patch frontier)',
+                time_call(lambda: [leaf.move(destination) for leaf in leaves]),
+                len(leaves))
+        _report('get_rectangles after the moves',
+                time_call(tree.get_rectangles))
+
+
+def bench_batch() -> None:
+    """Compare applying a large edit set one operation at a time, with a
+    relayout after each as the visualiser does, with a single apply_batch.
+    """
+    print('synthetic 1M leaves, fanout 1000: 2000 change_size, 1000 move')
+    results = []
+    for label in ('one at a time', 'apply_batch'):
+        tree = synthetic_tree(10 ** 6, fanout=1000)
+        tree.update_rectangles(TREEMAP_RECT)
+        rng = random.Random(0)
+        leaves = [leaf for node in tree._subtrees[:20]
+                  for leaf in node._subtrees]
+        archive = tree._subtrees[-1]
+        operations = [('change_size', leaf, -0.5)
+                      for leaf in rng.sample(leaves, 2000)]
+        operations += [('move', leaf, archive)
+                       for leaf in rng.sample(leaves, 1000)]
+        rng.shuffle(operations)
+
+        def one_at_a_time() -> None:
+            for operation, leaf, argument in operations:
+                if operation == 'change_size':
+                    leaf.change_size(argument)
+                else:
+                    leaf.move(argument)
+                tree.update_dirty_rectangles(TREEMAP_RECT)
+
+        if label == 'apply_batch':
+            _report(label, time_call(lambda: tree.apply_batch(operations)))
+        else:
+            _report(label, time_call(one_at_a_time), len(operations))
+        results.append(tree.get_rectangles())
+    assert [rect for rect, _ in results[0]] == \
+        [rect for rect, _ in results[1]]
+
+
+def bench_paths() -> None:
+    """Compare exporting the path string of every tree with the original
+    recursive get_path_string and with the cached one.
+    """
+    cases = [('cs1_papers.csv', papers_tree),
+             ('deep: height 900, 20 leaves per level',
+              lambda: deep_tree(900, leaves_per_level=20)),
+             ('wide: 100k leaves, fanout 10', lambda: synthetic_tree(10 ** 5))]
+    for label, build in cases:
+        tree = build()
+        nodes = _walk_dict_tree(tree)
+        print('{} ({} trees)'.format(label, len(nodes)))
+        _report('recursive get_path_string',
+                time_call(lambda: [_recursive_get_path_string(node)
+                               for node in nodes]), len(nodes))
+        _report('cached get_path_string (first export)',
+                time_call(lambda: [node.get_path_string() for node in nodes]),
+                len(nodes))
+        _report('cached get_path_string (again)',
+                time_call(lambda: [node.get_path_string() for node in nodes]),
+                len(nodes))
+        for node in nodes[-1000:]:
+            assert node.get_path_string() == _recursive_get_path_string(node)
+
+
+def bench_construction() -> None:
+    """Compare the number of trees created per second when each picks a
+    random colour in its constructor and when colours are computed lazily,
+    and time computing the colours of every displayed leaf afterwards.
+    """
+    n_leaves = 10 ** 6
+    print('synthetic {} leaves, fanout 10'.format(n_leaves))
+    for label, node_class in [('randint colours (original)', _RandintTree),
+                              ('lazy colours', _BenchTree)]:
+        start = time.perf_counter()
+        level = [node_class('f{}'.format(i), [], i % 1000 + 1)
+                 for i in range(n_leaves)]
+        count = len(level)
+        while len(level) > 1:
+            level = [node_class('d', level[i:i + 10])
+                     for i in range(0, len(level), 10)]
+            count += len(level)
+        seconds = time.perf_counter() - start
+        print('  {:<40} {:>10.0f} trees/s'.format(label, count / seconds))
+    tree = level[0]
+    tree.expand_all()
+    _report('first get_rectangles (computes colours)',
+            time_call(tree.get_rectangles))
+    _report('get_rectangles', time_call(tree.get_rectangles))
+
+
+def bench_instrumentation() -> None:
+    """Compare the cost of the instrumented operations with instrumentation
+    disabled and enabled against calling the undecorated methods directly.
+    """
+    tree = papers_tree()
+    tree.expand_all()
+    tree.update_rectangles(TREEMAP_RECT)
+    rng = random.Random(1)
+    points = [(rng.randint(0, TREEMAP_RECT[2]),
+               rng.randint(0, TREEMAP_RECT[3])) for _ in range(20000)]
+    hit_test = TMTree.get_tree_at_position.__wrapped__
+    print('cs1_papers.csv (fully expanded), {} hit tests'.format(len(points)))
+    _report('undecorated get_tree_at_position',
+            time_call(lambda: [hit_test(tree, pos) for pos in points]),
+            len(points))
+    _report('instrumentation disabled',
+            time_call(lambda: [tree.get_tree_at_position(pos)
+                               for pos in points]),
+            len(points))
+    instrumentation.enable()
+    try:
+        _report('instrumentation enabled',
+                time_call(lambda: [tree.get_tree_at_position(pos)
+                               for pos in points]), len(points))
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+
+
+def bench_scan() -> None:
+    """Compare the number of entries per second scanned by the original
+    os.listdir FileSystemTree constructor and the os.scandir one, on a
+    generated directory.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        print('generated directory, {} files'.format(n_files))
+        for label, build in [('os.listdir (original)', _ListdirFileSystemTree),
+                             ('os.scandir', FileSystemTree)]:
+            holder = []
+            seconds = min(time_call(lambda: holder.append(build(root)))
+                          for _ in range(3))
+            entries = len(_walk_dict_tree(holder[0]))
+            print('  {:<40} {:>10.0f} entries/s'.format(label,
+                                                       entries / seconds))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_scan_parallel() -> None:
+    """Compare the number of entries per second scanned with 1 to 16
+    workers on a generated directory, as reported by ScanStats.
+
+    The directory is in the page cache after the first scan, so this
+    measures the overhead of the workers more than the speedup on a slow or
+    network file system, where listing a folder mostly waits.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        print('generated directory, {} files'.format(n_files))
+        for workers in [1, 2, 4, 8, 16]:
+            options = ScanOptions(workers=workers)
+            best = max(scan(root, options).stats.entries_per_second()
+                       for _ in range(3))
+            print('  {:>2} workers {:>30.0f} entries/s'.format(workers, best))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_lazy_scan() -> None:
+    """Compare the time until a FileSystemTree can be drawn when it is
+    scanned all at once and when it is scanned lazily, on a generated
+    directory, and the time the lazy tree's background scan takes to find
+    every folder size.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        print('generated directory, {} files'.format(n_files))
+        for label, lazy in [('scanned all at once', False), ('lazy', True)]:
+            start = time.perf_counter()
+            tree = FileSystemTree(root, lazy=lazy)
+            tree.update_rectangles(TREEMAP_RECT)
+            list(tree.iter_rectangles())
+            first_frame = time.perf_counter() - start
+            tree.refresh_sizes(block=True)
+            print('  {:<26} first frame {:>9.4f} s, all sizes {:>9.4f} s'
+                  .format(label, first_frame,
+                          time.perf_counter() - start))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_stream_scan() -> None:
+    """Time the frames of a streamed FileSystemTree over a generated
+    directory, run the way the visualiser's event loop runs them, until the
+    background scan has listed every folder.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        print('generated directory, {} files'.format(n_files))
+        start = time.perf_counter()
+        tree = FileSystemTree(root, stream=True)
+        tree.update_rectangles(TREEMAP_RECT)
+        tree.expand()
+        list(tree.iter_rectangles())
+        first_frame = time.perf_counter() - start
+        frames, longest, last_layout = 0, 0.0, start
+        while tree.get_scan_progress():
+            frame_start = time.perf_counter()
+            tree.refresh_sizes(max_seconds=0.02)
+            if frame_start - last_layout >= 0.25:
+                tree.update_dirty_rectangles(TREEMAP_RECT)
+                last_layout = frame_start
+            list(tree.iter_rectangles())
+            frames += 1
+            longest = max(longest, time.perf_counter() - frame_start)
+        tree.update_dirty_rectangles(TREEMAP_RECT)
+        print('  first frame {:.4f} s, {} frames in {:.4f} s, longest frame '
+              '{:.4f} s'.format(first_frame, frames,
+                                time.perf_counter() - start, longest))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_pruning() -> None:
+    """Compare the number of trees, the time to build and lay out, and the
+    time to find the rectangles of a FileSystemTree of a generated
+    directory, scanned in full and pruned with each of the scan options.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        print('generated directory, {} files'.format(n_files))
+        for label, options in [
+                ('full', ScanOptions()),
+                ("exclude 'file1*'", ScanOptions(exclude=('file1*',))),
+                ('max_depth 2', ScanOptions(max_depth=2)),
+                ('min_size 50000', ScanOptions(min_size=50000)),
+                ('max_files 2', ScanOptions(max_files=2))]:
+            start = time.perf_counter()
+            tree = FileSystemTree(root, options)
+            tree.update_rectangles(TREEMAP_RECT)
+            build_time = time.perf_counter() - start
+            tree.expand_all()
+            start = time.perf_counter()
+            tree.get_rectangles()
+            print('  {:<18} {:>7} trees, size {:>11}, build {:>7.4f} s, '
+                  'rectangles {:>7.4f} s'.format(
+                      label, _tree_count(tree), tree.data_size,
+                      build_time, time.perf_counter() - start))
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_watch() -> None:
+    """Time applying the changes a FileSystemWatcher records to an expanded
+    FileSystemTree, and laying it out, for a file that is added and for a
+    folder of many files that is removed, compared with scanning the folder
+    before the changes.
+    """
+    n_files = 100000
+    root = tempfile.mkdtemp()
+    try:
+        for folder, count in [('kept', 1000), ('removed', n_files)]:
+            os.mkdir(os.path.join(root, folder))
+            make_directory(os.path.join(root, folder), count)
+        start = time.perf_counter()
+        tree = FileSystemTree(root)
+        tree.update_rectangles(TREEMAP_RECT)
+        scan_time = time.perf_counter() - start
+        tree.expand_all()
+        start = time.perf_counter()
+        watcher = FileSystemWatcher(root)
+        watcher.wait_started()
+        watch_time = time.perf_counter() - start
+        print('generated directory, {} files, watched with {}'.format(
+            n_files + 1000, watcher.method))
+        print('  {:<26} {:>13} {:>9.4f} s'.format('scan', '', scan_time))
+        print('  {:<26} {:>13} {:>9.4f} s'.format('start watching', '',
+                                                  watch_time))
+        changes = [('add one file',
+                    lambda: _add_file(os.path.join(root, 'kept'))),
+                   ('remove {} files'.format(n_files), lambda: shutil.rmtree(
+                       os.path.join(root, 'removed')))]
+        for label, change in changes:
+            change()
+            time.sleep(1)
+            start = time.perf_counter()
+            batch = watcher.take_changes()
+            tree.apply_changes(batch)
+            tree.update_dirty_rectangles(TREEMAP_RECT)
+            print('  {:<26} {:>7} paths {:>9.4f} s'.format(
+                label, len(batch.changed), time.perf_counter() - start))
+        watcher.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_scan_cache() -> None:
+    """Compare a full scan of a generated directory with incremental
+    rescans through a ScanCache, when nothing changed and when one folder
+    changed.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    cache = ScanCache(os.path.join(tempfile.mkdtemp(), 'scan.cache'))
+    try:
+        make_directory(root, n_files)
+        # Age the folders, so that the cache trusts their modification
+        # times.
+        for folder, _, _ in os.walk(root):
+            os.utime(folder, (1000000000, 1000000000))
+        print('generated directory, {} files'.format(n_files))
+        results = []
+        for label, run in [('full scan', lambda: scan(root)),
+                           ('first scan into the cache',
+                            lambda: cache.scan(root)),
+                           ('rescan, nothing changed',
+                            lambda: cache.scan(root)),
+                           ('rescan, one new file',
+                            lambda: (_add_file(root), cache.scan(root)))]:
+            start = time.perf_counter()
+            results.append(run())
+            print('  {:<34} {:>10.4f} s'.format(label,
+                                                time.perf_counter() - start))
+        print('  folders reused by the last rescan: {}'.format(
+            results[-1][1].stats.reused))
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(os.path.dirname(cache.path))
+
+
+def _add_file(root: str) -> None:
+    """Add a file to the first folder under <root>.
+    """
+    with open(os.path.join(root, 'dir0', 'new_file.txt'), 'w') as f:
+        f.write('new')
+
+
+def bench_snapshot() -> None:
+    """Compare building the paper tree from the CSV file, and a
+    FileSystemTree by scanning a generated directory, with loading each of
+    them from a snapshot, until the first frame can be drawn and until
+    every tree has been created.
+    """
+    n_files = 50000
+    root = tempfile.mkdtemp()
+    snapshots = tempfile.mkdtemp()
+    try:
+        make_directory(root, n_files)
+        for label, build in [('papers', papers_tree),
+                             ('file system, {} files'.format(n_files),
+                              lambda: FileSystemTree(root))]:
+            path = os.path.join(snapshots, 'tree.snapshot')
+            start = time.perf_counter()
+            tree = build()
+            built = time.perf_counter() - start
+            tree.update_rectangles(TREEMAP_RECT)
+            tree.save_snapshot(path)
+            print('{}: snapshot of {} bytes'.format(label,
+                                                   os.path.getsize(path)))
+            print('  {:<36} {:>10.4f} s'.format('build', built))
+
+            start = time.perf_counter()
+            loaded = TMTree.load_snapshot(path)
+            loaded.update_dirty_rectangles(TREEMAP_RECT)
+            _consume(loaded.iter_rectangles())
+            print('  {:<36} {:>10.4f} s'.format('load until the first frame',
+                                                time.perf_counter() - start))
+            loaded._list_subtrees(recursive=True)
+            print('  {:<36} {:>10.4f} s'.format('load every tree',
+                                                time.perf_counter() - start))
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(snapshots)
+
+
+def _consume(rectangles: Iterator[object]) -> None:
+    """Read every item of <rectangles> without keeping any of them.
+    """
+    for _ in rectangles:
+        pass
+
+
+def bench_paper_loading() -> None:
+    """Report the time and peak memory of building the trees of a large
+    papers dataset one row at a time, with and without years.
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'papers.csv')
+        print('{} rows'.format(replicate_papers(papers.DATA_FILE, path,
+                                                 100)))
+        for by_year in (False, True):
+            def load() -> None:
+                papers._load_papers(path, by_year)
+            print('  {:<44} {:>8.3f} s {:>8.1f} MB peak'.format(
+                'one row at a time{}'.format(', by year' if by_year else ''),
+                time_call(load), _peak_memory(load) / 10 ** 6))
+    finally:
+        shutil.rmtree(folder)
+
+
+def bench_paper_cache() -> None:
+    """Compare the time until the first frame of the paper tree can be
+    drawn when the dataset is read, when it is read and the tree saved in a
+    cache, and when the tree is loaded from the cache.
+    """
+    folder = tempfile.mkdtemp()
+    old_data_file = papers.DATA_FILE
+    try:
+        for copies in (1, 100):
+            papers.DATA_FILE = os.path.join(folder, 'papers.csv')
+            cache = os.path.join(folder, 'papers.cache')
+            print('{} rows'.format(replicate_papers(
+                old_data_file, papers.DATA_FILE, copies)))
+            for label, use_cache in [('no cache (original)', None),
+                                     ('first run, saves the cache', cache),
+                                     ('cached', cache)]:
+                start = time.perf_counter()
+                tree = PaperTree('CS1', [], all_papers=True, by_year=False,
+                                 cache=use_cache)
+                tree.update_rectangles(TREEMAP_RECT)
+                _consume(tree.iter_rectangles())
+                print('  {:<36} {:>10.4f} s'.format(
+                    label, time.perf_counter() - start))
+            os.remove(cache)
+    finally:
+        papers.DATA_FILE = old_data_file
+        shutil.rmtree(folder)
+
+
+def bench_paper_groupings() -> None:
+    """Compare switching the paper tree between groupings by reading the
+    dataset again, as PaperTree does, with regrouping the papers of a
+    PaperDataset read once.
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'papers.csv')
+        print('{} rows'.format(replicate_papers(papers.DATA_FILE, path,
+                                                 2000)))
+        for by_year in (True, False):
+            print('  {:<40} {:>10.4f} s'.format(
+                'read PaperTree, by_year={} (original)'.format(by_year),
+                time_call(lambda: papers._load_papers(path, by_year))))
+        holder = []
+        print('  {:<40} {:>10.4f} s'.format(
+            'read PaperDataset',
+            time_call(lambda: holder.append(papers.PaperDataset(path)))))
+        for grouping in papers.GROUPINGS:
+            print('  {:<40} {:>10.4f} s'.format(
+                'regroup by ' + ', '.join(grouping),
+                time_call(lambda: holder[0].build(grouping))))
+    finally:
+        shutil.rmtree(folder)
+
+
+def replicate_papers(source: str, path: str, copies: int) -> int:
+    """Write the papers of the dataset file <source> to a new dataset file
+    at <path>, each repeated <copies> times under a new title, and return the
+    number of papers written.
+    """
+    with open(source, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(rows[0])
+        for i in range(copies):
+            for row in rows[1:]:
+                writer.writerow([row[0], '{} ({})'.format(row[1], i)] +
+                                row[2:])
+    return copies * (len(rows) - 1)
+
+
+def _tree_count(tree: TMTree) -> int:
+    """Return the number of trees in <tree>, including itself.
+    """
+    count = 0
+    stack = [tree]
+    while stack:
+        current = stack.pop()
+        count += 1
+        stack.extend(current._subtrees)
+    return count
+
+
+def _last_leaf(tree: TMTree) -> TMTree:
+    """Return the last leaf of <tree> in preorder.
+    """
+    while tree._subtrees != []:
+        tree = tree._subtrees[-1]
+    return tree
+
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    'point_location': bench_point_location,
+    'traversal': bench_traversal,
+    'memory': bench_memory,
+    'array_store': bench_array_store,
+    'layout': bench_layout,
+    'rectangles': bench_rectangles,
+    'frontier': bench_frontier,
+    'batch': bench_batch,
+    'paths': bench_paths,
+    'construction': bench_construction,
+    'instrumentation': bench_instrumentation,
+    'scan': bench_scan,
+    'scan_parallel': bench_scan_parallel,
+    'lazy_scan': bench_lazy_scan,
+    'stream_scan': bench_stream_scan,
+    'scan_cache': bench_scan_cache,
+    'pruning': bench_pruning,
+    'watch': bench_watch,
+    'snapshot': bench_snapshot,
+    'paper_loading': bench_paper_loading,
+    'paper_cache': bench_paper_cache,
+    'paper_groupings': bench_paper_groupings,
+}
+
+
+def main(names: List[str]) -> None:
+    """Run the benchmarks called <names>, or all of them if <names> is empty.
+    """
+    for name in names or list(BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
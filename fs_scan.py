@@ -0,0 +1,1072 @@
+"""Assignment 2: Scanning the file system for FileSystemTree
+
+=== Module Description ===
+This module contains the scanner FileSystemTree uses to find the files and
+folders under a path. It lists each folder once with os.scandir, and makes
+at most one stat call per entry, reusing the file type that os.scandir
+already reports.
+
+Symbolic links are handled according to ScanOptions.symlinks:
+    'follow': a link is scanned as what it points to, so a link to a folder
+              is scanned as a folder, unless that folder contains the link.
+              Such a link would make the scan loop forever, so it is
+              scanned as a file instead.
+    'file':   every link is scanned as a file, with the size of the link.
+    'skip':   links are left out of the scan.
+The default, 'follow', gives the same tree as listing every folder with
+os.listdir and os.path.isdir.
+
+A scan can also be pruned, to bound the number of entries it finds:
+entries whose name matches one of ScanOptions.exclude are left out, the
+small files of each folder can be folded into one '(N small files)' entry,
+and folders below ScanOptions.max_depth are not listed, but given the total
+size of everything under them. Pruning never changes the total size of a
+folder, except by leaving out the excluded entries.
+
+With ScanOptions.workers above 1, folders are listed on that many threads
+at once. Listing folders and reading file sizes release the GIL and, on
+network storage, spend most of their time waiting, so this speeds up scans
+of slow file systems. The tree is still assembled in the order of a scan
+with one worker, so the result does not depend on the number of workers.
+
+A scan can also stop at a given depth, leaving the folders below it
+pending. scan_pending lists a pending folder later, FolderSizes finds the
+total size of pending folders on a background thread, and StreamingScan
+lists them on a background thread, publishing each folder as it goes.
+FileSystemTree uses these to list folders only when they are needed, or to
+be drawn while it is still being scanned.
+
+scan_incremental rescans a path using the result of an earlier scan,
+listing only the folders whose modification time changed, and ScanCache
+keeps that earlier result in a snapshot file, in the format of the
+snapshot module, between runs. check_entry finds how a
+scan would see a single path, for applying the changes a watcher reports.
+"""
+from __future__ import annotations
+import fnmatch
+import os
+import queue
+import re
+import stat
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Pattern, Tuple
+from snapshot import SnapshotReader, SnapshotWriter
+
+# The values ScanOptions.symlinks can take.
+SYMLINK_POLICIES = ('follow', 'file', 'skip')
+
+# The (device, inode) of a folder, followed by the chain of its parent
+# folder, or None for the folder the scan started at. Used to find symbolic
+# links that point to a folder containing them.
+_Chain = Optional[Tuple[Tuple[int, int], object]]
+# The entries of a folder, as (name, size, path, chain) where path and chain
+# are None for entries scanned as files, and the size of the folder itself
+# if it has no entries.
+_Listing = Tuple[List[Tuple[str, int, Optional[str], _Chain]], int]
+# Folders modified less than this many nanoseconds before a scan started
+# are listed again by the next incremental scan, since a change made in the
+# same tick of the file system's clock would not change their modification
+# time.
+_RECENT_NS = 2 * 10 ** 9
+# The version of the results ScanCache saves. Change it whenever they
+# change, so that older caches are not used.
+_CACHE_VERSION = 2
+# The class name ScanCache saves its snapshots with.
+_CACHE_CLASS = 'fs_scan:ScanResult'
+# A folder that has not been listed: its path and its chain.
+PendingFolder = Tuple[str, _Chain]
+# The name of the entry the small files of a folder are folded into.
+SMALL_FILES = '({} small files)'
+
+
+class ScanOptions:
+    """Settings for a scan of the file system.
+
+    === Public Attributes ===
+    symlinks:
+        How symbolic links are scanned: 'follow', 'file' or 'skip'.
+    workers:
+        The number of threads that list folders at once. With more than
+        one, folders are listed in parallel, but the result is the same as
+        with one.
+    exclude:
+        Glob patterns, as used by fnmatch. Files and folders whose name
+        matches one of them are left out of the scan.
+    max_depth:
+        The number of levels of folders below the scanned folder that are
+        listed, or None to list every folder. The folders at this depth are
+        left pending, with the total size of everything under them.
+    min_size:
+        Files smaller than this many bytes are folded into the small files
+        entry of their folder.
+    max_files:
+        The number of files of each folder, largest first, that are kept
+        as their own entries, or None to keep them all. The others are
+        folded into the small files entry of their folder.
+
+    === Private Attributes ===
+    _excluded:
+        A regular expression matching the names matched by one of the
+        patterns in exclude, or None if there are none.
+
+    === Representation Invariants ===
+    - symlinks in SYMLINK_POLICIES
+    - workers >= 1
+    - max_depth is None or max_depth >= 1
+    - min_size >= 0
+    - max_files is None or max_files >= 0
+    """
+    symlinks: str
+    workers: int
+    exclude: Tuple[str, ...]
+    max_depth: Optional[int]
+    min_size: int
+    max_files: Optional[int]
+    _excluded: Optional[Pattern]
+
+    def __init__(self, symlinks: str = 'follow', workers: int = 1,
+                 exclude: Tuple[str, ...] = (),
+                 max_depth: Optional[int] = None, min_size: int = 0,
+                 max_files: Optional[int] = None) -> None:
+        """Initialize the settings for a scan.
+        """
+        if symlinks not in SYMLINK_POLICIES:
+            raise ValueError('Unknown symlink policy: {}'.format(symlinks))
+        if workers < 1:
+            raise ValueError('A scan needs at least one worker')
+        if max_depth is not None and max_depth < 1:
+            raise ValueError('A scan must list at least one level')
+        if min_size < 0 or max_files is not None and max_files < 0:
+            raise ValueError('Thresholds for small files cannot be negative')
+        self.symlinks = symlinks
+        self.workers = workers
+        self.exclude = tuple(exclude)
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_files = max_files
+        self._excluded = None
+        if self.exclude != ():
+            flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+            self._excluded = re.compile(
+                '|'.join(fnmatch.translate(pattern)
+                         for pattern in self.exclude), flags)
+
+    def is_excluded(self, name: str) -> bool:
+        """Return whether a file or folder called <name> is left out of the
+        scan.
+        """
+        return self._excluded is not None and \
+            self._excluded.match(name) is not None
+
+    def below(self, depth: int) -> Optional[ScanOptions]:
+        """Return these options for a scan of a folder <depth> levels below
+        the folder scanned with them, or None if that folder is below
+        self.max_depth, and is not listed.
+        """
+        if self.max_depth is None:
+            return self
+        if depth >= self.max_depth:
+            return None
+        return ScanOptions(self.symlinks, self.workers, self.exclude,
+                           self.max_depth - depth, self.min_size,
+                           self.max_files)
+
+    def folds_files(self) -> bool:
+        """Return whether small files are folded together.
+        """
+        return self.min_size > 0 or self.max_files is not None
+
+
+class ScanStats:
+    """How long a scan took.
+
+    === Public Attributes ===
+    entries:
+        The number of files and folders scanned, including the one that was
+        scanned.
+    workers:
+        The number of threads that listed folders.
+    seconds:
+        The wall time the scan took.
+    reused:
+        The number of folders whose entries were reused from an earlier
+        scan instead of being listed.
+    """
+    entries: int
+    workers: int
+    seconds: float
+    reused: int
+
+    def __init__(self, entries: int, workers: int, seconds: float,
+                 reused: int = 0) -> None:
+        """Initialize the stats of a scan.
+        """
+        self.entries = entries
+        self.workers = workers
+        self.seconds = seconds
+        self.reused = reused
+
+    def entries_per_second(self) -> float:
+        """Return the number of entries scanned per second.
+        """
+        if self.seconds == 0:
+            return float('inf')
+        return self.entries / self.seconds
+
+
+class ScanResult:
+    """The files and folders found by a scan, in breadth-first order.
+
+    Entry 0 is the path that was scanned. The entries in a folder are
+    consecutive, in the order os.scandir listed them.
+
+    === Public Attributes ===
+    names:
+        The name of each entry.
+    sizes:
+        The size of each entry in bytes. The size of a folder is only used
+        when it is empty.
+    first_child:
+        The index of the first entry in each folder, or 0 for a file.
+    child_count:
+        The number of entries in each folder, or 0 for a file.
+    mtimes:
+        The modification time of each folder in nanoseconds, as recorded by
+        scan_incremental, or 0 if it was modified too close to the scan to
+        be trusted. -1 for files, and for every entry of other scans.
+    pending:
+        The folders that were not listed because the scan stopped above
+        them, by index. Their size is the size of the folder itself, as a
+        rough estimate of the size of its contents, or, if they are below
+        ScanOptions.max_depth, the total size of everything under them.
+    stats:
+        How long the scan took.
+    """
+    names: List[str]
+    sizes: List[int]
+    first_child: List[int]
+    child_count: List[int]
+    mtimes: List[int]
+    pending: Dict[int, PendingFolder]
+    stats: Optional[ScanStats]
+
+    def __init__(self) -> None:
+        """Initialize a result with no entries.
+        """
+        self.names = []
+        self.sizes = []
+        self.first_child = []
+        self.child_count = []
+        self.mtimes = []
+        self.pending = {}
+        self.stats = None
+
+    def add(self, name: str, size: int) -> int:
+        """Add an entry called <name> of size <size>, with no entries of its
+        own yet, and return its index.
+        """
+        self.names.append(name)
+        self.sizes.append(size)
+        self.first_child.append(0)
+        self.child_count.append(0)
+        self.mtimes.append(-1)
+        return len(self.names) - 1
+
+    def folder_totals(self, path: str) -> Dict[str, int]:
+        """Return the total size of the files in each folder that has
+        entries, by its path, where <path> is the path of entry 0.
+
+        An empty folder counts its own size, as FileSystemTree does.
+        """
+        first_child = self.first_child
+        child_count = self.child_count
+        totals = self.sizes[:]
+        for i in range(len(totals) - 1, -1, -1):
+            if child_count[i] > 0:
+                first = first_child[i]
+                totals[i] = sum(totals[first:first + child_count[i]])
+        paths = {0: path}
+        result = {}
+        for i in range(len(totals)):
+            if child_count[i] > 0:
+                folder = paths.pop(i)
+                result[folder] = totals[i]
+                for child in range(first_child[i],
+                                   first_child[i] + child_count[i]):
+                    if child_count[child] > 0:
+                        paths[child] = os.path.join(folder,
+                                                    self.names[child])
+        return result
+
+
+def scan(path: str, options: Optional[ScanOptions] = None,
+         depth: Optional[int] = None) -> ScanResult:
+    """Return the files and folders in the file or folder at <path>.
+
+    If <depth> is not None, only list folders fewer than <depth> levels
+    below <path>, so that 1 lists <path> itself only. The folders that are
+    not listed are left pending in the result. A scan with a depth is never
+    split between workers.
+
+    Folders that cannot be listed are scanned as empty folders.
+
+    Precondition: <path> is a valid path for this computer.
+    """
+    root_stat = os.stat(path)
+    if not stat.S_ISDIR(root_stat.st_mode):
+        result = ScanResult()
+        result.add(os.path.basename(path), root_stat.st_size)
+        result.stats = ScanStats(1, 1, 0.0)
+        return result
+    chain = ((root_stat.st_dev, root_stat.st_ino), None)
+    return _scan_from(path, chain, root_stat.st_size, options, depth)
+
+
+def scan_pending(folder: PendingFolder, options: Optional[ScanOptions] = None,
+                 depth: Optional[int] = None) -> ScanResult:
+    """Return the files and folders in <folder>, a pending folder of an
+    earlier scan with the same <options>, as scan does.
+    """
+    return _scan_from(folder[0], folder[1], _path_size(folder[0]), options,
+                      depth)
+
+
+def check_entry(path: str, root: str, options: Optional[ScanOptions] = None
+                ) -> Optional[Tuple[int, Optional[PendingFolder]]]:
+    """Return how a scan of the folder at <root> with <options> would see
+    the file or folder at <path>, which is <root> or under it: as (size,
+    folder), where folder is None if <path> is scanned as a file, or the
+    pending folder to list with scan_pending if it is scanned as a folder.
+
+    Return None if there is nothing at <path>, or if the scan would leave
+    it out.
+    """
+    if options is None:
+        options = ScanOptions()
+    is_root = os.path.normpath(path) == os.path.normpath(root)
+    if not is_root and options.is_excluded(os.path.basename(path)):
+        return None
+    try:
+        link_stat = os.lstat(path)
+    except OSError:
+        return None
+    target = link_stat
+    is_link = stat.S_ISLNK(link_stat.st_mode)
+    if is_link and options.symlinks == 'skip':
+        return None
+    elif is_link and options.symlinks == 'follow':
+        try:
+            target = os.stat(path)
+        except OSError:
+            return (link_stat.st_size, None)
+    if not stat.S_ISDIR(target.st_mode):
+        return (target.st_size, None)
+
+    # Like scan, start the chain of <root> itself from nothing.
+    chain = None if is_root else _chain_of(os.path.dirname(path), root)
+    key = (target.st_dev, target.st_ino)
+    ancestor = chain
+    while ancestor is not None:
+        if ancestor[0] == key:
+            return (link_stat.st_size, None)
+        ancestor = ancestor[1]
+    return (target.st_size, (path, (key, chain)))
+
+
+def folder_total(folder: PendingFolder,
+                 options: Optional[ScanOptions] = None) -> int:
+    """Return the total size of everything under <folder>, a pending folder
+    of an earlier scan with <options>, as a FileSystemTree of it would find
+    it, without keeping its entries.
+    """
+    if options is None:
+        options = ScanOptions()
+    return _total_size(folder[0], folder[1],
+                       lambda path, chain: _scan_folder(path, chain, options))
+
+
+def scan_incremental(path: str, previous: Optional[ScanResult],
+                     options: Optional[ScanOptions] = None) -> ScanResult:
+    """Return the files and folders in the file or folder at <path>, as scan
+    does, reusing the entries of every folder in <previous>, an earlier
+    result of scan_incremental for <path> with the same <options>, whose
+    modification time has not changed since.
+
+    Every folder is still checked with one stat call, but only the folders
+    whose modification time changed are listed. A folder's modification
+    time changes when an entry is added to it, removed from it or renamed,
+    but not when a file in it is rewritten, so a file whose size changed
+    keeps its old size until its folder changes.
+
+    The folders are listed by one worker. If <previous> is None, every
+    folder is listed.
+
+    Precondition: <path> is a valid path for this computer.
+    Precondition: options.max_depth is None
+    """
+    if options is None:
+        options = ScanOptions()
+    start = time.perf_counter()
+    recent = time.time_ns() - _RECENT_NS
+    result = ScanResult()
+    root_stat = os.stat(path)
+    result.add(os.path.basename(path), root_stat.st_size)
+    if previous is not None and previous.names[0] != result.names[0]:
+        previous = None
+    reused = 0
+    folders = []
+    if stat.S_ISDIR(root_stat.st_mode):
+        folders.append((0, path, None, 0 if previous is not None else None))
+    i = 0
+    while i < len(folders):
+        index, folder, parent_chain, old = folders[i]
+        i += 1
+        try:
+            folder_stat = os.stat(folder)
+        except OSError:
+            continue
+        chain = ((folder_stat.st_dev, folder_stat.st_ino), parent_chain)
+        mtime = folder_stat.st_mtime_ns
+        result.mtimes[index] = mtime if mtime < recent else 0
+        first = len(result.names)
+        if old is not None and previous.mtimes[old] == mtime:
+            reused += 1
+            old_first = previous.first_child[old]
+            for c in range(old_first, old_first + previous.child_count[old]):
+                child = result.add(previous.names[c], previous.sizes[c])
+                if previous.mtimes[c] >= 0:
+                    folders.append((child, os.path.join(folder,
+                                                        previous.names[c]),
+                                    chain, c))
+        else:
+            old_folders = {}
+            if old is not None:
+                old_first = previous.first_child[old]
+                for c in range(old_first,
+                               old_first + previous.child_count[old]):
+                    if previous.mtimes[c] >= 0:
+                        old_folders[previous.names[c]] = c
+            entries, own_size = _scan_folder(folder, chain, options)
+            for name, size, child_path, _ in entries:
+                child = result.add(name, size)
+                if child_path is not None:
+                    folders.append((child, child_path, chain,
+                                    old_folders.get(name)))
+            if entries == [] and index != 0:
+                result.sizes[index] = own_size
+        result.first_child[index] = first
+        result.child_count[index] = len(result.names) - first
+    result.stats = ScanStats(len(result.names), 1,
+                             time.perf_counter() - start, reused)
+    return result
+
+
+class ScanCache:
+    """A file that keeps the last result of scan_incremental for a path, so
+    that the next scan of that path only lists the folders that changed.
+
+    The result is saved as a snapshot, with a node per entry and the
+    modification time of each entry as its only field, and keyed by the
+    path and the settings it was scanned with.
+
+    === Public Attributes ===
+    path:
+        The path of the cache file.
+    """
+    path: str
+
+    def __init__(self, path: str) -> None:
+        """Initialize a cache kept in the file at <path>, which need not
+        exist yet.
+        """
+        self.path = path
+
+    def scan(self, path: str,
+             options: Optional[ScanOptions] = None) -> ScanResult:
+        """Return the files and folders in the file or folder at <path>, as
+        scan_incremental does with the result saved in this cache, and save
+        the new result in its place.
+        """
+        if options is None:
+            options = ScanOptions()
+        result = scan_incremental(path, self.load(path, options), options)
+        self.save(path, options, result)
+        return result
+
+    def load(self, path: str, options: ScanOptions) -> Optional[ScanResult]:
+        """Return the result saved in this cache, or None if there is none
+        for a scan of <path> with <options>, or it cannot be read.
+        """
+        try:
+            reader = SnapshotReader(self.path)
+            if reader.class_name != _CACHE_CLASS or \
+                    reader.fields_per_node != 1 or \
+                    reader.key != _cache_key(path, options):
+                return None
+            nodes, fields = reader.tables()
+            strings = reader.strings()
+            result = ScanResult()
+            result.sizes = nodes[0::3].tolist()
+            links = nodes[1::3]
+            result.first_child = [link & 0xFFFFFFFF for link in links]
+            result.child_count = [link >> 32 for link in links]
+            result.names = [strings[name & 0xFFFFFFFF]
+                            for name in nodes[2::3]]
+            result.mtimes = [int(strings[i]) for i in fields]
+            return result
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+
+    def save(self, path: str, options: ScanOptions,
+             result: ScanResult) -> None:
+        """Save <result>, a scan of <path> with <options>, in this cache.
+
+        The file is replaced in one step, so a scan that is interrupted
+        never leaves a partly written cache.
+        """
+        writer = SnapshotWriter(_CACHE_CLASS, 0, 1, False,
+                                _cache_key(path, options))
+        writer.add_nodes(result.names, result.sizes, result.first_child,
+                         result.child_count,
+                         [str(mtime) for mtime in result.mtimes])
+        temporary = self.path + '.tmp'
+        writer.write(temporary)
+        os.replace(temporary, self.path)
+
+
+def _cache_key(path: str, options: ScanOptions) -> str:
+    """Return the key ScanCache saves a scan of <path> with <options>
+    under.
+    """
+    return 'scan {} {!r} {!r} {}'.format(_CACHE_VERSION, options.symlinks,
+                                          _pruning(options),
+                                          os.path.abspath(path))
+
+
+def _scan_from(path: str, chain: _Chain, size: int,
+               options: Optional[ScanOptions],
+               depth: Optional[int]) -> ScanResult:
+    """Return the files and folders in the folder at <path>, of size <size>,
+    whose chain is <chain>, as scan does.
+    """
+    if options is None:
+        options = ScanOptions()
+    start = time.perf_counter()
+    result = ScanResult()
+    result.add(os.path.basename(path), size)
+    if depth is not None:
+        _assemble(result, path, chain,
+                  lambda folder, chain: _scan_folder(folder, chain, options),
+                  depth)
+        workers = 1
+    elif options.workers > 1:
+        listings = _ParallelScan(options).run(path, chain)
+        _assemble(result, path, chain, lambda folder, _: listings[folder],
+                  max_depth=options.max_depth)
+        workers = options.workers
+    else:
+        _assemble(result, path, chain,
+                  lambda folder, chain: _scan_folder(folder, chain, options),
+                  max_depth=options.max_depth)
+        workers = 1
+    result.stats = ScanStats(len(result.names), workers,
+                             time.perf_counter() - start)
+    return result
+
+
+def _assemble(result: ScanResult, path: str, chain: _Chain,
+              listing_of: Callable[[str, _Chain], _Listing],
+              depth: Optional[int] = None,
+              max_depth: Optional[int] = None) -> None:
+    """Add the entries under the folder at <path>, whose chain is <chain>,
+    to <result> in breadth-first order, leaving folders <depth> levels below
+    <path> pending if <depth> is not None.
+
+    Folders <max_depth> levels below <path> are also left pending if
+    <max_depth> is not None, but with the total size of everything under
+    them.
+
+    listing_of(folder, chain) returns the listing of the folder at path
+    <folder> whose chain is <chain>.
+    """
+    folders = [(0, path, chain, 0)]
+    i = 0
+    while i < len(folders):
+        index, folder, chain, level = folders[i]
+        i += 1
+        if depth is not None and level >= depth:
+            result.pending[index] = (folder, chain)
+            result.sizes[index] = _path_size(folder)
+            continue
+        if max_depth is not None and level >= max_depth:
+            result.pending[index] = (folder, chain)
+            result.sizes[index] = _total_size(folder, chain, listing_of)
+            continue
+        entries, own_size = listing_of(folder, chain)
+        first = len(result.names)
+        for name, size, child_path, child_chain in entries:
+            child = result.add(name, size)
+            if child_path is not None:
+                folders.append((child, child_path, child_chain, level + 1))
+        result.first_child[index] = first
+        result.child_count[index] = len(entries)
+        if entries == [] and index != 0:
+            result.sizes[index] = own_size
+
+
+def _scan_folder(folder: str, chain: _Chain,
+                 options: ScanOptions) -> _Listing:
+    """Return the listing of the folder at path <folder>, whose chain is
+    <chain>: its entries in order, as (name, size, path, chain) where path
+    and chain are None for an entry that is scanned as a file, and the size
+    of the folder itself if it has no entries.
+    """
+    entries = []
+    for entry in _list_folder(folder):
+        is_link = entry.is_symlink()
+        if is_link and options.symlinks == 'skip':
+            continue
+        elif options.is_excluded(entry.name):
+            continue
+        elif is_link and options.symlinks == 'follow':
+            entries.append(_followed_link(entry, chain))
+        elif not is_link and entry.is_dir(follow_symlinks=False):
+            # A folder can be a mount point, on another device than the
+            # folder it is in.
+            try:
+                device = entry.stat(follow_symlinks=False).st_dev
+            except OSError:
+                device = chain[0][0]
+            entries.append((entry.name, 0, entry.path,
+                            ((device, entry.inode()), chain)))
+        else:
+            entries.append((entry.name,
+                            _entry_size(entry, follow_symlinks=False),
+                            None, None))
+    if entries == []:
+        return entries, _path_size(folder)
+    if options.folds_files():
+        entries = _fold_small_files(entries, options)
+    return entries, 0
+
+
+def _fold_small_files(entries: List[Tuple[str, int, Optional[str], _Chain]],
+                      options: ScanOptions
+                      ) -> List[Tuple[str, int, Optional[str], _Chain]]:
+    """Return the listing entries <entries> of a folder with the files that
+    options.min_size and options.max_files leave out replaced by a single
+    small files entry, of their total size, after the others.
+
+    Nothing is folded unless at least two files would be.
+    """
+    files = [entry for entry in entries if entry[2] is None]
+    small = [entry for entry in files if entry[1] < options.min_size]
+    if options.max_files is not None:
+        large = [entry for entry in files if entry[1] >= options.min_size]
+        if len(large) > options.max_files:
+            large.sort(key=lambda entry: entry[1], reverse=True)
+            small.extend(large[options.max_files:])
+    if len(small) < 2:
+        return entries
+    folded = {id(entry) for entry in small}
+    kept = [entry for entry in entries if id(entry) not in folded]
+    kept.append((SMALL_FILES.format(len(small)),
+                 sum(entry[1] for entry in small), None, None))
+    return kept
+
+
+def _total_size(folder: str, chain: _Chain,
+                listing_of: Callable[[str, _Chain], _Listing]) -> int:
+    """Return the total size of everything under the folder at <folder>,
+    whose chain is <chain>, where listing_of returns the listing of a
+    folder as in _assemble. An empty folder counts its own size, as
+    FileSystemTree does.
+    """
+    total = 0
+    folders = [(folder, chain)]
+    while folders:
+        entries, own_size = listing_of(*folders.pop())
+        total += own_size
+        for _, size, path, child_chain in entries:
+            if path is None:
+                total += size
+            else:
+                folders.append((path, child_chain))
+    return total
+
+
+def _pruning(options: ScanOptions) -> Tuple:
+    """Return the settings of <options> that prune a scan, as a tuple that
+    can be compared and saved.
+    """
+    return (options.exclude, options.max_depth, options.min_size,
+            options.max_files)
+
+
+def _list_folder(folder: str) -> List[os.DirEntry]:
+    """Return the entries of the folder at path <folder>, or no entries if
+    it cannot be listed.
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return list(entries)
+    except OSError:
+        return []
+
+
+def _entry_size(entry: os.DirEntry, follow_symlinks: bool) -> int:
+    """Return the size of <entry>, or of the link itself if <entry> is a
+    broken symbolic link, or 0 if it cannot be read.
+    """
+    try:
+        return entry.stat(follow_symlinks=follow_symlinks).st_size
+    except OSError:
+        if follow_symlinks:
+            return _entry_size(entry, False)
+        return 0
+
+
+def _path_size(path: str) -> int:
+    """Return the size of the file or folder at <path>, or 0 if it cannot
+    be read.
+    """
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def _chain_of(folder: str, root: str) -> _Chain:
+    """Return the chain of the folder at <folder>, which is <root> or a
+    folder under it, as a scan of <root> would find it.
+    """
+    folders = [root]
+    relative = os.path.relpath(folder, root)
+    if relative != os.curdir:
+        for name in relative.split(os.sep):
+            folders.append(os.path.join(folders[-1], name))
+    chain = None
+    for current in folders:
+        try:
+            folder_stat = os.stat(current)
+        except OSError:
+            break
+        chain = ((folder_stat.st_dev, folder_stat.st_ino), chain)
+    return chain
+
+
+def _followed_link(entry: os.DirEntry, chain: _Chain) -> Tuple:
+    """Return the listing entry for the symbolic link <entry> in the folder
+    with chain <chain>, scanned as what it points to.
+
+    A link to a folder in <chain>, i.e. one that contains the link, is
+    scanned as a file, since following it would never end.
+    """
+    try:
+        target = entry.stat()
+    except OSError:
+        return (entry.name, _entry_size(entry, False), None, None)
+    if not stat.S_ISDIR(target.st_mode):
+        return (entry.name, target.st_size, None, None)
+
+    key = (target.st_dev, target.st_ino)
+    ancestor = chain
+    while ancestor is not None:
+        if ancestor[0] == key:
+            return (entry.name, _entry_size(entry, False), None, None)
+        ancestor = ancestor[1]
+    return (entry.name, 0, entry.path, (key, chain))
+
+
+class FolderSizes:
+    """The total sizes of pending folders, found by scanning them on a
+    background thread.
+
+    The folders are scanned one at a time, in order. When a folder has been
+    scanned, the totals of it and of every folder in it become available
+    together.
+
+    === Public Attributes ===
+    folder_count:
+        The number of folders to scan.
+    scanned:
+        The number of folders scanned so far.
+
+    === Private Attributes ===
+    _totals:
+        The total size of each folder scanned so far, by path.
+    _finished:
+        The totals of each folder scanned since take_finished was last
+        called, one dictionary per folder.
+    _stopped:
+        Set when the scan should stop before its next folder.
+    _thread:
+        The thread scanning the folders.
+    """
+    folder_count: int
+    scanned: int
+    _totals: Dict[str, int]
+    _finished: queue.Queue
+    _stopped: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self, folders: List[PendingFolder],
+                 options: Optional[ScanOptions] = None) -> None:
+        """Start finding the total sizes of <folders>, pending folders of a
+        scan with <options>.
+        """
+        self.folder_count = len(folders)
+        self.scanned = 0
+        self._totals = {}
+        self._finished = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(folders, options), daemon=True)
+        self._thread.start()
+
+    def get(self, path: str) -> Optional[int]:
+        """Return the total size of the folder at <path>, or None if it is
+        not known yet.
+        """
+        return self._totals.get(path)
+
+    def take_finished(self, block: bool = False) -> Dict[str, int]:
+        """Return the totals that became available since this method was
+        last called, by path. If <block>, first wait until every folder has
+        been scanned.
+        """
+        if block:
+            self._thread.join()
+        result = {}
+        while True:
+            try:
+                result.update(self._finished.get_nowait())
+            except queue.Empty:
+                return result
+
+    def is_done(self) -> bool:
+        """Return whether every folder has been scanned, or the scan has
+        stopped.
+        """
+        return not self._thread.is_alive()
+
+    def stop(self) -> None:
+        """Stop the scan once the folder it is scanning has been scanned.
+        """
+        self._stopped.set()
+
+    def _run(self, folders: List[PendingFolder],
+             options: Optional[ScanOptions]) -> None:
+        """Scan each of <folders> in turn, publishing their totals.
+        """
+        for folder in folders:
+            if self._stopped.is_set():
+                return
+            totals = scan_pending(folder, options).folder_totals(folder[0])
+            self._totals.update(totals)
+            self._finished.put(totals)
+            self.scanned += 1
+
+
+class StreamingScan:
+    """A scan that lists pending folders, and every folder under them, on a
+    background thread, publishing the listing of each folder as soon as it
+    has been made.
+
+    Folders are listed breadth-first, one level at a time, so the listing
+    of a folder is always published after the listing of the folder that
+    contains it.
+
+    === Public Attributes ===
+    entries:
+        The number of files and folders found so far.
+    listed:
+        The number of folders listed so far.
+    left:
+        The number of folders found but not listed yet.
+
+    === Private Attributes ===
+    _listings:
+        The listings made but not taken yet, as (path, result) where result
+        is the scan of the folder at path with a depth of 1.
+    _stopped:
+        Set when the scan should stop before its next folder.
+    _thread:
+        The thread listing the folders.
+    """
+    entries: int
+    listed: int
+    left: int
+    _listings: queue.Queue
+    _stopped: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self, folders: List[PendingFolder],
+                 options: Optional[ScanOptions] = None) -> None:
+        """Start listing <folders>, pending folders of a scan with <options>,
+        and every folder under them.
+        """
+        self.entries = 0
+        self.listed = 0
+        self.left = len(folders)
+        self._listings = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(folders, options), daemon=True)
+        self._thread.start()
+
+    def next_listing(self, block: bool = False) -> \
+            Optional[Tuple[str, ScanResult]]:
+        """Return the oldest listing that has not been taken yet, as
+        (path, result), or None if there is none. If <block>, wait for a
+        listing until every folder has been listed.
+        """
+        while True:
+            try:
+                return self._listings.get(block and not self.is_done(), 0.1)
+            except queue.Empty:
+                if not block or self.is_done() and self._listings.empty():
+                    return None
+
+    def is_done(self) -> bool:
+        """Return whether every folder has been listed, or the scan has
+        stopped.
+        """
+        return not self._thread.is_alive()
+
+    def stop(self) -> None:
+        """Stop the scan once the folder it is listing has been listed.
+        """
+        self._stopped.set()
+
+    def _run(self, folders: List[PendingFolder],
+             options: Optional[ScanOptions]) -> None:
+        """List <folders> and every folder under them, breadth-first.
+        """
+        folders = deque(folders)
+        while folders and not self._stopped.is_set():
+            folder = folders.popleft()
+            result = scan_pending(folder, options, depth=1)
+            found = [result.pending[i] for i in sorted(result.pending)]
+            folders.extend(found)
+            self.entries += len(result.names) - 1
+            self.listed += 1
+            self.left = len(folders)
+            self._listings.put((folder[0], result))
+
+
+class _ParallelScan:
+    """A scan that lists folders on several threads at once.
+
+    Each worker thread keeps its own queue of folders to list. It takes
+    the folder it found most recently from its own queue, and when that is
+    empty it steals the oldest folder from another worker's queue, so the
+    workers stay busy without sharing one queue.
+
+    === Private Attributes ===
+    _options:
+        The settings for the scan.
+    _queues:
+        The folders each worker has found but not listed, as (path, chain).
+    _listings:
+        The listing of each folder that has been listed, by path.
+    _pending:
+        The number of folders found but not listed yet.
+    _lock:
+        The lock guarding _pending.
+    _changed:
+        Notified when folders are added to a queue or the scan ends.
+    _error:
+        The exception a worker raised, if any.
+    """
+    _options: ScanOptions
+    _queues: List[Deque[Tuple[str, _Chain]]]
+    _listings: Dict[str, _Listing]
+    _pending: int
+    _lock: threading.Lock
+    _changed: threading.Condition
+    _error: Optional[BaseException]
+
+    def __init__(self, options: ScanOptions) -> None:
+        """Initialize a scan with the given <options>.
+        """
+        self._options = options
+        self._queues = [deque() for _ in range(options.workers)]
+        self._listings = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._error = None
+
+    def run(self, path: str, chain: _Chain) -> Dict[str, _Listing]:
+        """Return the listing of the folder at <path>, whose chain is
+        <chain>, and of every folder under it, by path.
+        """
+        self._queues[0].append((path, chain))
+        self._pending = 1
+        workers = [threading.Thread(target=self._work, args=(i,), daemon=True)
+                   for i in range(len(self._queues))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self._error is not None:
+            raise self._error
+        return self._listings
+
+    def _work(self, i: int) -> None:
+        """List folders as worker number <i> until there are none left.
+        """
+        own = self._queues[i]
+        try:
+            task = self._next_task(i)
+            while task is not None:
+                listing = _scan_folder(task[0], task[1], self._options)
+                self._listings[task[0]] = listing
+                found = [(path, chain) for _, _, path, chain in listing[0]
+                         if path is not None]
+                with self._lock:
+                    own.extend(found)
+                    self._pending += len(found) - 1
+                    if found != [] or self._pending == 0:
+                        self._changed.notify_all()
+                task = self._next_task(i)
+        except BaseException as error:
+            with self._lock:
+                self._error = error
+                self._changed.notify_all()
+
+    def _next_task(self, i: int) -> Optional[Tuple[str, _Chain]]:
+        """Return the next folder for worker number <i> to list, or None if
+        the scan is over.
+        """
+        n = len(self._queues)
+        while True:
+            try:
+                return self._queues[i].pop()
+            except IndexError:
+                pass
+            for j in range(1, n):
+                try:
+                    return self._queues[(i + j) % n].popleft()
+                except IndexError:
+                    pass
+            with self._lock:
+                if self._pending == 0 or self._error is not None:
+                    return None
+                self._changed.wait(0.01)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['load', 'save'],
+        'allowed-import-modules': ['python_ta', 'typing', 'fnmatch', 'os',
+                                   'stat', 'threading', 'time',
+                                   'collections', 'queue', 'struct', 're',
+                                   'snapshot',
+                                   '__future__']
+    })
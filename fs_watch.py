@@ -0,0 +1,434 @@
+"""Assignment 2: Watching the file system for FileSystemTree
+
+=== Module Description ===
+This module contains the watcher FileSystemTree.apply_changes uses to keep
+a tree up to date with the folder it was scanned from. A FileSystemWatcher
+records the files and folders that are created, deleted, modified or
+renamed under a folder on a background thread, and take_changes hands over
+everything recorded since the last call in one Changes, so that a burst of
+events, like removing a folder of 100000 files, is applied and laid out
+once.
+
+On Linux, the watcher uses inotify, through ctypes, with one watch per
+folder. Elsewhere, or if inotify cannot watch every folder, e.g. because
+the limit on the number of watches is too low, it falls back to scanning
+the folder again every poll interval and comparing the results. Polling
+costs a full scan per interval, and reports a renamed file or folder as
+removed from its old path and created at its new one.
+"""
+from __future__ import annotations
+import ctypes
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from fs_scan import ScanOptions, scan
+
+# The inotify events the watcher asks for, and the flags it reads; see
+# inotify(7).
+_IN_MODIFY = 0x2
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | \
+    _IN_DELETE | _IN_ONLYDIR
+# The header of an inotify event: watch descriptor, mask, cookie and the
+# length of the name that follows it.
+_EVENT = struct.Struct('iIII')
+# The number of seconds the inotify thread waits for events before checking
+# whether it has been closed.
+_WAKE_INTERVAL = 0.2
+
+
+class Changes:
+    """The changes to the files and folders under a folder, coalesced, so
+    that each path is recorded once however many times it changed.
+
+    A change to a path inside a folder that is then renamed, before the
+    changes are taken, is recorded under its new path.
+
+    === Public Attributes ===
+    root:
+        The path of the watched folder.
+    moved:
+        The (old path, new path) of each file or folder that was renamed
+        within the watched folder, in order.
+    changed:
+        The paths that were created, deleted or modified since the changes
+        were last taken.
+    overflowed:
+        Whether some changes were lost, so that the whole folder has to be
+        scanned again.
+    """
+    root: str
+    moved: List[Tuple[str, str]]
+    changed: Set[str]
+    overflowed: bool
+
+    def __init__(self, root: str) -> None:
+        """Initialize an empty record of the changes under <root>.
+        """
+        self.root = root
+        self.moved = []
+        self.changed = set()
+        self.overflowed = False
+
+    def add_changed(self, path: str) -> None:
+        """Record that the file or folder at <path> was created, deleted or
+        modified.
+        """
+        self.changed.add(path)
+
+    def add_moved(self, old_path: str, new_path: str) -> None:
+        """Record that the file or folder at <old_path> was renamed to
+        <new_path>, along with every path under it that has changed.
+        """
+        self.moved.append((old_path, new_path))
+        prefix = old_path + os.sep
+        renamed = [path for path in self.changed
+                   if path == old_path or path.startswith(prefix)]
+        for path in renamed:
+            self.changed.remove(path)
+            self.changed.add(new_path + path[len(old_path):])
+
+    def is_empty(self) -> bool:
+        """Return whether nothing has changed.
+        """
+        return self.moved == [] and self.changed == set() and \
+            not self.overflowed
+
+
+class FileSystemWatcher:
+    """A record of the changes to the files and folders under a folder,
+    made on a background thread until the watcher is closed.
+
+    The folders are watched, or first scanned if the folder is polled, on
+    the background thread too, so a change made to a folder before it is
+    watched may not be recorded; see wait_started.
+
+    === Public Attributes ===
+    root:
+        The path of the watched folder.
+    options:
+        The settings of the scan the watched tree was built with.
+    method:
+        How the folder is watched: 'inotify' or 'poll'.
+
+    === Private Attributes ===
+    _changes:
+        The changes recorded since take_changes was last called.
+    _lock:
+        Held while _changes is used.
+    _stop:
+        Set when the watcher is closed.
+    _started:
+        Set once every folder is watched, or the folder was first scanned
+        if it is polled.
+    _fd:
+        The inotify file descriptor, or -1 if the folder is polled.
+    _watches:
+        The paths of the folder each inotify watch descriptor watches.
+    _libc:
+        The C library, with the inotify functions, or None if the folder is
+        polled.
+    _poll_interval:
+        The number of seconds between the scans of the folder, if it is
+        polled.
+    _thread:
+        The thread recording the changes.
+    """
+    root: str
+    options: ScanOptions
+    method: str
+    _changes: Changes
+    _lock: threading.Lock
+    _stop: threading.Event
+    _started: threading.Event
+    _fd: int
+    _watches: Dict[int, List[str]]
+    _libc: Optional[ctypes.CDLL]
+    _poll_interval: float
+    _thread: threading.Thread
+
+    def __init__(self, path: str, options: Optional[ScanOptions] = None,
+                 poll_interval: float = 2.0, use_inotify: bool = True) -> None:
+        """Start watching the folder at <path>, which was scanned with
+        <options>.
+
+        Use inotify if <use_inotify> and it is available, or otherwise scan
+        the folder every <poll_interval> seconds. If a folder created
+        later cannot be watched with inotify, scan the folder every
+        <poll_interval> seconds from then on.
+
+        Precondition: <path> is a valid path to a folder.
+        """
+        self.root = path
+        self.options = options if options is not None else ScanOptions()
+        self._changes = Changes(path)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._started = threading.Event()
+        self._fd = -1
+        self._watches = {}
+        self._libc = _inotify_libc() if use_inotify else None
+        self._poll_interval = poll_interval
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.method = 'inotify' if self._fd >= 0 else 'poll'
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def wait_started(self) -> None:
+        """Wait until every folder is watched, or, if the folder is polled,
+        until it has been scanned for the first time.
+        """
+        self._started.wait()
+
+    def take_changes(self) -> Changes:
+        """Return the changes recorded since the last call, and start a new
+        record.
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = Changes(self.root)
+        return changes
+
+    def close(self) -> None:
+        """Stop watching the folder.
+        """
+        self._stop.set()
+        self._thread.join()
+        self._close_inotify()
+
+    def _close_inotify(self) -> None:
+        """Close the inotify file descriptor, if it is open.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._watches = {}
+
+    def _watch_folder(self, path: str) -> bool:
+        """Add an inotify watch for the folder at <path> and every folder
+        under it that a scan with self.options would list, and return
+        whether they were all added.
+        """
+        folders = [path]
+        seen = set()
+        while folders and not self._stop.is_set():
+            folder = folders.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                              _WATCH_MASK)
+            if wd < 0:
+                return False
+            if wd in seen:
+                # A followed link to a folder that is already watched.
+                continue
+            seen.add(wd)
+            self._watches.setdefault(wd, []).append(folder)
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_symlink() and \
+                                self.options.symlinks != 'follow' or \
+                                self.options.is_excluded(entry.name):
+                            continue
+                        try:
+                            if entry.is_dir():
+                                folders.append(entry.path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        return True
+
+    def _forget_folder(self, path: str, new_path: Optional[str]) -> None:
+        """Remove the inotify watches of the folder at <path> and every
+        folder under it, or, if <new_path> is not None, record that they
+        were renamed to be under <new_path> instead.
+        """
+        prefix = path + os.sep
+        for wd in list(self._watches):
+            folders = []
+            for folder in self._watches[wd]:
+                if folder != path and not folder.startswith(prefix):
+                    folders.append(folder)
+                elif new_path is not None:
+                    folders.append(new_path + folder[len(path):])
+            if folders != []:
+                self._watches[wd] = folders
+            else:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _run(self) -> None:
+        """Watch the folder with inotify if it could be initialized, or
+        otherwise poll it, until the watcher is closed.
+        """
+        if self._fd >= 0 and self._watch_folder(self.root):
+            self._started.set()
+            self._run_inotify()
+            return
+        self._close_inotify()
+        self.method = 'poll'
+        previous = _entry_table(self.root, self.options)
+        self._started.set()
+        self._run_polling(self._poll_interval, previous)
+
+    def _run_inotify(self) -> None:
+        """Record the changes inotify reports until the watcher is closed.
+        """
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], _WAKE_INTERVAL)
+            if ready == []:
+                continue
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                continue
+            if not self._read_events(data):
+                # A new folder could not be watched, so poll the folder
+                # from now on, and have it scanned again once the first
+                # entry table is taken.
+                self._close_inotify()
+                self.method = 'poll'
+                previous = _entry_table(self.root, self.options)
+                changes = Changes(self.root)
+                changes.overflowed = True
+                with self._lock:
+                    self._merge(changes)
+                self._run_polling(self._poll_interval, previous)
+                return
+
+    def _read_events(self, data: bytes) -> bool:
+        """Record the changes in <data>, a buffer of inotify events, and
+        return whether every folder they created could be watched.
+
+        The changes are recorded as overflowed if one could not be.
+        """
+        watched = True
+        changes = Changes(self.root)
+        # The old path of each folder or file renamed, by the cookie that
+        # pairs it with its new path.
+        renamed = {}
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                changes.overflowed = True
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            for folder in self._watches.get(wd, []):
+                path = os.path.join(folder, name) if name else folder
+                if mask & _IN_MOVED_FROM:
+                    renamed[cookie] = path
+                elif mask & _IN_MOVED_TO and cookie in renamed:
+                    old_path = renamed.pop(cookie)
+                    changes.add_moved(old_path, path)
+                    if mask & _IN_ISDIR:
+                        self._forget_folder(old_path, path)
+                else:
+                    changes.add_changed(path)
+                    if mask & (_IN_CREATE | _IN_MOVED_TO) and \
+                            mask & _IN_ISDIR and \
+                            watched and not self._watch_folder(path):
+                        changes.overflowed = True
+                        watched = False
+        # A file or folder renamed to a path outside the watched folder.
+        for old_path in renamed.values():
+            changes.add_changed(old_path)
+            self._forget_folder(old_path, None)
+        with self._lock:
+            self._merge(changes)
+        return watched
+
+    def _run_polling(self, interval: float,
+                     previous: Dict[str, int]) -> None:
+        """Record the changes found by scanning the folder every <interval>
+        seconds, starting from <previous>, the entry table of the folder
+        when it started being watched, until the watcher is closed.
+        """
+        while not self._stop.wait(interval):
+            current = _entry_table(self.root, self.options)
+            changes = Changes(self.root)
+            for path, size in current.items():
+                if previous.get(path) != size:
+                    changes.add_changed(path)
+            for path in previous:
+                if path not in current:
+                    changes.add_changed(path)
+            previous = current
+            with self._lock:
+                self._merge(changes)
+
+    def _merge(self, changes: Changes) -> None:
+        """Add <changes>, made after those in self._changes, to them.
+
+        Precondition: self._lock is held.
+        """
+        for old_path, new_path in changes.moved:
+            self._changes.add_moved(old_path, new_path)
+        self._changes.changed.update(changes.changed)
+        self._changes.overflowed |= changes.overflowed
+
+
+def _inotify_libc() -> Optional[ctypes.CDLL]:
+    """Return the C library if it has the inotify functions, or None.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _entry_table(path: str, options: ScanOptions) -> Dict[str, int]:
+    """Return the size of every file and empty folder a scan of <path> with
+    <options> finds, and -1 for every folder with entries, by path.
+
+    Every folder is listed, and no files are folded together, so that the
+    changes under a folder below options.max_depth, or to a small file, are
+    found too.
+    """
+    result = scan(path, ScanOptions(options.symlinks, options.workers,
+                                    options.exclude))
+    paths = [path] * len(result.names)
+    table = {}
+    for i in range(len(paths)):
+        if result.child_count[i] > 0:
+            table[paths[i]] = -1
+            first = result.first_child[i]
+            for child in range(first, first + result.child_count[i]):
+                paths[child] = os.path.join(paths[i], result.names[child])
+        else:
+            table[paths[i]] = result.sizes[i]
+    return table
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': ['python_ta', 'typing', 'ctypes', 'os',
+                                   'select', 'struct', 'sys',
+                                   'threading', '__future__', 'fs_scan'],
+        'allowed-io': []
+    })
@@ -0,0 +1,239 @@
+"""Assignment 2: Instrumentation for the treemap
+
+=== Module Description ===
+This module contains an opt-in record of how long the treemap operations
+take. While it is enabled, every call to an operation decorated with
+timed() adds its wall time, and the number of trees it visited, to the
+totals for that operation and to the totals of the current frame of the
+visualiser's event loop.
+
+While it is disabled, which is the default, a decorated operation costs one
+extra function call and a check of a module flag, so the decorators can be
+left in place for production runs.
+
+Typical use:
+    instrumentation.enable()
+    run_treemap_papers()
+    instrumentation.get_stats().dump_json_lines('stats.jsonl')
+"""
+from __future__ import annotations
+import functools
+import json
+import time
+from typing import Any, Callable, Dict, List, TextIO
+
+
+class OperationStats:
+    """The totals recorded for one operation.
+
+    === Public Attributes ===
+    name:
+        The name of the operation.
+    calls:
+        The number of times the operation was called.
+    seconds:
+        The total wall time spent in the operation, including the time spent
+        in any operations it called.
+    nodes:
+        The total number of trees the operation visited.
+    """
+    name: str
+    calls: int
+    seconds: float
+    nodes: int
+
+    def __init__(self, name: str) -> None:
+        """Initialize empty totals for the operation called <name>.
+        """
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.nodes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return these totals as a dictionary that can be written as JSON.
+        """
+        return {'name': self.name, 'calls': self.calls,
+                'seconds': self.seconds, 'nodes': self.nodes}
+
+
+class FrameStats:
+    """The totals recorded for one frame of the visualiser's event loop.
+
+    === Public Attributes ===
+    index:
+        The number of frames before this one.
+    seconds:
+        The wall time from the end of the previous frame to the end of this
+        one.
+    operations:
+        The totals of each operation called during this frame, by name.
+    """
+    index: int
+    seconds: float
+    operations: Dict[str, OperationStats]
+
+    def __init__(self, index: int, seconds: float,
+                 operations: Dict[str, OperationStats]) -> None:
+        """Initialize the totals of frame number <index>.
+        """
+        self.index = index
+        self.seconds = seconds
+        self.operations = operations
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return these totals as a dictionary that can be written as JSON.
+        """
+        return {'frame': self.index, 'seconds': self.seconds,
+                'operations': [op.to_dict()
+                               for op in self.operations.values()]}
+
+
+class Stats:
+    """Everything recorded since instrumentation was last reset.
+
+    === Public Attributes ===
+    operations:
+        The totals of each operation, by name.
+    frames:
+        The totals of each frame ended with end_frame, in order.
+    """
+    operations: Dict[str, OperationStats]
+    frames: List[FrameStats]
+
+    def __init__(self) -> None:
+        """Initialize an empty record.
+        """
+        self.operations = {}
+        self.frames = []
+
+    def write_json_lines(self, stream: TextIO) -> None:
+        """Write these stats to <stream> as JSON lines: one line for the
+        totals of each operation, followed by one line for each frame.
+        """
+        for op in self.operations.values():
+            stream.write(json.dumps(op.to_dict()) + '\n')
+        for frame in self.frames:
+            stream.write(json.dumps(frame.to_dict()) + '\n')
+
+    def dump_json_lines(self, path: str) -> None:
+        """Write these stats to the file at <path> as JSON lines.
+        """
+        with open(path, 'w') as f:
+            self.write_json_lines(f)
+
+
+# Whether operations are being recorded.
+_enabled = False
+# Everything recorded so far.
+_stats = Stats()
+# The totals of each operation called since the last frame ended.
+_frame_operations = {}
+# The time the current frame started, or None if no frame has started.
+_frame_start = None
+# The totals of the operations that are running, innermost last.
+_running = []
+
+
+def enable() -> None:
+    """Start recording operations. The first frame starts now.
+    """
+    global _enabled, _frame_start
+    _enabled = True
+    if _frame_start is None:
+        _frame_start = time.perf_counter()
+
+
+def disable() -> None:
+    """Stop recording operations. What has been recorded is kept.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    """Return whether operations are being recorded.
+    """
+    return _enabled
+
+
+def reset() -> None:
+    """Forget everything that has been recorded, and start a new frame.
+    """
+    global _stats, _frame_operations, _frame_start
+    _stats = Stats()
+    _frame_operations = {}
+    _frame_start = time.perf_counter() if _enabled else None
+
+
+def get_stats() -> Stats:
+    """Return everything recorded since the last reset.
+    """
+    return _stats
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Return a decorator that records each call of the decorated function
+    as the operation called <name>, while instrumentation is enabled.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return function(*args, **kwargs)
+            op = OperationStats(name)
+            _running.append(op)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                op.seconds = time.perf_counter() - start
+                _running.pop()
+                _add_to(_stats.operations, op)
+                _add_to(_frame_operations, op)
+        return wrapper
+    return decorator
+
+
+def add_nodes(count: int) -> None:
+    """Record that the innermost running operation visited <count> more
+    trees.
+    """
+    if _enabled and _running:
+        _running[-1].nodes += count
+
+
+def end_frame() -> None:
+    """Record the totals of the operations called since the previous frame
+    ended as one frame.
+    """
+    global _frame_operations, _frame_start
+    if not _enabled:
+        return
+    now = time.perf_counter()
+    if _frame_start is None:
+        _frame_start = now
+    _stats.frames.append(FrameStats(len(_stats.frames), now - _frame_start,
+                                    _frame_operations))
+    _frame_operations = {}
+    _frame_start = now
+
+
+def _add_to(totals: Dict[str, OperationStats], op: OperationStats) -> None:
+    """Add one call of <op> to the totals of its operation in <totals>.
+    """
+    if op.name not in totals:
+        totals[op.name] = OperationStats(op.name)
+    total = totals[op.name]
+    total.calls += 1
+    total.seconds += op.seconds
+    total.nodes += op.nodes
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': ['python_ta', 'typing', 'functools', 'json',
+                                   'time', '__future__'],
+        'allowed-io': ['dump_json_lines']
+    })
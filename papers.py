@@ -22,11 +22,24 @@ and we can then run it through our treemap visualisation tool to get a nice
 interactive graphical representation of this data.
 """
 import csv
-from typing import List, Dict
+import hashlib
+import os
+from array import array
+from typing import List, Dict, Optional, Tuple
 from tm_trees import TMTree
 
 # Filename for the dataset
 DATA_FILE = 'cs1_papers.csv'
+# The version of the paper trees saved in a cache. Change it whenever the
+# trees built from a dataset change, so that older caches are not used.
+_CACHE_VERSION = 1
+# The levels a PaperDataset can group papers by: their year, their
+# categories, from the most general, and the initial of their first author.
+LEVELS = ('year', 'category', 'initial')
+# The groupings the visualiser cycles through, each as the levels above the
+# papers, from the top of the tree.
+GROUPINGS = [('category',), ('year', 'category'), ('category', 'year'),
+             ('initial', 'category')]
 
 
 class PaperTree(TMTree):
@@ -60,6 +73,8 @@ class PaperTree(TMTree):
     === Representation Invariants ===
     - All TMTree RIs are inherited.
     """
+    __slots__ = ('_authors', '_doi', '_by_year', '_all_paper')
+
     _authors: str
     _doi: str
     _by_year: bool
@@ -67,7 +82,8 @@ class PaperTree(TMTree):
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False,
+                 cache: Optional[str] = None) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
 
@@ -80,16 +96,33 @@ class PaperTree(TMTree):
         <by_year> indicates whether or not the first level of subtrees should be
         the years, followed by each category, subcategory, and so on. If
         <by_year> is False, then the year in the dataset is simply ignored.
+
+        If <all_papers> and <cache> is not None, the tree is saved in a
+        snapshot file at the path <cache>, and the next tree built with the
+        same <cache> and <by_year>, while DATA_FILE has the same size,
+        modification time and contents, is loaded from it without reading
+        the dataset. Its trees are only created when they are first needed;
+        see TMTree.load_snapshot.
         """
         if all_papers is True:
-            year = by_year
-            sample_dict = _load_papers_to_dict(DATA_FILE, by_year)
-            subtrees_2 = _build_tree_from_dict(sample_dict, year)
+            key = None
+            subtrees_2 = None
+            if cache is not None:
+                key = _dataset_key(DATA_FILE, by_year)
+                subtrees_2 = _load_cached_papers(cache, key)
+            cached = subtrees_2 is not None
+            if not cached:
+                subtrees_2 = _load_papers(DATA_FILE, by_year)
             TMTree.__init__(self, name, subtrees_2, citations)
             self._authors = authors
             self._doi = doi
             self._by_year = by_year
             self._all_paper = all_papers
+            if key is not None and not cached:
+                # Replace the cache in one step, so that an interrupted save
+                # never leaves a partly written cache.
+                self.save_snapshot(cache + '.tmp', rects=False, key=key)
+                os.replace(cache + '.tmp', cache)
         else:
             TMTree.__init__(self, name, subtrees, citations)
             self._authors = authors
@@ -97,6 +130,22 @@ class PaperTree(TMTree):
             self._by_year = by_year
             self._all_paper = all_papers
 
+    def _snapshot_fields(self) -> Tuple[str, ...]:
+        """A private helper method that returns the authors, DOI, and
+        whether this tree is by year and holds all papers, as strings.
+        """
+        return (self._authors, self._doi, '1' if self._by_year else '',
+                '1' if self._all_paper else '')
+
+    def _set_snapshot_fields(self, fields: List[str]) -> None:
+        """A private helper method that sets the fields of this tree from
+        <fields>, as returned by _snapshot_fields.
+        """
+        self._authors = fields[0]
+        self._doi = fields[1]
+        self._by_year = fields[2] != ''
+        self._all_paper = fields[3] != ''
+
     def get_separator(self) -> str:
         """Return the string used to separate names in the string
         representation of a path from the tree root to this tree.
@@ -113,95 +162,219 @@ class PaperTree(TMTree):
             return ' (category)'
 
 
-def _load_papers_to_dict(dataset: csv, by_year: bool = True) -> Dict:
-    """Return a nested dictionary of the data read from the papers dataset file.
+class PaperDataset:
+    """The papers in a papers dataset file, read once, which can be grouped
+    into paper trees in different ways without reading the file again.
+
+    Every tree built from a dataset has the same paper trees as its leaves,
+    so only the last tree built should be used: building a tree moves the
+    papers out of the trees built before it.
+
+    === Public Attributes ===
+    papers:
+        The paper tree of each paper in the dataset, in the order of the
+        file.
+
+    === Private Attributes ===
+    _names:
+        The different names papers are grouped under by each level, keyed
+        by the level: tuples of a year, of categories from the most general,
+        or of the initial of a first author.
+    _groups:
+        The index in _names[level] of the names of each paper, in the order
+        of self.papers, keyed by the level. The indices are kept in arrays
+        instead of lists of the names themselves, so that the garbage
+        collector does not have to visit a reference per paper and level.
+    """
+    papers: List[PaperTree]
+    _names: Dict[str, List[Tuple[str, ...]]]
+    _groups: Dict[str, array]
+
+    def __init__(self, dataset: Optional[str] = None) -> None:
+        """Read the papers in the papers dataset file <dataset>, or in
+        DATA_FILE if it is None.
+        """
+        if dataset is None:
+            dataset = DATA_FILE
+        self.papers = []
+        self._names = {level: [] for level in LEVELS}
+        self._groups = {level: array('I') for level in LEVELS}
+        # The index in self._names of each year, category path as written
+        # in the file, and initial, keyed by the level and then by it.
+        indices = {level: {} for level in LEVELS}
+        with open(dataset, newline='') as csvfile:
+            data_reader = csv.reader(csvfile, delimiter=',')
+            next(data_reader)
+            for line in data_reader:
+                self.papers.append(PaperTree(line[1], [], line[0], line[4],
+                                             int(line[5])))
+                for level, key in zip(LEVELS, (line[2], line[3],
+                                               line[0].strip()[:1].upper())):
+                    index = indices[level].get(key)
+                    if index is None:
+                        index = len(self._names[level])
+                        indices[level][key] = index
+                        self._names[level].append(
+                            tuple(key.split(': ')) if level == 'category'
+                            else (key,))
+                    self._groups[level].append(index)
+
+    def build(self, grouping: Tuple[str, ...], name: str = 'CS1') -> PaperTree:
+        """Return a new paper tree named <name> with the papers in this
+        dataset, grouped by each level of <grouping> in turn, from the top of
+        the tree.
+
+        The papers of each group come first, in the order of the file,
+        followed by its subgroups in the order they first appear, so that
+        grouping by ('year', 'category') gives the same tree as
+        PaperTree(<name>, [], all_papers=True, by_year=True), and by
+        ('category',) the same tree as with by_year=False.
+
+        Raise ValueError if <grouping> is empty, or a level of it is not in
+        LEVELS.
+        """
+        if grouping == ():
+            raise ValueError('A grouping needs at least one level')
+        for level in grouping:
+            if level not in LEVELS:
+                raise ValueError('Unknown grouping level: {}'.format(level))
+        by_year = grouping[:1] == ('year',)
+        top = []
+        groups = {}
+        # The entry of each group of papers, keyed by the indices of the
+        # names of the papers in it by each level, so that the group of each
+        # paper is found with one lookup.
+        leaves = {}
+        for paper, indices in zip(self.papers,
+                                  zip(*[self._groups[level]
+                                        for level in grouping])):
+            group = leaves.get(indices)
+            if group is None:
+                names = ()
+                for level, index in zip(grouping, indices):
+                    names += self._names[level][index]
+                group = _index_group(groups, top, names)
+                leaves[indices] = group
+            paper._by_year = by_year
+            group[1].append(paper)
+        tree = PaperTree(name, [_build_group(entry) for entry in top],
+                         by_year=by_year)
+        tree._all_paper = True
+        return tree
+
+
+def _dataset_key(dataset: str, by_year: bool) -> str:
+    """Return the key of the trees built from the papers dataset file
+    <dataset> with <by_year>, made from the size, modification time and a
+    hash of the contents of the file.
+    """
+    stat = os.stat(dataset)
+    digest = hashlib.blake2b()
+    with open(dataset, 'rb') as f:
+        block = f.read(1 << 20)
+        while block:
+            digest.update(block)
+            block = f.read(1 << 20)
+    return 'papers {} {} {} {} {}'.format(_CACHE_VERSION, int(by_year),
+                                          stat.st_size, stat.st_mtime_ns,
+                                          digest.hexdigest())
+
+
+def _load_cached_papers(cache: str, key: str) -> Optional[List[PaperTree]]:
+    """Return the trees under the root of the paper tree saved in the
+    snapshot file <cache> with <key>, or None if there is none or it cannot
+    be read.
+    """
+    try:
+        root = TMTree.load_snapshot(cache, key)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(root, PaperTree):
+        return None
+    return root._subtrees
+
 
-    If <by_year>, then use years as the roots of the subtrees of the root of
-    the whole tree. Otherwise, ignore years and use categories only.
+def _load_papers(dataset: str, by_year: bool = True) -> List[PaperTree]:
+    """Return the trees of the years, or of the categories if not <by_year>,
+    of the papers in the papers dataset file <dataset>.
+
+    The file is read one row at a time, and each paper is added straight to
+    its category, found by its year and category path in an index of the
+    categories seen so far. The papers of each category come first, in the
+    order of the file, followed by its subcategories in the order they
+    first appear.
     """
-    data = {}
+    top = []
+    groups = {}
+    # The entry of each category, keyed by its year ('' if not <by_year>)
+    # and its path of categories as written in the file, so that the
+    # category of each row is found with one lookup.
+    categories = {}
     with open(dataset, newline='') as csvfile:
         data_reader = csv.reader(csvfile, delimiter=',')
         next(data_reader)
         for line in data_reader:
-            for item in line:
-                item.strip(' ')
-            year = line[2]
-            if by_year is True:
-                if year not in data.keys():
-                    data[year] = {}
-            categories = line[3].split(': ')
-            check = _subcategories(data, year, categories, by_year)
-            current_category = _add_category(data, year, categories, check,
-                                             by_year)
-            current_category['papers'].append({'authors': line[0],
-                                               'name': line[1], 'doi': line[4],
-                                               'citations': int(line[5])})
-    csvfile.close()
-    return data
-
-
-def _subcategories(overall_data: Dict, yr: str, lst: List, by_year: bool) -> \
-        int:
-    """Return the depth up until categories do not exist in nested dictionary
-    <overall_data>.
-    """
-    if by_year is True:
-        dic = overall_data[yr]
-    else:
-        dic = overall_data
-    pos = 0
-    while pos < len(lst):
-        sub = lst[pos]
-        if sub not in dic.keys():
-            return pos
-        dic = dic[sub]
-        pos += 1
-    return pos
-
-
-def _add_category(overall_data: Dict, yr: str, lst: List, index: int,
-                  by_year: bool) -> Dict:
-    """Add non-existing categories as nested dictionaries into an existing
-    category that is an dictionary and return dictionary of deepest depth.
+            year = line[2] if by_year else ''
+            category = categories.get((year, line[3]))
+            if category is None:
+                names = tuple(line[3].split(': '))
+                if by_year:
+                    names = (year,) + names
+                category = _index_group(groups, top, names)
+                categories[(year, line[3])] = category
+            category[1].append(PaperTree(line[1], [], line[0], line[4],
+                                         int(line[5]), by_year))
+    return [_build_group(entry) for entry in top]
+
+
+def _index_group(groups: Dict[Tuple[str, ...], list], top: List[list],
+                 names: Tuple[str, ...]) -> list:
+    """Return the entry in <groups> of the group whose path of names from
+    the top of the tree is <names>, adding it and the groups above it if
+    they are missing.
+
+    Each entry is [name, papers, subgroups], keyed by its path of names.
+    New entries at the top of the tree are appended to <top>, and the
+    others to the subgroups of their parent.
     """
-    curr_d = 0
-    if by_year is True:
-        curr = overall_data[yr]
-    else:
-        curr = overall_data
-    while curr_d != index:
-        curr = curr[lst[curr_d]]
-        curr_d += 1
-    while curr_d != len(lst):
-        curr[lst[curr_d]] = {'papers': []}
-        curr = curr[lst[curr_d]]
-        curr_d += 1
-    return curr
-
-
-def _build_tree_from_dict(nested_dict: Dict, year: bool) -> List[PaperTree]:
-    """Return a list of trees from the nested dictionary <nested_dict>.
+    siblings = top
+    entry = None
+    for i in range(len(names)):
+        key = names[:i + 1]
+        entry = groups.get(key)
+        if entry is None:
+            entry = [names[i], [], []]
+            groups[key] = entry
+            siblings.append(entry)
+        siblings = entry[2]
+    return entry
+
+
+def _build_group(entry: list) -> PaperTree:
+    """Return the tree of the group <entry>, as [name, papers, subgroups],
+    with its papers followed by the trees of its subgroups.
+
+    The groups are built from a list instead of recursively, so that
+    deeply nested categories do not reach the recursion limit.
     """
-    tree = []
-    for i in nested_dict.keys():
-        if isinstance(nested_dict[i], list) and len(nested_dict[i]) != 0:
-            for j in nested_dict[i]:
-                tree.append(PaperTree(j['name'], [], j['authors'],
-                                      j['doi'], j['citations'], year))
-        elif isinstance(nested_dict[i], list) and len(nested_dict[i]) == 0:
-            pass
-        elif isinstance(nested_dict[i], dict):
-            subtree = []
-            subtree.extend(_build_tree_from_dict(nested_dict[i], year))
-            tree.extend([PaperTree(i, subtree)])
-    return tree
+    # Every group under <entry>, each after the group it is in.
+    order = [entry]
+    for group in order:
+        order.extend(group[2])
+    # The tree of each group built so far, keyed by the id of its entry.
+    trees = {}
+    for group in reversed(order):
+        subtrees = group[1]
+        subtrees.extend(trees.pop(id(subgroup)) for subgroup in group[2])
+        trees[id(group)] = PaperTree(group[0], subtrees)
+    return trees[id(entry)]
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
-        'allowed-io': ['_load_papers_to_dict'],
-        'max-args': 8
+        'allowed-import-modules': ['python_ta', 'typing', 'array', 'csv',
+                                   'hashlib', 'os', 'tm_trees'],
+        'allowed-io': ['__init__', '_dataset_key', '_load_papers'],
+        'max-args': 9
     })
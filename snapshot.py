@@ -0,0 +1,319 @@
+"""Assignment 2: Binary tree snapshots
+
+=== Module Description ===
+This module contains the file format TMTree.save_snapshot writes and
+TMTree.load_snapshot reads. A snapshot holds a whole tree in a few flat
+tables, so it can be memory-mapped and read one node at a time, without
+parsing the rest of the file.
+
+All numbers are little-endian. The file is laid out as:
+    header:  magic, version, flags, node count, string count, the number of
+             fields per node, the layout id, and the lengths of the class
+             name and of the key
+    class:   the module and name of the class of the trees, as
+             'module:name', followed by the key, a string the writer can use
+             to tell which data the snapshot was made from, padded together
+             to a multiple of 8 bytes
+    nodes:   one record per node in breadth-first order: data_size, index
+             of the first subtree, number of subtrees, string index of the
+             name, and flags (bit 0: expanded, bit 1: empty tree)
+    rects:   x, y, width and height of each node, if flags has HAS_RECTS
+    fields:  the string index of each class-specific field of each node
+    strings: the byte offset of each string in the string data, followed
+             by the offset of the end of the string data, then the UTF-8
+             string data itself
+
+Every string is stored once, so names shared by many trees cost nothing
+extra.
+"""
+from __future__ import annotations
+import mmap
+import struct
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# The first bytes of every snapshot file.
+MAGIC = b'TMSNAP\x00\x01'
+# The version of the format SnapshotWriter writes.
+VERSION = 2
+# Set in the header flags if the snapshot has a rect for every node.
+HAS_RECTS = 1
+# Set in the flags of a node if it is expanded.
+EXPANDED = 1
+# Set in the flags of a node if it is an empty tree, with no name.
+EMPTY = 2
+
+_HEADER = struct.Struct('<8sIIQQIIII')
+_NODE = struct.Struct('<qIIII')
+_RECT = struct.Struct('<iiii')
+
+
+class SnapshotWriter:
+    """The tables of a snapshot, filled in one node at a time and then
+    written to a file.
+
+    === Public Attributes ===
+    class_name:
+        The module and name of the class of the trees, as 'module:name'.
+    layout:
+        The id of the layout the rects were computed with.
+    fields_per_node:
+        The number of class-specific string fields of each node.
+    has_rects:
+        Whether the rect of each node is written.
+    key:
+        The key of the snapshot.
+
+    === Private Attributes ===
+    _nodes:
+        The node records, flattened.
+    _rects:
+        The rects, flattened.
+    _fields:
+        The string index of each field of each node, flattened.
+    _strings:
+        The index of each string added so far.
+    """
+    class_name: str
+    layout: int
+    fields_per_node: int
+    has_rects: bool
+    key: str
+    _nodes: array
+    _rects: array
+    _fields: array
+    _strings: Dict[str, int]
+
+    def __init__(self, class_name: str, layout: int, fields_per_node: int,
+                 has_rects: bool, key: str = '') -> None:
+        """Initialize an empty snapshot of trees of the class <class_name>,
+        with the key <key>.
+        """
+        self.class_name = class_name
+        self.layout = layout
+        self.fields_per_node = fields_per_node
+        self.has_rects = has_rects
+        self.key = key
+        self._nodes = array('q')
+        self._rects = array('i')
+        self._fields = array('I')
+        self._strings = {}
+
+    def add_node(self, name: Optional[str], data_size: int, first_child: int,
+                 child_count: int, expanded: bool,
+                 rect: Tuple[int, int, int, int],
+                 fields: Tuple[str, ...]) -> None:
+        """Add the record of the next node in breadth-first order. A node
+        with no <name> is an empty tree.
+        """
+        flags = EXPANDED if expanded else 0
+        if name is None:
+            name = ''
+            flags |= EMPTY
+        self._nodes.extend((data_size, first_child | child_count << 32,
+                            self._string(name) | flags << 32))
+        if self.has_rects:
+            self._rects.extend(rect)
+        for field in fields:
+            self._fields.append(self._string(field))
+
+    def add_nodes(self, names: List[str], data_sizes: List[int],
+                  first_children: List[int], child_counts: List[int],
+                  fields: List[str]) -> None:
+        """Add the records of the next nodes in breadth-first order at
+        once, none of them expanded or empty trees. <fields> holds the
+        fields of each node in turn.
+
+        Precondition: not self.has_rects
+        """
+        # The same as self._string, without a method call per string.
+        strings = self._strings
+        index = strings.setdefault
+        nodes = array('q', bytes(24 * len(names)))
+        nodes[0::3] = array('q', data_sizes)
+        nodes[1::3] = array('q', [first | count << 32 for first, count
+                                  in zip(first_children, child_counts)])
+        nodes[2::3] = array('q', [index(name, len(strings))
+                                  for name in names])
+        self._nodes.extend(nodes)
+        self._fields.extend([index(field, len(strings)) for field in fields])
+
+    def write(self, path: str) -> None:
+        """Write the snapshot to the file at <path>.
+        """
+        class_name = self.class_name.encode('utf-8')
+        key = self.key.encode('utf-8')
+        strings = [s.encode('utf-8') for s in self._strings]
+        offsets = array('Q', [0])
+        for s in strings:
+            offsets.append(offsets[-1] + len(s))
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION,
+                                 HAS_RECTS if self.has_rects else 0,
+                                 len(self._nodes) // 3, len(strings),
+                                 self.fields_per_node, self.layout,
+                                 len(class_name), len(key)))
+            f.write(class_name + key +
+                    b'\x00' * (-(len(class_name) + len(key)) % 8))
+            for table in (self._nodes, self._rects, self._fields):
+                f.write(_little_endian(table).tobytes())
+            f.write(b'\x00' * (-len(self._fields) * 4 % 8))
+            f.write(_little_endian(offsets).tobytes())
+            f.write(b''.join(strings))
+
+    def _string(self, s: str) -> int:
+        """Return the index of <s> in the string table, adding it if it is
+        not there yet.
+        """
+        index = self._strings.get(s)
+        if index is None:
+            index = len(self._strings)
+            self._strings[s] = index
+        return index
+
+
+class SnapshotReader:
+    """A snapshot file, memory-mapped and read one node at a time.
+
+    === Public Attributes ===
+    class_name:
+        The module and name of the class of the trees, as 'module:name'.
+    layout:
+        The id of the layout the rects were computed with.
+    fields_per_node:
+        The number of class-specific string fields of each node.
+    has_rects:
+        Whether the snapshot has the rect of each node.
+    key:
+        The key the snapshot was written with.
+    node_count:
+        The number of nodes in the snapshot.
+
+    === Private Attributes ===
+    _map:
+        The contents of the file.
+    _nodes, _rects, _fields, _offsets, _data:
+        The byte offset of each table in the file.
+    """
+    class_name: str
+    layout: int
+    fields_per_node: int
+    has_rects: bool
+    key: str
+    node_count: int
+    _map: mmap.mmap
+    _nodes: int
+    _rects: int
+    _fields: int
+    _offsets: int
+    _data: int
+
+    def __init__(self, path: str) -> None:
+        """Open the snapshot file at <path>.
+
+        Raise ValueError if it is not a snapshot this module can read.
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError('Not a tree snapshot: {}'.format(path))
+        magic, version, flags, self.node_count, string_count, \
+            self.fields_per_node, self.layout, name_length, key_length = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a tree snapshot: {}'.format(path))
+        self.has_rects = bool(flags & HAS_RECTS)
+        start = _HEADER.size
+        self.class_name = self._map[start:start + name_length].decode('utf-8')
+        start += name_length
+        self.key = self._map[start:start + key_length].decode('utf-8')
+        start += key_length
+        self._nodes = start + (-(name_length + key_length) % 8)
+        self._rects = self._nodes + self.node_count * _NODE.size
+        self._fields = self._rects
+        if self.has_rects:
+            self._fields += self.node_count * _RECT.size
+        field_bytes = self.node_count * self.fields_per_node * 4
+        self._offsets = self._fields + field_bytes + (-field_bytes % 8)
+        self._data = self._offsets + (string_count + 1) * 8
+
+    def node(self, i: int) -> Tuple[int, int, int, Optional[str], bool]:
+        """Return the data_size, index of the first subtree, number of
+        subtrees, name and whether it is expanded, of node <i>. The name of
+        an empty tree is None.
+        """
+        data_size, first_child, child_count, name, flags = \
+            _NODE.unpack_from(self._map, self._nodes + i * _NODE.size)
+        return (data_size, first_child, child_count,
+                None if flags & EMPTY else self.string(name),
+                bool(flags & EXPANDED))
+
+    def rect(self, i: int) -> Tuple[int, int, int, int]:
+        """Return the rect of node <i>.
+
+        Precondition: self.has_rects
+        """
+        return _RECT.unpack_from(self._map, self._rects + i * _RECT.size)
+
+    def fields(self, i: int) -> List[str]:
+        """Return the class-specific fields of node <i>.
+        """
+        n = self.fields_per_node
+        indices = struct.unpack_from('<{}I'.format(n), self._map,
+                                     self._fields + i * n * 4)
+        return [self.string(index) for index in indices]
+
+    def string(self, i: int) -> str:
+        """Return string number <i> of the string table.
+        """
+        start, end = struct.unpack_from('<QQ', self._map,
+                                        self._offsets + i * 8)
+        return self._map[self._data + start:self._data + end].decode('utf-8')
+
+    def tables(self) -> Tuple[array, array]:
+        """Return the node records and the fields of every node, read at
+        once.
+
+        The node records are three numbers per node: its data_size, the
+        index of its first subtree with the number of subtrees in the high
+        32 bits, and the string index of its name with its flags in the
+        high 32 bits. The fields are the string index of each field of
+        each node.
+        """
+        nodes = array('q')
+        nodes.frombytes(self._map[self._nodes:self._rects])
+        fields = array('I')
+        fields.frombytes(self._map[self._fields:self._fields +
+                                   self.node_count * self.fields_per_node * 4])
+        return _little_endian(nodes), _little_endian(fields)
+
+    def strings(self) -> List[str]:
+        """Return the whole string table, read at once.
+        """
+        offsets = array('Q')
+        offsets.frombytes(self._map[self._offsets:self._data])
+        offsets = _little_endian(offsets)
+        data = self._map[self._data:self._data + offsets[-1]]
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                for i in range(len(offsets) - 1)]
+
+
+def _little_endian(table: array) -> array:
+    """Return <table>, or a little-endian copy of it on big-endian machines.
+    Applied to a table read from a snapshot, it gives the table in the
+    byte order of this machine.
+    """
+    if struct.pack('=I', 1) == struct.pack('<I', 1):
+        return table
+    swapped = array(table.typecode, table)
+    swapped.byteswap()
+    return swapped
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': ['python_ta', 'typing', 'mmap', 'struct',
+                                   'array', '__future__'],
+        'allowed-io': ['write', '__init__']
+    })
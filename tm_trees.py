@@ -19,8 +19,32 @@ computer's file system.
 from __future__ import annotations
 import os
 import math
-from random import randint
-from typing import List, Tuple, Optional
+import sys
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, Set, Tuple, Optional, \
+    TYPE_CHECKING
+
+from fs_scan import FolderSizes, PendingFolder, ScanCache, ScanOptions, \
+    ScanResult, StreamingScan, check_entry, folder_total, scan, scan_pending
+from instrumentation import add_nodes, timed
+from snapshot import SnapshotReader, SnapshotWriter
+
+if TYPE_CHECKING:
+    from fs_watch import Changes
+
+
+# The seed mixed into the hash every tree colour is computed from.
+_colour_seed = 0
+
+
+def set_colour_seed(seed: int) -> None:
+    """Use <seed> to pick the colours of trees whose colour has not been
+    computed yet. For a given seed, trees with the same path always get the
+    same colour.
+    """
+    global _colour_seed
+    _colour_seed = seed & 0xFFFFFFFF
 
 
 class TMTree:
@@ -46,6 +70,15 @@ class TMTree:
     === Private Attributes ===
     _colour:
         The RGB colour value of the root of this tree.
+    _x, _y, _w, _h:
+        The components of rect. Trees are slotted to keep large trees small
+        in memory, so rect and _colour are properties over these compact
+        fields rather than stored tuples.
+    _rgb:
+        The components of _colour packed into one int as 0xRRGGBB, or -1 if
+        the colour has not been computed yet. Colours are computed when they
+        are first needed, from a hash of the tree's path, so a tree gets the
+        same colour in every run.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -55,6 +88,36 @@ class TMTree:
         as a subtree, or None if this tree is not part of a larger tree.
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+    _dirty:
+        Whether or not the rectangles of this tree's subtrees need to be
+        recomputed because a data_size below this tree has changed since the
+        last layout.
+    _layout_strategy:
+        The function used to divide a tree's rect among its subtrees. Only
+        the value at the root of the whole tree is used.
+    _frontier:
+        The trees whose rectangles are displayed when this tree is the root
+        of the displayed-tree, in the order get_rectangles lists them, or
+        None if they have not been found yet. Only kept up to date at the
+        root of the whole tree, by the methods that expand, collapse or move
+        trees. Trees with a data_size of 0 are kept in the frontier but not
+        displayed.
+    _root_state:
+        The _layout_strategy and _frontier of this tree, or None if they
+        are slice_and_dice_layout and None. Only the root of a whole tree
+        needs them, so they are kept in one object there, and
+        _layout_strategy and _frontier are properties over it, rather than
+        costing every tree two fields.
+    _path:
+        The path string of this tree without its suffix, or None if it has
+        not been built since this tree last changed parent. Only cached for
+        trees with subtrees, whose paths are the shared prefixes of the
+        paths of their descendants.
+    _stub:
+        The snapshot this tree was loaded from and its index in it, if its
+        subtrees have not been created from the snapshot yet, or None.
+        Until they are, this tree has no subtrees, but its data_size is
+        already the sum of theirs.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -75,17 +138,29 @@ class TMTree:
     - if _subtrees is empty, then _expanded is False
     """
 
-    rect: Tuple[int, int, int, int]
+    __slots__ = ('_x', '_y', '_w', '_h', 'data_size', '_rgb', '_name',
+                 '_subtrees', '_parent_tree', '_expanded', '_dirty',
+                 '_root_state', '_path', '_stub')
+
     data_size: int
-    _colour: Tuple[int, int, int]
+    _x: int
+    _y: int
+    _w: int
+    _h: int
+    _rgb: int
     _name: str
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _dirty: bool
+    _root_state: Optional[_RootState]
+    _path: Optional[str]
+    _stub: Optional[Tuple[SnapshotReader, int]]
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
-        """Initialize a new TMTree with a random colour and the provided <name>.
+        """Initialize a new TMTree with the provided <name>. Its colour is
+        computed from its path when it is first needed.
 
         If <subtrees> is empty, use <data_size> to initialize this tree's
         data_size.
@@ -97,11 +172,12 @@ class TMTree:
 
         Precondition: if <name> is None, then <subtrees> is empty.
         """
-        self.rect = (0, 0, 0, 0)
-        self._name = name
+        self._x = self._y = self._w = self._h = 0
+        self._name = name if name is None else sys.intern(name)
+        self._path = None
         self._subtrees = subtrees[:]
         self._parent_tree = None
-        self._colour = (randint(0, 255), randint(0, 255), randint(0, 255))
+        self._rgb = -1
 
         if len(subtrees) == 0:
             self.data_size = data_size
@@ -112,59 +188,197 @@ class TMTree:
 
         for subtree in subtrees:
             subtree._parent_tree = self
+            subtree._root_state = None
+            if subtree._path is not None:
+                subtree._clear_paths()
 
         self._expanded = False
+        self._dirty = True
+        self._root_state = None
+        self._stub = None
+
+    @property
+    def rect(self) -> Tuple[int, int, int, int]:
+        """The pygame rectangle representing this tree, as
+        (x, y, width, height).
+        """
+        return (self._x, self._y, self._w, self._h)
+
+    @rect.setter
+    def rect(self, rect: Tuple[int, int, int, int]) -> None:
+        """Set the pygame rectangle representing this tree.
+        """
+        self._x, self._y, self._w, self._h = rect
+
+    @property
+    def _colour(self) -> Tuple[int, int, int]:
+        """The RGB colour value of the root of this tree.
+        """
+        rgb = self._get_rgb()
+        return (rgb >> 16, (rgb >> 8) & 0xFF, rgb & 0xFF)
+
+    @_colour.setter
+    def _colour(self, colour: Tuple[int, int, int]) -> None:
+        """Set the RGB colour value of the root of this tree.
+        """
+        self._rgb = (colour[0] << 16) | (colour[1] << 8) | colour[2]
+
+    @property
+    def _layout_strategy(self) -> LayoutStrategy:
+        """The function used to divide a tree's rect among its subtrees.
+        """
+        state = self._root_state
+        return slice_and_dice_layout if state is None \
+            else state.layout_strategy
+
+    @_layout_strategy.setter
+    def _layout_strategy(self, strategy: LayoutStrategy) -> None:
+        """Set the function used to divide a tree's rect among its
+        subtrees.
+        """
+        if self._root_state is None:
+            self._root_state = _RootState()
+        self._root_state.layout_strategy = strategy
+
+    @property
+    def _frontier(self) -> Optional[_Frontier]:
+        """The trees whose rectangles are displayed when this tree is the
+        root of the displayed-tree, or None if they have not been found.
+        """
+        state = self._root_state
+        return None if state is None else state.frontier
+
+    @_frontier.setter
+    def _frontier(self, frontier: Optional[_Frontier]) -> None:
+        """Set the trees whose rectangles are displayed when this tree is
+        the root of the displayed-tree.
+        """
+        if self._root_state is None:
+            if frontier is None:
+                return
+            self._root_state = _RootState()
+        self._root_state.frontier = frontier
+
+    def _get_rgb(self) -> int:
+        """A private helper method that returns _rgb, first computing it from
+        a hash of this tree's path and the colour seed if it has not been
+        computed yet.
+        """
+        if self._rgb < 0:
+            parent = self._parent_tree
+            if parent is not None and parent._path is not None:
+                path = parent._path + self.get_separator() + self._name
+            else:
+                path = self._path_string()
+            if path is None:
+                path = ''
+            digest = zlib.crc32(path.encode('utf-8'), _colour_seed)
+            self._rgb = ((digest * 0x9E3779B1) & 0xFFFFFFFF) >> 8
+        return self._rgb
 
     def is_empty(self) -> bool:
         """Return True iff this tree is empty.
         """
         return self._name is None
 
+    @timed('update_rectangles')
     def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
         """
-        if self._name is None:
-            self.rect = (0, 0, 0, 0)
-        elif self._subtrees == []:
-            self.rect = rect
-        elif self.data_size > 0:
-            x, y, width, height = rect
-            self.rect = rect
-            save_x = x
-            save_y = y
-            if width > height:
-                for i in self._subtrees[:-1]:
-                    proportion_i = i.data_size / self.data_size
-                    i.rect = (x, y, math.floor(width * proportion_i), height)
-                    x += i.rect[2]
-                    i.update_rectangles(i.rect)
-                self._subtrees[-1].rect = (x, y, save_x + width - x, height)
-                self._subtrees[-1].update_rectangles(self._subtrees[-1].rect)
-            else:
-                for j in self._subtrees[:-1]:
-                    proportion_j = j.data_size / self.data_size
-                    j.rect = (x, y, width, math.floor(height * proportion_j))
-                    y += j.rect[3]
-                    j.update_rectangles(j.rect)
-                self._subtrees[-1].rect = (x, y, width, save_y + height - y)
-                self._subtrees[-1].update_rectangles(self._subtrees[-1].rect)
-        elif self.data_size == 0:
-            self.rect = rect
-            x, y, width, height = rect
-            if width > height:
-                for i in self._subtrees[:-1]:
-                    i.rect = (x, y, 0, height)
-                    i.update_rectangles(i.rect)
-                self._subtrees[-1].rect = rect
-                self._subtrees[-1].update_rectangles(self._subtrees[-1].rect)
-            else:
-                for j in self._subtrees[:-1]:
-                    j.rect = (x, y, width, 0)
-                    j.update_rectangles(j.rect)
-                self._subtrees[-1].rect = rect
-                self._subtrees[-1].update_rectangles(self._subtrees[-1].rect)
+        self.rect = rect
+        add_nodes(self._layout_descendants(self.get_layout_strategy()))
+
+    @timed('update_dirty_rectangles')
+    def update_dirty_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+        """Update the rectangles in this tree and its descendents to fill the
+        area defined by pygame rectangle <rect>, recomputing only the parts of
+        the tree whose layout changed since the last update.
+
+        The resulting rectangles are identical to those produced by
+        update_rectangles, provided data sizes have only been changed through
+        change_size and move since that call.
+        """
+        if self.rect != rect or self._name is None:
+            self.update_rectangles(rect)
+        else:
+            add_nodes(self._update_dirty_helper(self.get_layout_strategy()))
+
+    def set_layout_strategy(self, strategy: LayoutStrategy) -> None:
+        """Use <strategy> to lay out the whole tree that this tree is part of,
+        e.g. slice_and_dice_layout (the default) or squarified_layout.
+
+        The rectangles are not recomputed until the next call to
+        update_rectangles.
+        """
+        self._get_root()._layout_strategy = strategy
+
+    def get_layout_strategy(self) -> LayoutStrategy:
+        """Return the layout strategy of the whole tree that this tree is
+        part of, as set by set_layout_strategy.
+        """
+        return self._get_root()._layout_strategy
+
+    def _get_root(self) -> TMTree:
+        """A private helper method that returns the root of the whole tree
+        that this tree is part of.
+        """
+        current_tree = self
+        while current_tree._parent_tree is not None:
+            current_tree = current_tree._parent_tree
+        return current_tree
+
+    def _update_dirty_helper(self, layout: LayoutStrategy) -> int:
+        """A private helper method that recomputes the rectangles of the
+        subtrees of every dirty tree in this tree using <layout>, descending
+        only into subtrees that are dirty themselves or whose rectangle has
+        changed. Return the number of trees visited.
+        """
+        visited = 0
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            visited += 1
+            if tree._dirty:
+                tree._dirty = False
+                if tree._subtrees != []:
+                    old_rects = [sub.rect for sub in tree._subtrees]
+                    layout(tree)
+                    for sub, old_rect in zip(tree._subtrees, old_rects):
+                        if sub.rect != old_rect:
+                            visited += sub._layout_descendants(layout)
+                        else:
+                            stack.append(sub)
+        return visited
+
+    def _layout_descendants(self, layout: LayoutStrategy) -> int:
+        """A private helper method that lays out every descendant of this tree
+        within this tree's current rect using <layout>. Return the number of
+        trees visited.
+        """
+        visited = 1
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree._dirty = False
+            if tree._name is None:
+                tree.rect = (0, 0, 0, 0)
+            elif tree._subtrees != []:
+                layout(tree)
+                stack.extend(tree._subtrees)
+                visited += len(tree._subtrees)
+        return visited
 
+    def _mark_dirty(self) -> None:
+        """A private helper method that marks this tree and its ancestors as
+        needing their subtrees' rectangles recomputed.
+        """
+        current_tree = self
+        while current_tree is not None and not current_tree._dirty:
+            current_tree._dirty = True
+            current_tree = current_tree._parent_tree
+
+    @timed('get_rectangles')
     def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
                                            Tuple[int, int, int]]]:
         """Return a list with tuples for every leaf in the displayed-tree
@@ -172,17 +386,76 @@ class TMTree:
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
         """
-        if self._expanded is False and self.data_size == 0:
-            return []
-        elif self._expanded is False:
-            return [(self.rect, self._colour)]
+        result = list(self.iter_rectangles())
+        add_nodes(len(result))
+        return result
+
+    def iter_rectangles(self) -> Iterator[Tuple[Tuple[int, int, int, int],
+                                                Tuple[int, int, int]]]:
+        """Yield the same tuples as get_rectangles, in the same order, one at
+        a time without building a list.
+
+        The tree must not be changed while the tuples are being consumed.
+        """
+        if self._parent_tree is None:
+            if self._frontier is None:
+                self._frontier = _Frontier(self._displayed_trees())
+            displayed = self._frontier
         else:
-            result = []
-            if self._expanded is True:
-                for sub in self._subtrees:
-                    result.extend(sub.get_rectangles())
-            return result
+            displayed = self._displayed_trees()
+        for tree in displayed:
+            if tree.data_size != 0:
+                rgb = tree._rgb
+                if rgb < 0:
+                    rgb = tree._get_rgb()
+                yield ((tree._x, tree._y, tree._w, tree._h),
+                       (rgb >> 16, (rgb >> 8) & 0xFF, rgb & 0xFF))
 
+    def _displayed_trees(self) -> List[TMTree]:
+        """A private helper method that returns the trees of the
+        displayed-tree rooted at this tree that are not expanded, in order,
+        including those with a data_size of 0.
+        """
+        result = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._expanded:
+                stack.extend(reversed(tree._subtrees))
+            else:
+                result.append(tree)
+        return result
+
+    def _cached_frontier(self) -> Optional[_Frontier]:
+        """A private helper method that returns the cached frontier of the
+        whole tree that this tree is part of if this tree is in its
+        displayed-tree, or None if there is nothing to keep up to date.
+        """
+        current_tree = self._parent_tree
+        while current_tree is not None:
+            if not current_tree._expanded:
+                return None
+            if current_tree._parent_tree is None:
+                return current_tree._frontier
+            current_tree = current_tree._parent_tree
+        return self._frontier
+
+    def _splice_frontier(self, before: List[TMTree]) -> None:
+        """A private helper method that replaces <before>, the trees that
+        this tree used to display, with the trees it displays now in the
+        cached frontier of the whole tree.
+
+        Precondition: self._cached_frontier() was not None before this tree
+        changed.
+        """
+        root = self._get_root()
+        frontier = root._frontier
+        if before != [] and frontier is not None and before[0] in frontier:
+            frontier.replace(before, self._displayed_trees())
+        else:
+            root._frontier = None
+
+    @timed('get_tree_at_position')
     def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
         rectangle contains position <pos>, or None if <pos> is outside of this
@@ -190,55 +463,138 @@ class TMTree:
 
         If <pos> is on the shared edge between two rectangles, return the
         tree represented by the rectangle that is closer to the origin.
+
+        The slice-and-dice layout places the subtrees of a tree one after
+        another along a single axis, so with that layout only the subtrees
+        whose span on that axis contains <pos> are searched, found by binary
+        search.
         """
-        if self.data_size == 0:
-            return None
-        elif self.rect[0] <= pos[0] <= (self.rect[0] + self.rect[2]) and \
-                self.rect[1] <= pos[1] <= (self.rect[1] + self.rect[3]) \
-                and (self._subtrees == [] or not self._expanded):
-            return self
-        else:
-            leaves = []
-            for sub in self._subtrees:
-                leaves.append(sub.get_tree_at_position(pos))
-            leaves = [item for item in leaves if item is not None]
-            if len(leaves) == 0:
-                return None
-            smallest = math.sqrt((leaves[0].rect[0])**2 +
-                                 (leaves[0].rect[1])**2)
-            i = 0
-            j = 0
-            for leaf in leaves[1:]:
-                j += 1
-                c = math.sqrt((leaf.rect[0])**2 + (leaf.rect[1])**2)
-                if c < smallest:
+        sliced = self.get_layout_strategy() is slice_and_dice_layout
+        closest = None
+        smallest = 0
+        visited = 0
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            visited += 1
+            x = tree._x
+            y = tree._y
+            if tree.data_size == 0 or not (x <= pos[0] <= x + tree._w and
+                                           y <= pos[1] <= y + tree._h):
+                pass
+            elif tree._subtrees == [] or not tree._expanded:
+                c = x ** 2 + y ** 2
+                if closest is None or c < smallest:
+                    closest = tree
                     smallest = c
-                    i = j
-            return leaves[i]
+            elif sliced:
+                stack.extend(reversed(tree._subtrees_containing(pos)))
+            else:
+                stack.extend(reversed(tree._subtrees))
+        add_nodes(visited)
+        if closest is not None:
+            closest._list_subtrees()
+        return closest
+
+    def _subtrees_containing(self, pos: Tuple[int, int]) -> List[TMTree]:
+        """A private helper method that returns the subtrees of this tree
+        whose rectangle spans position <pos> along the axis this tree was
+        sliced on, in order. There is more than one only when <pos> is on a
+        shared edge.
+
+        Precondition: this tree has been laid out by slice_and_dice_layout,
+        self.data_size > 0, and <pos> is inside self.rect.
+        """
+        if self.rect[2] > self.rect[3]:
+            axis = 0
+        else:
+            axis = 1
+        p = pos[axis]
+        subtrees = self._subtrees
+        lo = 0
+        hi = len(subtrees) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_rect = subtrees[mid].rect
+            if mid_rect[axis] + mid_rect[axis + 2] < p:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = []
+        while lo < len(subtrees) and subtrees[lo].rect[axis] <= p:
+            result.append(subtrees[lo])
+            lo += 1
+        return result
 
+    @timed('update_data_sizes')
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
         size of their leaves, and return the new size.
 
         If this tree is a leaf, return its size unchanged.
+
+        change_size and move keep the data_size of every ancestor up to date
+        on their own, so this is only needed as a full re-computation after
+        data_size has been changed by other means.
         """
-        if self._subtrees == []:
-            return self.data_size
-        else:
-            self.data_size = 0
-            for sub in self._subtrees:
-                self.data_size += sub.update_data_sizes()
-            return self.data_size
+        visited = 1
+        for tree in reversed(self._internal_nodes()):
+            tree.data_size = 0
+            for sub in tree._subtrees:
+                tree.data_size += sub.data_size
+            visited += len(tree._subtrees)
+        add_nodes(visited)
+        return self.data_size
 
     def move(self, destination: TMTree) -> None:
         """If this tree is a leaf, and <destination> is not a leaf, move this
         tree to be the last subtree of <destination>. Otherwise, do nothing.
+
+        The data_size of the old and new ancestors of this tree is updated.
+        If the old parent of this tree has no subtrees left, it is no longer
+        expanded.
+
+        The cached frontier is patched where this tree leaves and where it
+        arrives, without searching it or walking the displayed-tree.
         """
+        self._list_subtrees()
+        destination._list_subtrees()
         if self._subtrees == [] and len(destination._subtrees) != 0:
             current_parent = self._parent_tree
+            # Moving the only subtree of a tree to that tree again changes
+            # nothing that is displayed.
+            frontier = None
+            if current_parent is not destination or \
+                    len(current_parent._subtrees) > 1:
+                frontier = self._cached_frontier()
             current_parent._subtrees.remove(self)
+            emptied = current_parent._subtrees == [] and \
+                current_parent is not destination
+            if frontier is not None:
+                if emptied:
+                    frontier.replace([self], [current_parent])
+                else:
+                    frontier.replace([self], [])
+            if emptied:
+                current_parent._expanded = False
+            self._add_size_to_ancestors(-self.data_size)
+            # The tree this tree is displayed after once it is the last
+            # subtree of <destination>, if it is displayed.
+            last = None
+            frontier = destination._cached_frontier()
+            if frontier is not None and destination._subtrees != [] and \
+                    destination._expanded:
+                last = destination
+                while last._expanded and last._subtrees != []:
+                    last = last._subtrees[-1]
             destination._subtrees.append(self)
             self._parent_tree = destination
+            self._clear_paths()
+            if last is not None:
+                frontier.insert_after(last, self)
+            self._add_size_to_ancestors(self.data_size)
+            current_parent._mark_dirty()
+            destination._mark_dirty()
 
     def change_size(self, factor: float) -> None:
         """Change the value of this tree's data_size attribute by <factor>.
@@ -247,35 +603,151 @@ class TMTree:
         some change is made.
 
         Do nothing if this tree is not a leaf.
+
+        The data_size of every ancestor of this tree is updated by the same
+        amount.
         """
+        self._list_subtrees()
         if self.data_size == 1 and factor < 0:
             pass
         elif self._subtrees == []:
-            if factor < 0:
-                self.data_size = self.data_size + \
-                                 -math.ceil(-factor*self.data_size)
-            else:
-                self.data_size = self.data_size + \
-                                 math.ceil(factor*self.data_size)
+            delta = self._size_change(factor)
+            self.data_size = self.data_size + delta
+            self._add_size_to_ancestors(delta)
+            if self._parent_tree is not None:
+                self._parent_tree._mark_dirty()
         else:
             pass
 
+    def _size_change(self, factor: float) -> int:
+        """A private helper method that returns the amount change_size adds
+        to this tree's data_size for <factor>.
+        """
+        if factor < 0:
+            return -math.ceil(-factor*self.data_size)
+        else:
+            return math.ceil(factor*self.data_size)
+
+    @timed('apply_batch')
+    def apply_batch(self,
+                    operations: List[Tuple[str, TMTree, object]]) -> None:
+        """Apply <operations> in order to the whole tree that this tree is
+        part of, then update the rectangles of the whole tree.
+
+        Each operation is either ('change_size', tree, factor), which does
+        tree.change_size(factor), or ('move', tree, destination), which does
+        tree.move(destination). The resulting tree is the same as calling
+        those methods one at a time, but the data_size of the ancestors is
+        updated once for the whole batch, moved trees are taken out of
+        their old parent's subtrees in one pass per parent, and the
+        rectangles are recomputed once, with update_dirty_rectangles.
+        """
+        for operation, _, _ in operations:
+            if operation not in ('change_size', 'move'):
+                raise ValueError('Unknown operation: {}'.format(operation))
+
+        # The amount to add to the data_size of each tree and its ancestors.
+        deltas = {}
+        # The number of subtrees of each tree that have been moved away but
+        # not yet removed from its _subtrees.
+        moved_away = {}
+        for operation, tree, argument in operations:
+            tree._list_subtrees()
+            if operation == 'move':
+                argument._list_subtrees()
+            is_leaf = len(tree._subtrees) == moved_away.get(tree, 0)
+            if is_leaf and tree in deltas:
+                # Every subtree of this tree has been moved away. Apply its
+                # pending delta now, since this tree may change size or move
+                # to new ancestors.
+                delta = deltas.pop(tree)
+                tree.data_size += delta
+                tree._add_size_to_ancestors(delta)
+            if operation == 'change_size':
+                if is_leaf and not (tree.data_size == 1 and argument < 0):
+                    delta = tree._size_change(argument)
+                    tree.data_size += delta
+                    parent = tree._parent_tree
+                    if parent is not None:
+                        deltas[parent] = deltas.get(parent, 0) + delta
+                        parent._mark_dirty()
+            elif is_leaf and tree._parent_tree is not None and \
+                    len(argument._subtrees) != moved_away.get(argument, 0):
+                parent = tree._parent_tree
+                moved_away[parent] = moved_away.get(parent, 0) + 1
+                deltas[parent] = deltas.get(parent, 0) - tree.data_size
+                argument._subtrees.append(tree)
+                tree._parent_tree = argument
+                tree._clear_paths()
+                deltas[argument] = deltas.get(argument, 0) + tree.data_size
+                parent._mark_dirty()
+                argument._mark_dirty()
+
+        add_nodes(len(operations))
+        for parent in moved_away:
+            parent._remove_moved_subtrees()
+        _add_size_deltas(deltas)
+        root = self._get_root()
+        if moved_away != {}:
+            root._frontier = None
+        root.update_dirty_rectangles(root.rect)
+
+    def _remove_moved_subtrees(self) -> None:
+        """A private helper method that removes from this tree's subtrees
+        every tree that has been moved to another parent, and every earlier
+        copy of a tree that was moved back to the end of this tree. If no
+        subtrees are left, this tree is no longer expanded.
+        """
+        kept = []
+        seen = set()
+        for sub in reversed(self._subtrees):
+            if sub._parent_tree is self and sub not in seen:
+                kept.append(sub)
+                seen.add(sub)
+        kept.reverse()
+        self._subtrees = kept
+        if kept == []:
+            self._expanded = False
+
+    def _add_size_to_ancestors(self, delta: int) -> None:
+        """A private helper method that adds <delta> to the data_size of every
+        ancestor of this tree, keeping their sizes equal to the sum of their
+        subtrees' sizes.
+        """
+        current_tree = self._parent_tree
+        while current_tree is not None:
+            current_tree.data_size += delta
+            current_tree = current_tree._parent_tree
+
     def expand(self) -> None:
         """Expand the tree corresponding the chosen rectangle in the
         displayed-tree.
         If the tree is a leaf, nothing happens.
         """
-        if self._subtrees != []:
+        self._list_subtrees()
+        if self._subtrees != [] and not self._expanded:
             self._expanded = True
+            if self._cached_frontier() is not None:
+                self._splice_frontier([self])
 
     def expand_all(self) -> None:
         """Expand the tree corresponding to the chosen rectangle, as well as
         all of its subtrees in the displayed tree.
         """
-        if self._subtrees != []:
-            self.expand()
-            for sub in self._subtrees:
-                sub.expand_all()
+        self._list_subtrees(recursive=True)
+        self._expand_listed()
+
+    def _expand_listed(self) -> None:
+        """A private helper method that expands this tree and every
+        descendant of it that has subtrees, without creating any subtrees.
+        """
+        before = None
+        if self._cached_frontier() is not None:
+            before = self._displayed_trees()
+        for tree in self._internal_nodes():
+            tree._expanded = True
+        if before is not None:
+            self._splice_frontier(before)
 
     def collapse(self) -> None:
         """Collapse the parent of the selected tree.
@@ -297,11 +769,160 @@ class TMTree:
         """A private helper method that collapse the tree as well as all of its
         subtrees.
         """
-        if self._subtrees != []:
-            self._expanded = False
-            for sub in self._subtrees:
-                if sub._expanded:
-                    sub._collapse_all_helper()
+        before = None
+        if self._cached_frontier() is not None:
+            before = self._displayed_trees()
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._subtrees != []:
+                tree._expanded = False
+                for sub in tree._subtrees:
+                    if sub._expanded:
+                        stack.append(sub)
+        if before is not None:
+            self._splice_frontier(before)
+
+    def _list_subtrees(self, recursive: bool = False) -> None:
+        """A private helper method that makes sure the subtrees of this tree
+        are known, and those of all of its descendants if <recursive>.
+
+        The subtrees of a TMTree are known unless it was loaded from a
+        snapshot, in which case they are created here. Subclasses that find
+        their subtrees only when they are needed extend this.
+        """
+        layout = None
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._stub is not None:
+                if layout is None:
+                    layout = self.get_layout_strategy()
+                tree._load_stub(layout)
+            if recursive:
+                stack.extend(tree._subtrees)
+
+    def _load_stub(self, layout: LayoutStrategy) -> None:
+        """A private helper method that creates the subtrees of this tree
+        from its snapshot, and those of every new subtree that is expanded,
+        since the subtrees of an expanded tree are displayed.
+
+        The rects saved in the snapshot are used if this tree still has its
+        saved rect, and <layout>, the layout of the whole tree, is the saved
+        layout. Otherwise this tree is marked for layout.
+
+        Precondition: self._stub is not None
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            reader, i = tree._stub
+            tree._stub = None
+            _, first, child_count, _, _ = reader.node(i)
+            tree._subtrees = [_tree_from_snapshot(type(tree), reader, j)
+                              for j in range(first, first + child_count)]
+            for sub in tree._subtrees:
+                sub._parent_tree = tree
+                if sub._expanded and sub._stub is not None:
+                    stack.append(sub)
+            if not (reader.has_rects and tree.rect == reader.rect(i) and
+                    layout is _SNAPSHOT_LAYOUTS[reader.layout]):
+                tree._mark_dirty()
+
+    def _is_unlisted(self) -> bool:
+        """A private helper method that returns whether the subtrees of
+        this tree have not been created yet, as for a tree loaded from a
+        snapshot whose subtrees have not been needed.
+
+        Subclasses that find their subtrees only when they are needed extend
+        this.
+        """
+        return self._stub is not None
+
+    def save_snapshot(self, path: str, rects: bool = True,
+                      key: str = '') -> None:
+        """Save this tree and its descendants to a snapshot file at <path>,
+        which TMTree.load_snapshot reads back, with the rect of each tree if
+        <rects>, and with <key>, which load_snapshot can check, e.g. to tell
+        whether the snapshot was made from data that has changed since.
+
+        Each tree is saved with its name, data_size and whether it is
+        expanded, along with the fields of its class. Trees that have not
+        been created or listed yet, in a snapshot or a lazy scan, are created
+        first.
+
+        Precondition: every tree in this tree is of the class of this tree.
+        """
+        self._list_subtrees(recursive=True)
+        layout = self.get_layout_strategy()
+        if layout not in _SNAPSHOT_LAYOUTS:
+            rects = False
+            layout = slice_and_dice_layout
+        cls = type(self)
+        writer = SnapshotWriter(cls.__module__ + ':' + cls.__qualname__,
+                                _SNAPSHOT_LAYOUTS.index(layout),
+                                len(self._snapshot_fields()), rects, key)
+        order = [self]
+        for tree in order:
+            writer.add_node(tree._name, tree.data_size, len(order),
+                            len(tree._subtrees), tree._expanded, tree.rect,
+                            tree._snapshot_fields())
+            order.extend(tree._subtrees)
+        writer.write(path)
+
+    @staticmethod
+    def load_snapshot(path: str, key: Optional[str] = None) -> TMTree:
+        """Return the tree saved in the snapshot file at <path> by
+        save_snapshot.
+
+        The file is memory-mapped, and the trees in it are only created
+        when they are first needed: when their parent is expanded, or is
+        found by get_tree_at_position, for example. Until then the saved
+        data_size of each tree is used.
+
+        The class of the trees must be TMTree or a subclass of it that has
+        already been defined: no module is imported to find it.
+
+        Raise ValueError if the file is not a snapshot, if its class is not
+        such a class, or if <key> is not None and the snapshot was saved
+        with a different key.
+        """
+        reader = SnapshotReader(path)
+        if key is not None and reader.key != key:
+            raise ValueError('Snapshot of other data: {}'.format(path))
+        root = _tree_from_snapshot(_snapshot_class(reader.class_name),
+                                   reader, 0)
+        root._layout_strategy = _SNAPSHOT_LAYOUTS[reader.layout]
+        root._list_subtrees()
+        return root
+
+    def _snapshot_fields(self) -> Tuple[str, ...]:
+        """A private helper method that returns the fields of this tree's
+        class that save_snapshot saves, as strings.
+        """
+        return ()
+
+    def _set_snapshot_fields(self, fields: List[str]) -> None:
+        """A private helper method that sets the fields of this tree's class
+        from <fields>, as returned by _snapshot_fields.
+        """
+        pass
+
+    def _internal_nodes(self) -> List[TMTree]:
+        """A private helper method that returns this tree and its descendants
+        that are not leaves, with every tree listed before its descendants.
+
+        The list is built breadth-first while it is being read, instead of
+        recursing, so that deep trees cannot exceed the recursion limit.
+        """
+        if self._subtrees == []:
+            return []
+        result = [self]
+        for tree in result:
+            for sub in tree._subtrees:
+                if sub._subtrees != []:
+                    result.append(sub)
+        return result
 
     # Methods for the string representation
     def get_path_string(self, final_node: bool = True) -> str:
@@ -309,17 +930,50 @@ class TMTree:
         and its ancestors, using the separator for this tree between each
         tree's name. If <final_node>, then add the suffix for the tree.
         """
-        if self._parent_tree is None:
-            path_str = self._name
-            if final_node:
-                path_str += self.get_suffix()
-            return path_str
-        else:
-            path_str = (self._parent_tree.get_path_string(False) +
-                        self.get_separator() + self._name)
-            if final_node or len(self._subtrees) == 0:
-                path_str += self.get_suffix()
-            return path_str
+        path_str = self._path_string()
+        if final_node or (self._parent_tree is not None and
+                          len(self._subtrees) == 0):
+            path_str += self.get_suffix()
+        return path_str
+
+    def _path_string(self) -> str:
+        """A private helper method that returns the path string of this tree
+        without its suffix.
+
+        Each path is built from the cached path of the nearest ancestor that
+        has one, caching the paths of the trees in between that have
+        subtrees, so paths are only ever copied once per tree.
+        """
+        if self._path is not None:
+            return self._path
+        chain = []
+        current_tree = self
+        while current_tree is not None and current_tree._path is None:
+            chain.append(current_tree)
+            current_tree = current_tree._parent_tree
+        path = None if current_tree is None else current_tree._path
+        for tree in reversed(chain):
+            if path is None:
+                path = tree._name
+            else:
+                path = path + tree.get_separator() + tree._name
+            if tree._subtrees != []:
+                tree._path = path
+        return path
+
+    def _clear_paths(self) -> None:
+        """A private helper method that clears the cached paths of this tree
+        and its descendants.
+
+        A tree's path is only cached after its parent's, so the descendants
+        of a tree with no cached path have none either.
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._path is not None:
+                tree._path = None
+                stack.extend(tree._subtrees)
 
     def get_separator(self) -> str:
         """Return the string used to separate names in the string
@@ -334,6 +988,359 @@ class TMTree:
         raise NotImplementedError
 
 
+class _RootState:
+    """The fields of a TMTree that only the root of a whole tree uses.
+
+    === Public Attributes ===
+    layout_strategy:
+        The function used to divide a tree's rect among its subtrees.
+    frontier:
+        The trees displayed by the whole tree, or None if they have not been
+        found yet.
+    """
+    __slots__ = ('layout_strategy', 'frontier')
+    layout_strategy: LayoutStrategy
+    frontier: Optional[_Frontier]
+
+    def __init__(self) -> None:
+        """Initialize the fields a tree has before they are set.
+        """
+        self.layout_strategy = slice_and_dice_layout
+        self.frontier = None
+
+
+class _Frontier:
+    """The trees displayed by a whole tree, in the order get_rectangles
+    lists them, kept as a linked list so that the trees displayed by one
+    tree can be replaced without searching for them.
+
+    The links are only made when the frontier is first changed, and the
+    list of the trees in order only when it is next iterated over, so a
+    frontier that does not change costs no more than a list.
+
+    === Private Attributes ===
+    _order:
+        The trees in order, or None if they have changed since they were
+        last listed.
+    _first:
+        The first tree, or None if there are no trees.
+    _next:
+        The tree after each tree, or None for the last tree, or None if the
+        links have not been made yet.
+    _prev:
+        The tree before each tree, or None for the first tree, or None if
+        the links have not been made yet.
+    """
+    __slots__ = ('_order', '_first', '_next', '_prev')
+
+    _order: Optional[List[TMTree]]
+    _first: Optional[TMTree]
+    _next: Optional[Dict[TMTree, Optional[TMTree]]]
+    _prev: Optional[Dict[TMTree, Optional[TMTree]]]
+
+    def __init__(self, trees: List[TMTree]) -> None:
+        """Initialize a frontier of <trees>, in order.
+        """
+        self._order = trees
+        self._first = trees[0] if trees != [] else None
+        self._next = None
+        self._prev = None
+
+    def __iter__(self) -> Iterator[TMTree]:
+        """Return an iterator over the trees in order.
+        """
+        if self._order is None:
+            order = []
+            tree = self._first
+            while tree is not None:
+                order.append(tree)
+                tree = self._next[tree]
+            self._order = order
+        return iter(self._order)
+
+    def __contains__(self, tree: TMTree) -> bool:
+        """Return whether <tree> is in this frontier.
+        """
+        self._link()
+        return tree in self._prev
+
+    def insert_after(self, tree: TMTree, new: TMTree) -> None:
+        """Insert <new> right after <tree>.
+
+        Precondition: <tree> is in this frontier and <new> is not.
+        """
+        self._link()
+        following = self._next[tree]
+        self._next[tree] = new
+        self._prev[new] = tree
+        self._next[new] = following
+        if following is not None:
+            self._prev[following] = new
+        self._order = None
+
+    def replace(self, before: List[TMTree], after: List[TMTree]) -> None:
+        """Replace <before>, trees that are next to each other in this
+        frontier, in order, with <after>, in the time it takes to go through
+        the two lists.
+
+        Precondition: <before> is not empty.
+        """
+        self._link()
+        previous = self._prev[before[0]]
+        following = self._next[before[-1]]
+        for tree in before:
+            del self._prev[tree]
+            del self._next[tree]
+        for tree in after:
+            self._prev[tree] = previous
+            if previous is None:
+                self._first = tree
+            else:
+                self._next[previous] = tree
+            previous = tree
+        if previous is None:
+            self._first = following
+        else:
+            self._next[previous] = following
+        if following is not None:
+            self._prev[following] = previous
+        self._order = None
+
+    def _link(self) -> None:
+        """Make the links between the trees, if they have not been made.
+        """
+        if self._prev is None:
+            order = self._order
+            self._next = dict(zip(order, order[1:] + [None]))
+            self._prev = dict(zip(order, [None] + order[:-1]))
+
+
+def _add_size_deltas(deltas: Dict[TMTree, int]) -> None:
+    """Add each value in <deltas> to the data_size of its key and of every
+    ancestor of its key, visiting each affected tree once.
+    """
+    depths = {}
+    for tree in deltas:
+        path = []
+        current_tree = tree
+        while current_tree is not None and current_tree not in depths:
+            path.append(current_tree)
+            current_tree = current_tree._parent_tree
+        depth = -1 if current_tree is None else depths[current_tree]
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+
+    pending = dict(deltas)
+    for tree in sorted(depths, key=depths.get, reverse=True):
+        delta = pending.get(tree, 0)
+        if delta != 0:
+            tree.data_size += delta
+            if tree._parent_tree is not None:
+                pending[tree._parent_tree] = \
+                    pending.get(tree._parent_tree, 0) + delta
+
+
+def _snapshot_class(class_name: str) -> type:
+    """Return TMTree, or the subclass of it already defined, whose module
+    and name are <class_name>, as 'module:name'.
+
+    Raise ValueError if there is no such class.
+    """
+    classes = [TMTree]
+    for cls in classes:
+        if cls.__module__ + ':' + cls.__qualname__ == class_name:
+            return cls
+        classes.extend(cls.__subclasses__())
+    raise ValueError('Not a tree class: {}'.format(class_name))
+
+
+def _tree_from_snapshot(cls: type, reader: SnapshotReader,
+                        i: int) -> TMTree:
+    """Return a new tree of class <cls> for node <i> of the snapshot
+    <reader>, with no subtrees yet.
+    """
+    data_size, _, child_count, name, expanded = reader.node(i)
+    tree = cls.__new__(cls)
+    TMTree.__init__(tree, name, [], data_size)
+    tree._set_snapshot_fields(reader.fields(i))
+    tree._expanded = expanded
+    if reader.has_rects:
+        tree.rect = reader.rect(i)
+        tree._dirty = False
+    if child_count > 0:
+        tree._stub = (reader, i)
+    return tree
+
+
+def slice_and_dice_layout(tree: TMTree) -> None:
+    """Divide the rect of <tree> among its subtrees in proportion to their
+    data_size, slicing along the longer side. Only the rect of each immediate
+    subtree is set.
+
+    This is the default layout strategy of a TMTree.
+
+    Precondition: tree._subtrees is not empty and tree.data_size >= 0.
+    """
+    x = tree._x
+    y = tree._y
+    width = tree._w
+    height = tree._h
+    subtrees = tree._subtrees
+    last = subtrees[-1]
+    if tree.data_size > 0:
+        if width > height:
+            for i in subtrees[:-1]:
+                proportion_i = i.data_size / tree.data_size
+                i._x, i._y, i._h = x, y, height
+                i._w = math.floor(width * proportion_i)
+                x += i._w
+            last._x, last._y, last._h = x, y, height
+            last._w = tree._x + width - x
+        else:
+            for j in subtrees[:-1]:
+                proportion_j = j.data_size / tree.data_size
+                j._x, j._y, j._w = x, y, width
+                j._h = math.floor(height * proportion_j)
+                y += j._h
+            last._x, last._y, last._w = x, y, width
+            last._h = tree._y + height - y
+    else:
+        if width > height:
+            for i in subtrees[:-1]:
+                i._x, i._y, i._w, i._h = x, y, 0, height
+        else:
+            for j in subtrees[:-1]:
+                j._x, j._y, j._w, j._h = x, y, width, 0
+        last._x, last._y, last._w, last._h = x, y, width, height
+
+
+def squarified_layout(tree: TMTree) -> None:
+    """Divide the rect of <tree> among its subtrees in proportion to their
+    data_size using the squarified treemap algorithm, which keeps the
+    rectangles close to square instead of producing thin slivers. Only the
+    rect of each immediate subtree is set.
+
+    Subtrees are placed from largest to smallest in rows along the shorter
+    side of the space that is left, and a subtree joins the current row for
+    as long as that does not make the row's worst aspect ratio worse.
+    Rectangle edges are rounded to whole pixels, so the rectangles still tile
+    the rect of <tree> without gaps or overlaps. Subtrees with no data get an
+    empty rectangle.
+
+    Precondition: tree._subtrees is not empty and tree.data_size >= 0.
+    """
+    width = tree._w
+    height = tree._h
+    items = [sub for sub in tree._subtrees if sub.data_size > 0]
+    total = sum(sub.data_size for sub in items)
+    if total == 0 or width <= 0 or height <= 0:
+        slice_and_dice_layout(tree)
+        return
+    for sub in tree._subtrees:
+        if sub.data_size <= 0:
+            sub._x, sub._y, sub._w, sub._h = tree._x, tree._y, 0, 0
+    items.sort(key=lambda sub: sub.data_size, reverse=True)
+
+    scale = width * height / total
+    free = [float(tree._x), float(tree._y), float(width), float(height)]
+    row = []
+    row_area = 0.0
+    row_worst = 0.0
+    for sub in items:
+        area = sub.data_size * scale
+        side = min(free[2], free[3])
+        if row == []:
+            worst = _worst_aspect_ratio(area, area, area, side)
+        else:
+            worst = _worst_aspect_ratio(row_area + area,
+                                        row[0].data_size * scale, area, side)
+            if worst > row_worst:
+                _place_row(tree, row, row_area, scale, free, False)
+                row = []
+                row_area = 0.0
+                side = min(free[2], free[3])
+                worst = _worst_aspect_ratio(area, area, area, side)
+        row.append(sub)
+        row_area += area
+        row_worst = worst
+    _place_row(tree, row, row_area, scale, free, True)
+
+
+# The layouts whose rects a snapshot can keep, by their id in the snapshot.
+_SNAPSHOT_LAYOUTS = [slice_and_dice_layout, squarified_layout]
+
+
+def _worst_aspect_ratio(row_area: float, largest: float, smallest: float,
+                        side: float) -> float:
+    """Return the worst aspect ratio among the rectangles of a row laid
+    along a side of length <side>, where the row has total area <row_area>
+    and its largest and smallest rectangles have areas <largest> and
+    <smallest>.
+    """
+    side_squared = side * side
+    area_squared = row_area * row_area
+    return max(side_squared * largest / area_squared,
+               area_squared / (side_squared * smallest))
+
+
+def _place_row(tree: TMTree, row: List[TMTree], row_area: float,
+               scale: float, free: List[float], last_row: bool) -> None:
+    """Set the rects of the subtrees of <tree> in <row> as one row along the
+    shorter side of the space <free> = [x, y, width, height] that is left in
+    the rect of <tree>, then remove the row from <free>. Each unit of
+    data_size has area <scale>, so the row has area <row_area>.
+
+    If <last_row>, the row takes all of the space that is left.
+    """
+    x, y, width, height = free
+    if width >= height:
+        # A column on the left of the space that is left.
+        thickness = width if last_row else row_area / height
+        left = _to_pixel(x)
+        right = tree._x + tree._w if last_row else _to_pixel(x + thickness)
+        top = y
+        for sub in row[:-1]:
+            bottom = top + sub.data_size * scale / thickness
+            sub._x, sub._w = left, right - left
+            sub._y = _to_pixel(top)
+            sub._h = _to_pixel(bottom) - sub._y
+            top = bottom
+        last = row[-1]
+        last._x, last._w = left, right - left
+        last._y = _to_pixel(top)
+        last._h = tree._y + tree._h - last._y
+        free[0] = x + thickness
+        free[2] = width - thickness
+    else:
+        # A row along the top of the space that is left.
+        thickness = height if last_row else row_area / width
+        top = _to_pixel(y)
+        bottom = tree._y + tree._h if last_row else _to_pixel(y + thickness)
+        left = x
+        for sub in row[:-1]:
+            right = left + sub.data_size * scale / thickness
+            sub._y, sub._h = top, bottom - top
+            sub._x = _to_pixel(left)
+            sub._w = _to_pixel(right) - sub._x
+            left = right
+        last = row[-1]
+        last._y, last._h = top, bottom - top
+        last._x = _to_pixel(left)
+        last._w = tree._x + tree._w - last._x
+        free[1] = y + thickness
+        free[3] = height - thickness
+
+
+def _to_pixel(coordinate: float) -> int:
+    """Return <coordinate> rounded to the nearest whole pixel.
+    """
+    return math.floor(coordinate + 0.5)
+
+
+LayoutStrategy = Callable[[TMTree], None]
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -345,23 +1352,328 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
+
+    A tree scanned lazily lists each folder only when it is first needed.
+    Until then the folder is a leaf that is pending, and its data_size is an
+    estimate, replaced by refresh_sizes once a background scan has found
+    the folder's total size. A streamed tree is built the same way, but a
+    background scan lists every folder, and refresh_sizes adds the folders
+    listed so far to the tree.
+
+    === Private Attributes ===
+    _pending:
+        The folder this tree represents if it has not been listed yet, or
+        None if it has been, or if this tree is a file.
+    _lazy:
+        The lazy scan this tree is part of, or None if it was scanned all at
+        once.
     """
 
-    def __init__(self, path: str) -> None:
+    __slots__ = ('_pending', '_lazy')
+
+    _pending: Optional[PendingFolder]
+    _lazy: Optional[_LazyScan]
+
+    def __init__(self, path: str, options: Optional[ScanOptions] = None,
+                 lazy: bool = False, cache: Optional[str] = None,
+                 stream: bool = False) -> None:
         """Store the file tree structure contained in the given file or folder.
 
+        <options> controls how the file system is scanned, e.g. how symbolic
+        links are handled; see fs_scan.ScanOptions.
+
+        If <lazy>, only list the folder at <path> itself for now. Each folder
+        in it is listed when it is expanded, or found by
+        get_tree_at_position, and the total sizes of the folders are found
+        on a background thread.
+
+        If <stream>, only list the folder at <path> itself for now, as with
+        <lazy>, and list every other folder on a background thread. Each
+        call to refresh_sizes adds the folders listed since the last call to
+        this tree, so that it can be drawn while it is being scanned.
+
+        If <cache> is not None, the scan is saved in the file at that path,
+        and the next tree built with the same <cache> only lists the folders
+        whose modification time changed; see fs_scan.scan_incremental.
+
+        <options> can also prune the tree; see fs_scan.ScanOptions. A folder
+        below options.max_depth is a leaf, with the total size of everything
+        under it, but a folder and not a file, like a pending folder.
+
         Precondition: <path> is a valid path for this computer.
+        Precondition: at most one of <lazy>, <stream> and <cache> is given,
+        and none of them if options.max_depth is not None.
         """
-        if os.path.isdir(path):
-            subtrees = []
-            for f in os.listdir(path):
-                i = os.path.join(path, f)
-                subtrees.append(FileSystemTree(i))
-            TMTree.__init__(self, os.path.basename(path), subtrees,
-                            os.path.getsize(path))
+        if cache is not None:
+            self._build(ScanCache(cache).scan(path, options), None)
+        elif lazy or stream:
+            result = scan(path, options, depth=1)
+            pending = [result.pending[i] for i in sorted(result.pending)]
+            if stream:
+                lazy_scan = _LazyScan(path, options, None,
+                                      StreamingScan(pending, options))
+            else:
+                lazy_scan = _LazyScan(path, options,
+                                      FolderSizes(pending, options), None)
+            self._build(result, lazy_scan)
         else:
-            TMTree.__init__(self, os.path.basename(path), [],
-                            os.path.getsize(path))
+            self._build(scan(path, options), None)
+
+    def _build(self, result: ScanResult, lazy: Optional[_LazyScan]) -> None:
+        """A private helper method that makes this tree the root of the
+        trees for the entries in <result>, which are part of the lazy scan
+        <lazy>, if it is not None.
+        """
+        # Every entry comes after its folder, so initializing the nodes in
+        # reverse order initializes every subtree before the tree containing
+        # it.
+        names = result.names
+        first_child = result.first_child
+        child_count = result.child_count
+        pending = result.pending
+        nodes = [self]
+        for _ in range(len(names) - 1):
+            nodes.append(FileSystemTree.__new__(type(self)))
+        for i in range(len(nodes) - 1, -1, -1):
+            node = nodes[i]
+            node._pending = pending.get(i)
+            node._lazy = lazy
+            size = result.sizes[i]
+            if node._pending is not None and lazy is not None:
+                lazy.pending[node._pending[0]] = node
+                if lazy.sizes is not None:
+                    total = lazy.sizes.get(node._pending[0])
+                    if total is not None:
+                        size = total
+            first = first_child[i]
+            TMTree.__init__(node, names[i],
+                            nodes[first:first + child_count[i]], size)
+
+    def _list_subtrees(self, recursive: bool = False) -> None:
+        """A private helper method that lists the folder of this tree if it
+        is pending, and every pending folder under it if <recursive>.
+        """
+        TMTree._list_subtrees(self, recursive)
+        if self._lazy is None:
+            return
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._pending is not None:
+                tree._list_folder(None if recursive else 1)
+            elif recursive:
+                stack.extend(tree._subtrees)
+
+    def _is_unlisted(self) -> bool:
+        """A private helper method that returns whether the subtrees of
+        this tree have not been created yet, including when its folder is
+        still pending.
+        """
+        return self._pending is not None or TMTree._is_unlisted(self)
+
+    def _list_folder(self, depth: Optional[int]) -> None:
+        """A private helper method that lists the pending folder of this
+        tree, and the folders under it fewer than <depth> levels below it,
+        or all of them if <depth> is None.
+
+        The data_size of this tree and its ancestors becomes the sum of the
+        sizes of its new subtrees, and they are marked for layout.
+        """
+        self._add_listing(scan_pending(self._pending, self._lazy.options,
+                                       depth))
+
+    def _add_listing(self, result: ScanResult) -> None:
+        """A private helper method that makes the entries of <result>, a
+        scan of the pending folder of this tree, the subtrees of this tree.
+
+        The data_size of this tree and its ancestors becomes the sum of the
+        sizes of its new subtrees, and they are marked for layout.
+        """
+        lazy = self._lazy
+        listed = FileSystemTree.__new__(type(self))
+        listed._build(result, lazy)
+        path = self._pending[0]
+        del lazy.pending[path]
+        self._pending = None
+        self._subtrees = listed._subtrees
+        for sub in self._subtrees:
+            sub._parent_tree = self
+        self._add_size_to_ancestors(listed.data_size - self.data_size)
+        self.data_size = listed.data_size
+        self._mark_dirty()
+        if path in lazy.deferred:
+            root = self
+            while root._parent_tree is not None:
+                root = root._parent_tree
+            batch = _ChangeBatch(root, lazy.root, lazy.options)
+            # A tree removed from the tree since it was pending is left.
+            if batch._path_of(self) == path:
+                batch.check_all(lazy.deferred.pop(path))
+                batch.finish()
+        if path in lazy.expanding:
+            lazy.expanding.remove(path)
+            if self._parent_tree is None or self._parent_tree._expanded:
+                self._expand_streamed()
+
+    def expand_all(self) -> None:
+        """Expand the tree corresponding to the chosen rectangle, as well as
+        all of its subtrees in the displayed tree.
+
+        The folders of a streamed tree that have not been listed yet are
+        left to its background scan, rather than scanned again here, and
+        expanded when refresh_sizes adds them to the tree.
+        """
+        if self._lazy is None or self._lazy.stream is None:
+            TMTree.expand_all(self)
+        else:
+            self._expand_streamed()
+
+    def _expand_streamed(self) -> None:
+        """A private helper method that expands this tree and every
+        descendant of it that has been listed, and records the pending
+        folders under it, so that they are expanded when they are listed.
+        """
+        expanding = self._lazy.expanding
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if tree._pending is not None:
+                expanding.add(tree._pending[0])
+            stack.extend(tree._subtrees)
+        self._expand_listed()
+
+    def refresh_sizes(self, block: bool = False,
+                      max_seconds: Optional[float] = None) -> bool:
+        """Apply what the background scan of the tree this tree is part of
+        has found since the last call, and return whether the tree changed.
+        If <block>, first wait for the background scan to finish.
+
+        For a lazy tree, each pending folder is given the total size found
+        for it. For a streamed tree, the folders listed are added to the
+        tree, for at most about <max_seconds> if it is not None, leaving the
+        rest for the next call.
+
+        The trees that changed are marked for layout, so a call to
+        update_dirty_rectangles lays them out. A tree that was scanned all
+        at once never changes.
+        """
+        lazy = self._lazy
+        if lazy is None:
+            return False
+        changed = False
+        if lazy.sizes is not None:
+            for path, total in lazy.sizes.take_finished(block).items():
+                tree = lazy.pending.get(path)
+                if tree is not None and tree.data_size != total:
+                    tree._add_size_to_ancestors(total - tree.data_size)
+                    tree.data_size = total
+                    tree._parent_tree._mark_dirty()
+                    changed = True
+        if lazy.stream is not None:
+            deadline = None
+            if max_seconds is not None:
+                deadline = time.perf_counter() + max_seconds
+            listing = lazy.stream.next_listing(block)
+            while listing is not None:
+                tree = lazy.pending.get(listing[0])
+                if tree is not None:
+                    tree._add_listing(listing[1])
+                    changed = True
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                listing = lazy.stream.next_listing(block)
+        return changed
+
+    def get_scan_progress(self) -> str:
+        """Return a short description of how far the background scan of the
+        tree this tree is part of has got, or the empty string if it has
+        finished, or there is none.
+        """
+        lazy = self._lazy
+        if lazy is None:
+            return ''
+        if lazy.stream is not None and \
+                not (lazy.stream.is_done() and lazy.pending == {}):
+            return 'Scanning: {} entries, {} folders left'.format(
+                lazy.stream.entries, lazy.stream.left + len(lazy.pending))
+        if lazy.sizes is not None and not lazy.sizes.is_done():
+            return 'Sizing folders: {}/{}'.format(lazy.sizes.scanned,
+                                                  lazy.sizes.folder_count)
+        return ''
+
+    @timed('apply_changes')
+    def apply_changes(self, changes: Changes,
+                      options: Optional[ScanOptions] = None) -> bool:
+        """Update this tree with <changes>, recorded by a FileSystemWatcher
+        for the folder this tree was scanned from with <options>, and return
+        whether the tree changed.
+
+        Each renamed file or folder is moved to its new parent with its
+        subtrees. Each changed path is then checked again: a file or folder
+        that no longer exists is removed, a new one is scanned and added,
+        and a file that changed size adds the difference to its ancestors.
+        Only the ancestors of each change are visited, and the trees that
+        changed are marked for layout, so that one call to
+        update_dirty_rectangles lays out the whole batch.
+
+        Changes inside a folder that is still pending are left to the scan
+        that lists it, and checked again when a streamed tree adds it, since
+        the stream may have listed it before they happened. Changes inside a
+        folder below options.max_depth give it its new total size. If small
+        files are folded together, a changed file makes its folder's files
+        be listed again, so that they are folded again. If the watcher lost
+        changes, the whole folder is scanned again, the way this tree was: a
+        lazy or streamed tree only lists the folder itself, and starts its
+        background scan again.
+
+        Precondition: this tree is the root of a FileSystemTree of the
+        folder at changes.root.
+        """
+        if changes.overflowed:
+            self._rescan(changes.root, options)
+            return True
+
+        batch = _ChangeBatch(self, changes.root, options)
+        rechecked = set(changes.changed)
+        for old_path, new_path in changes.moved:
+            if not batch.move(old_path, new_path):
+                rechecked.add(old_path)
+            rechecked.add(new_path)
+        batch.check_all(rechecked)
+        return batch.finish()
+
+    def _rescan(self, path: str, options: Optional[ScanOptions]) -> None:
+        """A private helper method that replaces the subtrees of this tree
+        with a new scan of the folder at <path> with <options>, made the
+        way this tree was made. The background scan of a lazy or streamed
+        tree is stopped, and a new one is started.
+        """
+        lazy = self._lazy
+        if lazy is None:
+            rescanned = FileSystemTree(path, options)
+        else:
+            lazy.stop()
+            rescanned = FileSystemTree(path, options,
+                                       lazy=lazy.sizes is not None,
+                                       stream=lazy.stream is not None)
+        for sub in self._subtrees:
+            sub._parent_tree = None
+        self._subtrees = rescanned._subtrees
+        for sub in self._subtrees:
+            sub._parent_tree = self
+        self._lazy = rescanned._lazy
+        self.data_size = rescanned.data_size
+        if self._subtrees == []:
+            self._expanded = False
+        self._frontier = None
+        self._mark_dirty()
+
+    def _set_snapshot_fields(self, fields: List[str]) -> None:
+        """A private helper method that sets the fields of a tree loaded
+        from a snapshot, which is never pending.
+        """
+        self._pending = None
+        self._lazy = None
 
     def get_separator(self) -> str:
         """Return the file separator for this OS.
@@ -371,16 +1683,413 @@ class FileSystemTree(TMTree):
     def get_suffix(self) -> str:
         """Return the final descriptor of this tree.
         """
-        if len(self._subtrees) == 0:
+        if len(self._subtrees) == 0 and not self._is_unlisted():
             return ' (file)'
         else:
             return ' (folder)'
 
 
+class _LazyScan:
+    """The state shared by the trees of a lazily scanned FileSystemTree.
+
+    === Public Attributes ===
+    root:
+        The path of the folder the tree was scanned from.
+    options:
+        The settings for the scan.
+    sizes:
+        The background scan finding the total sizes of the folders that
+        were pending when the tree was built, or None if the tree is
+        streamed.
+    stream:
+        The background scan listing every folder of a streamed tree, or
+        None if the tree is lazy.
+    pending:
+        The trees whose folder is pending, by the path of their folder.
+    expanding:
+        The paths of the pending folders of a streamed tree that were under
+        a tree when expand_all was called on it, so that they are expanded
+        when they are listed.
+    deferred:
+        The changed paths inside each pending folder of a streamed tree, by
+        the path of the folder, which are checked again when it is added to
+        the tree, since the stream may have listed it before they changed.
+    """
+    root: str
+    options: Optional[ScanOptions]
+    sizes: Optional[FolderSizes]
+    stream: Optional[StreamingScan]
+    pending: Dict[str, FileSystemTree]
+    expanding: Set[str]
+    deferred: Dict[str, Set[str]]
+
+    def __init__(self, root: str, options: Optional[ScanOptions],
+                 sizes: Optional[FolderSizes],
+                 stream: Optional[StreamingScan]) -> None:
+        """Initialize the state of a lazy scan of the folder at <root> with
+        <options>, whose folder sizes are found by <sizes>, or whose folders
+        are listed by <stream>.
+        """
+        self.root = root
+        self.options = options
+        self.sizes = sizes
+        self.stream = stream
+        self.pending = {}
+        self.expanding = set()
+        self.deferred = {}
+
+    def stop(self) -> None:
+        """Stop the background scan, and forget the pending folders, whose
+        trees are no longer part of the tree.
+        """
+        if self.sizes is not None:
+            self.sizes.stop()
+        if self.stream is not None:
+            self.stream.stop()
+        self.pending = {}
+        self.expanding = set()
+        self.deferred = {}
+
+
+class _ChangeBatch:
+    """The state of FileSystemTree.apply_changes while it applies one batch
+    of changes.
+
+    Trees removed from their parent have their _parent_tree set to None,
+    and are only taken out of the parent's subtrees when the batch
+    finishes, in one pass per parent.
+
+    === Public Attributes ===
+    tree:
+        The root of the tree the changes are applied to.
+    root:
+        The path of the folder the tree was scanned from.
+    options:
+        The settings the tree was scanned with.
+    prefix:
+        The path of the folder the tree was scanned from, followed by a
+        separator.
+    folders:
+        The result of find for each folder looked up since the subtrees of
+        a tree last changed, by path.
+    children:
+        The subtrees of each folder looked at so far that are still in it,
+        by name.
+    changed:
+        The folders whose subtrees changed.
+    cutoffs:
+        The folders below options.max_depth that had changes inside them.
+    refolded:
+        The folders whose files have been listed again.
+    resized:
+        Whether the data_size of a tree changed.
+    """
+    tree: FileSystemTree
+    root: str
+    options: Optional[ScanOptions]
+    prefix: str
+    folders: Dict[str, Tuple[bool, Optional[FileSystemTree]]]
+    children: Dict[FileSystemTree, Dict[str, FileSystemTree]]
+    changed: Set[FileSystemTree]
+    cutoffs: Set[FileSystemTree]
+    refolded: Set[FileSystemTree]
+    resized: bool
+
+    def __init__(self, tree: FileSystemTree, root: str,
+                 options: Optional[ScanOptions]) -> None:
+        """Initialize an empty batch of changes to <tree>, scanned from the
+        folder at <root> with <options>.
+        """
+        self.tree = tree
+        self.root = root
+        self.options = options if options is not None else ScanOptions()
+        self.prefix = os.path.join(root, '')
+        self.folders = {}
+        self.children = {}
+        self.changed = set()
+        self.cutoffs = set()
+        self.refolded = set()
+        self.resized = False
+
+    def find(self, path: str) -> Tuple[bool, Optional[FileSystemTree]]:
+        """Return whether the tree for <path> can be known, and the tree for
+        <path>, or None if there is none.
+
+        It cannot be known if <path> is inside a pending folder, or outside
+        the folder the tree was scanned from. A pending folder of a tree that
+        is not lazy is below options.max_depth, and is recorded in
+        self.cutoffs.
+        """
+        if path == self.root:
+            return True, self.tree
+        if not path.startswith(self.prefix):
+            return False, None
+        folder, _, name = path.rpartition(os.sep)
+        found = self.folders.get(folder)
+        if found is None:
+            found = self.find(folder)
+            self.folders[folder] = found
+        known, parent = found
+        if parent is not None and parent._pending is not None:
+            if self.tree._lazy is None:
+                self.cutoffs.add(parent)
+            return False, None
+        elif parent is None:
+            return known, None
+        TMTree._list_subtrees(parent)
+        return True, self._children_of(parent).get(name)
+
+    def move(self, old_path: str, new_path: str) -> bool:
+        """Move the tree for <old_path> to <new_path>, keeping its subtrees,
+        and return whether it was moved.
+        """
+        known, tree = self.find(old_path)
+        known_parent, parent = self.find(os.path.dirname(new_path))
+        if not known or not known_parent or tree is None or \
+                parent is None or tree is self.tree:
+            return False
+        if (tree._subtrees != [] or tree._pending is not None) and \
+                (self.tree._lazy is not None or
+                 self.options.max_depth is not None):
+            # The pending folders under it would keep their old paths, and
+            # its depth may change.
+            return False
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is tree:
+                return False
+            ancestor = ancestor._parent_tree
+        replaced = self._children_of(parent).get(os.path.basename(new_path))
+        if replaced is not None and replaced is not tree:
+            self._remove(replaced)
+        self._remove(tree)
+        self._add(tree, parent, os.path.basename(new_path))
+        return True
+
+    def check_all(self, paths: Set[str]) -> None:
+        """Make the tree for each of <paths> match what is at it now.
+        """
+        # Check each folder before the paths in it, so that the paths in a
+        # folder that was removed are skipped. Separators sort before every
+        # other character this way.
+        for path in sorted(paths,
+                           key=lambda path: path.replace(os.sep, '\0')):
+            self.check(path)
+
+    def check(self, path: str) -> None:
+        """Make the tree for <path> match what is at <path> now.
+        """
+        known, tree = self.find(path)
+        if not known:
+            self._defer(path)
+            return
+        if tree is self.tree:
+            return
+        # Found by self.find(path) above.
+        parent = self.folders[path.rpartition(os.sep)[0]][1]
+        if parent is None:
+            return
+        entry = check_entry(path, self.root, self.options)
+        if self.options.folds_files() and (entry is None or
+                                           entry[1] is None) and \
+                (tree is None or tree._subtrees == [] and
+                 tree._pending is None):
+            # A file, which may be folded into the small files of its
+            # folder, or the small files entry itself.
+            self._refold(parent)
+            return
+        if entry is None:
+            if tree is not None:
+                self._remove(tree)
+            return
+        size, folder = entry
+        if tree is not None and (tree._subtrees != [] or
+                                 tree._pending is not None):
+            # A folder whose entries are checked one at a time, unless it
+            # is now a file.
+            if folder is None:
+                self._replace(tree, path, size, None)
+        elif tree is not None and folder is None:
+            if tree.data_size != size:
+                tree._add_size_to_ancestors(size - tree.data_size)
+                tree.data_size = size
+                tree._parent_tree._mark_dirty()
+                self.resized = True
+        elif tree is not None:
+            # An empty folder, or a file that is now a folder.
+            self._replace(tree, path, size, folder)
+        else:
+            self._add(self._scanned(path, size, folder), parent,
+                      os.path.basename(path))
+
+    def finish(self) -> bool:
+        """Take the removed trees out of their parents' subtrees, and return
+        whether the tree changed.
+        """
+        for parent in self.changed:
+            parent._remove_moved_subtrees()
+            if parent._subtrees == [] and \
+                    (parent._parent_tree is not None or parent is self.tree):
+                # An empty folder is a leaf with the size of the folder
+                # itself.
+                parent._expanded = False
+                entry = check_entry(self._path_of(parent), self.root,
+                                    self.options)
+                if entry is not None:
+                    parent._add_size_to_ancestors(entry[0] -
+                                                  parent.data_size)
+                    parent.data_size = entry[0]
+        for cutoff in self.cutoffs:
+            if cutoff._parent_tree is not None:
+                total = folder_total(cutoff._pending, self.options)
+                if total != cutoff.data_size:
+                    cutoff._add_size_to_ancestors(total - cutoff.data_size)
+                    cutoff.data_size = total
+                    cutoff._parent_tree._mark_dirty()
+                    self.resized = True
+        if self.changed != set():
+            self.tree._frontier = None
+        return self.changed != set() or self.resized
+
+    def _defer(self, path: str) -> None:
+        """Record <path>, if it is inside a pending folder of a streamed
+        tree, so that it is checked again when the folder is added to the
+        tree.
+        """
+        lazy = self.tree._lazy
+        if lazy is None or lazy.stream is None or \
+                not path.startswith(self.prefix):
+            return
+        folder = os.path.dirname(path)
+        while folder not in lazy.pending:
+            if not folder.startswith(self.prefix):
+                return
+            folder = os.path.dirname(folder)
+        lazy.deferred.setdefault(folder, set()).add(path)
+
+    def _children_of(self, tree: FileSystemTree) -> Dict[str,
+                                                         FileSystemTree]:
+        """Return the subtrees of <tree> that are still in it, by name.
+        """
+        children = self.children.get(tree)
+        if children is None:
+            children = {sub._name: sub for sub in tree._subtrees
+                        if sub._parent_tree is tree}
+            self.children[tree] = children
+        return children
+
+    def _remove(self, tree: FileSystemTree) -> None:
+        """Remove <tree> from its parent.
+        """
+        parent = tree._parent_tree
+        del self._children_of(parent)[tree._name]
+        tree._add_size_to_ancestors(-tree.data_size)
+        tree._parent_tree = None
+        parent._mark_dirty()
+        self.changed.add(parent)
+        self.folders = {}
+
+    def _add(self, tree: FileSystemTree, parent: FileSystemTree,
+             name: str) -> None:
+        """Add <tree>, which has no parent, to the subtrees of <parent> as
+        <name>.
+        """
+        children = self._children_of(parent)
+        if children == {}:
+            # <parent> was an empty folder, whose size was its own.
+            parent._add_size_to_ancestors(-parent.data_size)
+            parent.data_size = 0
+        children[name] = tree
+        tree._name = name
+        parent._subtrees.append(tree)
+        tree._parent_tree = parent
+        tree._clear_paths()
+        tree._add_size_to_ancestors(tree.data_size)
+        parent._mark_dirty()
+        self.changed.add(parent)
+        self.folders = {}
+
+    def _replace(self, tree: FileSystemTree, path: str, size: int,
+                 folder: Optional[PendingFolder]) -> None:
+        """Replace <tree> with a new scan of <path>, which has <size>, and
+        is the pending folder <folder>, or a file if <folder> is None.
+        """
+        parent = tree._parent_tree
+        self._remove(tree)
+        self._add(self._scanned(path, size, folder), parent, tree._name)
+
+    def _refold(self, parent: FileSystemTree) -> None:
+        """List the folder of <parent> again, and replace the files in it
+        that changed, including its small files entry.
+        """
+        if parent in self.refolded:
+            return
+        self.refolded.add(parent)
+        path = self._path_of(parent)
+        entry = check_entry(path, self.root, self.options)
+        if entry is None or entry[1] is None:
+            # The folder itself changed, and is checked on its own.
+            return
+        result = scan_pending(entry[1], self.options, depth=1)
+        first = result.first_child[0]
+        files = {}
+        folders = set()
+        for i in range(first, first + result.child_count[0]):
+            if i in result.pending:
+                folders.add(result.names[i])
+            else:
+                files[result.names[i]] = result.sizes[i]
+        children = self._children_of(parent)
+        for name, sub in list(children.items()):
+            if sub._subtrees == [] and sub._pending is None:
+                if files.get(name) == sub.data_size:
+                    del files[name]
+                elif name not in folders:
+                    self._remove(sub)
+        for name, size in files.items():
+            if name not in children:
+                self._add(self._scanned(os.path.join(path, name), size,
+                                        None), parent, name)
+
+    def _scanned(self, path: str, size: int,
+                 folder: Optional[PendingFolder]) -> FileSystemTree:
+        """Return a new tree for <path>, which has <size>, and is the
+        pending folder <folder>, or a file if <folder> is None.
+        """
+        options = self.options
+        if options.max_depth is not None and folder is not None:
+            depth = path[len(self.prefix):].count(os.sep) + 1
+            options = options.below(depth)
+        if folder is None:
+            result = ScanResult()
+            result.add(os.path.basename(path), size)
+        elif options is None:
+            result = ScanResult()
+            result.add(os.path.basename(path),
+                       folder_total(folder, self.options))
+            result.pending[0] = folder
+        else:
+            result = scan_pending(folder, options)
+        tree = FileSystemTree.__new__(type(self.tree))
+        tree._build(result, None)
+        return tree
+
+    def _path_of(self, tree: FileSystemTree) -> str:
+        """Return the path of the file or folder of <tree>.
+        """
+        names = []
+        while tree is not self.tree:
+            names.append(tree._name)
+            tree = tree._parent_tree
+        return os.path.join(self.root, *reversed(names))
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'os', 'sys', 'time', 'zlib',
+            '__future__',
+            'instrumentation', 'fs_scan', 'fs_watch', 'snapshot'
         ]
     })
@@ -0,0 +1,1384 @@
+"""Assignment 2 - Tests for the TMTree performance features
+
+=== Module Description ===
+This module contains tests for the incremental and scalable parts of the
+TMTree interface. Unlike a2_sample_test.py, these tests build their trees
+in memory, so they do not need the example-directory to be downloaded.
+"""
+from __future__ import annotations
+import csv
+import io
+import json
+import os
+import pathlib
+import random
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+import fs_scan
+import fs_watch
+import instrumentation
+import papers
+import snapshot
+import tm_trees
+from fs_scan import ScanCache, ScanOptions, scan
+from fs_watch import Changes, FileSystemWatcher
+from tm_trees import TMTree, FileSystemTree, set_colour_seed, \
+    squarified_layout
+from papers import PaperTree
+
+
+# The directory with the JSON fixtures of paper trees.
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'DATA_FILE')
+
+
+class _SimpleTree(TMTree):
+    """A minimal concrete TMTree used to build trees for these tests.
+    """
+
+    def get_separator(self) -> str:
+        """Return the separator used between names in a path.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the suffix used at the end of a path.
+        """
+        return ''
+
+
+def test_dirty_rectangles_match_full_layout() -> None:
+    """Test that incremental relayout after a mix of change_size and move
+    gives exactly the rectangles of a full update_rectangles.
+    """
+    for seed in range(20):
+        tree = _random_tree(seed)
+        twin = _random_tree(seed)
+        tree.update_rectangles((0, 0, 800, 570))
+        twin.update_rectangles((0, 0, 800, 570))
+
+        rng = random.Random(seed)
+        for _ in range(30):
+            _apply_random_op(rng, tree)
+            tree.update_dirty_rectangles((0, 0, 800, 570))
+        rng = random.Random(seed)
+        for _ in range(30):
+            _apply_random_op(rng, twin)
+            twin.update_data_sizes()
+        twin.update_rectangles((0, 0, 800, 570))
+
+        assert _all_rects(tree) == _all_rects(twin)
+
+
+def test_dirty_rectangles_new_area() -> None:
+    """Test that incremental relayout into a different area lays out the
+    whole tree again.
+    """
+    tree = _random_tree(3)
+    tree.update_rectangles((0, 0, 800, 570))
+    tree.update_dirty_rectangles((10, 20, 300, 400))
+    twin = _random_tree(3)
+    twin.update_rectangles((10, 20, 300, 400))
+    assert _all_rects(tree) == _all_rects(twin)
+
+
+def test_size_deltas_match_update_data_sizes() -> None:
+    """Test that change_size and move keep every ancestor's data_size equal
+    to what a full update_data_sizes computes.
+    """
+    for seed in range(20):
+        tree = _random_tree(seed)
+        rng = random.Random(seed)
+        for _ in range(50):
+            _apply_random_op(rng, tree)
+        sizes = [node.data_size for node in _preorder(tree)]
+        tree.update_data_sizes()
+        assert sizes == [node.data_size for node in _preorder(tree)]
+
+
+def test_move_updates_both_ancestor_chains() -> None:
+    """Test that move subtracts from the old ancestors and adds to the new.
+    """
+    leaf = _SimpleTree('leaf', [], 10)
+    old_parent = _SimpleTree('old', [leaf, _SimpleTree('a', [], 5)])
+    new_parent = _SimpleTree('new', [_SimpleTree('b', [], 7)])
+    root = _SimpleTree('root', [_SimpleTree('mid', [old_parent]), new_parent])
+    assert root.data_size == 22
+
+    leaf.move(new_parent)
+    assert old_parent.data_size == 5
+    assert old_parent._parent_tree.data_size == 5
+    assert new_parent.data_size == 17
+    assert root.data_size == 22
+
+
+def test_tree_at_position_matches_full_scan() -> None:
+    """Test that the binary-search hit test returns the same leaf as scanning
+    every subtree, including on shared edges and with zero-size subtrees.
+    """
+    for seed in range(20):
+        tree = _random_tree(seed)
+        rng = random.Random(seed)
+        for node in _preorder(tree):
+            if rng.random() < 0.7:
+                node.expand()
+        tree.update_rectangles((0, 0, 120, 90))
+        for x in range(-1, 122):
+            for y in range(-1, 92, 3):
+                assert tree.get_tree_at_position((x, y)) is \
+                    _scan_tree_at_position(tree, (x, y))
+
+
+def test_deep_tree_does_not_recurse() -> None:
+    """Test that the traversals work on a tree much deeper than the
+    recursion limit.
+    """
+    depth = sys.getrecursionlimit() * 5
+    tree = _SimpleTree('leaf', [], 3)
+    deepest = tree
+    for i in range(depth):
+        tree = _SimpleTree('n{}'.format(i), [tree, _SimpleTree('x', [], 1)])
+
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 800, 570))
+    assert len(tree.get_rectangles()) == depth + 1
+    assert tree.get_tree_at_position((799, 569)) is not None
+    assert tree.update_data_sizes() == depth + 3
+    assert deepest.get_path_string().count('/') == depth
+    deepest.collapse_all()
+    assert tree.get_rectangles() == [(tree.rect, tree._colour)]
+
+
+def test_deep_file_system_tree(tmp_path: pathlib.Path) -> None:
+    """Test building a FileSystemTree for folders nested deeper than the
+    recursion limit.
+    """
+    depth = sys.getrecursionlimit() + 100
+    path = str(tmp_path)
+    for _ in range(depth):
+        path = os.path.join(path, 'd')
+        os.mkdir(path)
+    with open(os.path.join(path, 'file.txt'), 'w') as f:
+        f.write('hello')
+
+    try:
+        tree = FileSystemTree(os.path.join(str(tmp_path), 'd'))
+        assert tree.data_size == 5
+        leaf = tree
+        while leaf._subtrees != []:
+            leaf = leaf._subtrees[0]
+        assert leaf._name == 'file.txt'
+        assert leaf.get_path_string().endswith(os.sep + 'file.txt (file)')
+    finally:
+        # shutil.rmtree recurses, so pytest could not clean this up itself.
+        os.remove(os.path.join(path, 'file.txt'))
+        while path != str(tmp_path):
+            os.rmdir(path)
+            path = os.path.dirname(path)
+
+
+def test_slotted_nodes(tmp_path: pathlib.Path) -> None:
+    """Test that the concrete trees have no per-node __dict__ and that rect
+    and _colour still read and write as tuples.
+    """
+    (tmp_path / 'a.txt').write_text('abc')
+    tree = FileSystemTree(str(tmp_path))
+    paper = PaperTree('paper', [], 'Author', 'doi', 3)
+    for node in (tree, tree._subtrees[0], paper):
+        assert not hasattr(node, '__dict__')
+
+    tree.rect = (1, 2, 3, 4)
+    tree._colour = (10, 20, 30)
+    assert tree.rect == (1, 2, 3, 4)
+    assert tree._colour == (10, 20, 30)
+    assert tree.get_rectangles() == [((1, 2, 3, 4), (10, 20, 30))]
+
+    # Only the root of a whole tree keeps a layout strategy and frontier.
+    tree.set_layout_strategy(squarified_layout)
+    assert tree._root_state is not None
+    assert tree._subtrees[0]._root_state is None
+    assert tree._subtrees[0].get_layout_strategy() is squarified_layout
+    top = TMTree('top', [tree])
+    assert tree._root_state is None
+    assert tree.get_layout_strategy() is top.get_layout_strategy()
+
+
+def test_iter_rectangles_streams_get_rectangles() -> None:
+    """Test that iter_rectangles yields exactly what get_rectangles returns,
+    one tuple at a time.
+    """
+    for seed in range(10):
+        tree = _random_tree(seed)
+        rng = random.Random(seed)
+        for node in _preorder(tree):
+            if rng.random() < 0.7:
+                node.expand()
+        tree.update_rectangles((0, 0, 800, 570))
+        rectangles = tree.iter_rectangles()
+        assert not isinstance(rectangles, list)
+        assert list(rectangles) == tree.get_rectangles()
+
+
+def test_cached_frontier_matches_walk() -> None:
+    """Test that the root's cached display frontier stays equal to walking
+    the displayed-tree through random expands, collapses and moves.
+    """
+    for seed in range(30):
+        tree = _random_tree(seed)
+        rng = random.Random(seed)
+        tree.get_rectangles()
+        for _ in range(60):
+            nodes = _preorder(tree)
+            node = rng.choice(nodes)
+            op = rng.randrange(5)
+            if op == 0:
+                node.expand()
+            elif op == 1:
+                node.expand_all()
+            elif op == 2:
+                node.collapse()
+            elif op == 3 and rng.random() < 0.2:
+                node.collapse_all()
+            else:
+                _apply_random_op(rng, tree)
+            assert tree._frontier is None or \
+                list(tree._frontier) == tree._displayed_trees()
+            tree.update_rectangles((0, 0, 200, 100))
+            assert tree.get_rectangles() == list(_walk_rectangles(tree))
+
+    # Moving away the last subtree of an expanded tree makes it a displayed
+    # leaf, which can then be moved too.
+    a = _SimpleTree('a', [], 5)
+    b = _SimpleTree('b', [a])
+    c = _SimpleTree('c', [], 3)
+    d = _SimpleTree('d', [c])
+    root = _SimpleTree('r', [b, d])
+    root.update_rectangles((0, 0, 100, 100))
+    root.expand_all()
+    root.get_rectangles()
+    a.move(d)
+    assert not b._expanded
+    assert list(root._frontier) == root._displayed_trees() == [b, c, a]
+    b.move(d)
+    assert list(root._frontier) == root._displayed_trees() == [c, a, b]
+    c.move(d)
+    assert list(root._frontier) == root._displayed_trees() == [a, b, c]
+
+
+def test_apply_batch_matches_one_at_a_time() -> None:
+    """Test that apply_batch gives the same tree, data sizes and rectangles
+    as calling change_size and move for each operation in turn.
+    """
+    for seed in range(30):
+        tree = _random_tree(seed)
+        twin = _random_tree(seed)
+        tree.expand_all()
+        twin.expand_all()
+        tree.update_rectangles((0, 0, 300, 200))
+        tree.get_rectangles()
+        nodes = _preorder(tree)
+        twin_nodes = _preorder(twin)
+        rng = random.Random(seed)
+        operations = []
+        for _ in range(40):
+            i = rng.randrange(len(nodes))
+            if rng.random() < 0.5:
+                operations.append(('change_size', i,
+                                   rng.choice([0.01, -0.5, 3])))
+            else:
+                operations.append(('move', i, rng.randrange(len(nodes))))
+
+        tree.apply_batch([(op, nodes[i], nodes[arg] if op == 'move' else arg)
+                          for op, i, arg in operations])
+        for op, i, arg in operations:
+            if op == 'move':
+                twin_nodes[i].move(twin_nodes[arg])
+            else:
+                twin_nodes[i].change_size(arg)
+        twin.update_rectangles((0, 0, 300, 200))
+
+        assert _all_rects(tree) == _all_rects(twin)
+        assert [node.data_size for node in _preorder(tree)] == \
+            [node.data_size for node in _preorder(twin)]
+        assert [rect for rect, _ in tree.get_rectangles()] == \
+            [rect for rect, _ in twin.get_rectangles()]
+        for node in _preorder(tree):
+            for sub in node._subtrees:
+                assert sub._parent_tree is node
+
+
+def test_apply_batch_rejects_unknown_operation() -> None:
+    """Test that apply_batch changes nothing when an operation is unknown.
+    """
+    leaf = _SimpleTree('leaf', [], 10)
+    tree = _SimpleTree('root', [leaf, _SimpleTree('other', [], 5)])
+    with pytest.raises(ValueError):
+        tree.apply_batch([('change_size', leaf, 1), ('delete', leaf, None)])
+    assert leaf.data_size == 10
+
+
+def test_cached_paths_follow_moves() -> None:
+    """Test that cached path strings are rebuilt for trees that moved or
+    became part of a larger tree.
+    """
+    for seed in range(10):
+        tree = _random_tree(seed)
+        rng = random.Random(seed)
+        for _ in range(40):
+            rng.choice(_preorder(tree)).get_path_string()
+            _apply_random_op(rng, tree)
+            for node in _preorder(tree):
+                assert node.get_path_string() == _uncached_path(node)
+
+    inner = _SimpleTree('inner', [_SimpleTree('leaf', [], 1)])
+    assert inner._subtrees[0].get_path_string() == 'inner/leaf'
+    outer = _SimpleTree('outer', [inner])
+    assert inner._subtrees[0].get_path_string() == 'outer/inner/leaf'
+    assert outer.get_path_string() == 'outer'
+
+
+def test_colours_are_lazy_and_deterministic() -> None:
+    """Test that colours are only computed when first needed, are the same
+    for the same path in every tree, and change with the colour seed.
+    """
+    tree = _random_tree(1)
+    assert all(node._rgb == -1 for node in _preorder(tree))
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 800, 570))
+    colours = tree.get_rectangles()
+    twin = _random_tree(1)
+    twin.expand_all()
+    twin.update_rectangles((0, 0, 800, 570))
+    assert twin.get_rectangles() == colours
+    assert len({colour for _, colour in colours}) > len(colours) // 2
+    for _, colour in colours:
+        assert all(0 <= c <= 255 for c in colour)
+
+    try:
+        set_colour_seed(7)
+        other = _random_tree(1)
+        other.expand_all()
+        other.update_rectangles((0, 0, 800, 570))
+        assert other.get_rectangles() != colours
+    finally:
+        set_colour_seed(0)
+
+
+def test_instrumentation_records_operations_and_frames() -> None:
+    """Test that enabled instrumentation records calls, nodes visited and
+    frames, and writes them as JSON lines, and that disabled
+    instrumentation records nothing.
+    """
+    tree = _random_tree(2)
+    n = len(_preorder(tree))
+    tree.expand_all()
+    instrumentation.reset()
+    tree.update_rectangles((0, 0, 800, 570))
+    assert instrumentation.get_stats().operations == {}
+
+    try:
+        instrumentation.enable()
+        tree.update_rectangles((0, 0, 800, 570))
+        tree.get_tree_at_position((10, 10))
+        instrumentation.end_frame()
+        assert tree.update_data_sizes() == tree.data_size
+        tree.get_rectangles()
+        instrumentation.end_frame()
+    finally:
+        instrumentation.disable()
+
+    stats = instrumentation.get_stats()
+    assert stats.operations['update_rectangles'].calls == 1
+    assert stats.operations['update_rectangles'].nodes == n
+    assert stats.operations['update_data_sizes'].nodes == n
+    assert stats.operations['get_tree_at_position'].nodes > 0
+    assert stats.operations['get_rectangles'].nodes == \
+        len(tree.get_rectangles())
+    assert [list(frame.operations) for frame in stats.frames] == \
+        [['update_rectangles', 'get_tree_at_position'],
+         ['update_data_sizes', 'get_rectangles']]
+
+    stream = io.StringIO()
+    stats.write_json_lines(stream)
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == len(stats.operations) + 2
+    assert lines[-1]['frame'] == 1
+    instrumentation.reset()
+
+
+def test_benchmark_suite_shapes_and_baseline(
+        tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the benchmark suite builds trees of about the requested
+    size in every shape, reading the paper datasets it is given rather than
+    papers.DATA_FILE, and flags results slower than the baseline.
+    """
+    import benchmark_suite
+
+    monkeypatch.setattr(papers, 'DATA_FILE', str(tmp_path / 'missing.csv'))
+    for shape in benchmark_suite.SHAPES:
+        tree = benchmark_suite.build_tree(shape, 2000)
+        assert 1000 <= len(_preorder(tree)) <= 4000
+
+    baseline = str(tmp_path / 'baseline.json')
+    benchmark_suite.save_results({'a': 1.0, 'b': 1.0}, baseline)
+    assert benchmark_suite.compare_results({'a': 1.1, 'b': 2.0}, baseline,
+                                           1.25) == ['b']
+
+
+def test_scandir_scan_matches_listdir(tmp_path: pathlib.Path) -> None:
+    """Test that FileSystemTree gives the same tree as listing every folder
+    with os.listdir and os.path.getsize, including empty folders and
+    symbolic links that do not loop.
+    """
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'empty').mkdir()
+    (tmp_path / 'a' / 'x.txt').write_text('hello')
+    (tmp_path / 'a' / 'b' / 'y.txt').write_text('hi')
+    (tmp_path / 'z.txt').write_text('')
+    (tmp_path / 'link_to_b').symlink_to(tmp_path / 'a' / 'b')
+    (tmp_path / 'link_to_x').symlink_to(tmp_path / 'a' / 'x.txt')
+
+    tree = FileSystemTree(str(tmp_path))
+    assert _fs_shape(tree) == _listdir_shape(str(tmp_path))
+
+
+def test_scan_symlink_policies(tmp_path: pathlib.Path) -> None:
+    """Test that a symbolic link loop is scanned as a file when following
+    links, and that links can be scanned as files or skipped.
+    """
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'x.txt').write_text('hello')
+    (tmp_path / 'a' / 'loop').symlink_to(tmp_path)
+    (tmp_path / 'broken').symlink_to(tmp_path / 'missing')
+
+    followed = FileSystemTree(str(tmp_path), ScanOptions('follow'))
+    a = [sub for sub in followed._subtrees if sub._name == 'a'][0]
+    loop = [sub for sub in a._subtrees if sub._name == 'loop'][0]
+    assert loop._subtrees == []
+    assert loop.data_size == len(str(tmp_path))
+    assert len(followed._subtrees) == 2
+
+    as_files = FileSystemTree(str(tmp_path), ScanOptions('file'))
+    assert sorted(_preorder_names(as_files)) == \
+        sorted([tmp_path.name, 'a', 'x.txt', 'loop', 'broken'])
+    skipped = FileSystemTree(str(tmp_path), ScanOptions('skip'))
+    assert sorted(_preorder_names(skipped)) == \
+        sorted([tmp_path.name, 'a', 'x.txt'])
+    with pytest.raises(ValueError):
+        ScanOptions('recurse')
+
+    # A folder is keyed by its own device, not by that of its parent, so
+    # that loops are found across mount points.
+    a_stat = os.stat(str(tmp_path / 'a'))
+    entries, _ = fs_scan._scan_folder(str(tmp_path), ((-1, 0), None),
+                                      ScanOptions())
+    assert [entry[3][0] for entry in entries if entry[0] == 'a'] == \
+        [(a_stat.st_dev, a_stat.st_ino)]
+
+
+def test_parallel_scan_matches_serial(tmp_path: pathlib.Path) -> None:
+    """Test that scanning with several workers gives the same entries, in
+    the same order, as scanning with one, and reports its throughput.
+    """
+    rng = random.Random(16)
+    folders = [tmp_path]
+    for i in range(60):
+        parent = rng.choice(folders)
+        if rng.random() < 0.3:
+            folders.append(parent / 'd{}'.format(i))
+            folders[-1].mkdir()
+        else:
+            (parent / 'f{}'.format(i)).write_text('x' * rng.randint(0, 50))
+    (folders[-1] / 'loop').symlink_to(tmp_path)
+
+    serial = scan(str(tmp_path))
+    for workers in [2, 4, 16]:
+        parallel = scan(str(tmp_path), ScanOptions(workers=workers))
+        assert parallel.names == serial.names
+        assert parallel.sizes == serial.sizes
+        assert parallel.first_child == serial.first_child
+        assert parallel.child_count == serial.child_count
+        assert parallel.stats.entries == len(serial.names)
+        assert parallel.stats.workers == workers
+        assert parallel.stats.entries_per_second() > 0
+    with pytest.raises(ValueError):
+        ScanOptions(workers=0)
+
+
+def test_incremental_rescan(tmp_path: pathlib.Path) -> None:
+    """Test that a rescan through a ScanCache lists only the folders whose
+    modification time changed, and gives the same result as a full scan.
+    """
+    root = tmp_path / 'root'
+    for folder in ['a/b', 'a/c', 'd']:
+        (root / folder).mkdir(parents=True)
+    for i, name in enumerate(['a/x', 'a/b/y', 'a/c/z', 'd/w']):
+        (root / name).write_text('x' * (i + 1))
+    for folder in [root, root / 'a', root / 'a/b', root / 'a/c', root / 'd']:
+        os.utime(folder, (1000000000, 1000000000))
+    cache = ScanCache(str(tmp_path / 'scan.cache'))
+
+    first = cache.scan(str(root))
+    assert first.stats.reused == 0
+    unchanged = cache.scan(str(root))
+    assert unchanged.stats.reused == 5
+    assert unchanged.names == first.names
+    assert unchanged.sizes == first.sizes
+
+    (root / 'a/b/new').write_text('new file')
+    (root / 'd/w').unlink()
+    changed = cache.scan(str(root))
+    assert changed.stats.reused == 3
+    fresh = scan(str(root))
+    assert changed.names == fresh.names
+    assert changed.sizes == fresh.sizes
+    assert changed.first_child == fresh.first_child
+    assert changed.child_count == fresh.child_count
+
+    tree = FileSystemTree(str(root), cache=str(tmp_path / 'scan.cache'))
+    assert _fs_shape(tree) == _listdir_shape(str(root))
+
+    # The cache is a snapshot, and anything else in its place is ignored.
+    with open(cache.path, 'rb') as f:
+        assert f.read(len(snapshot.MAGIC)) == snapshot.MAGIC
+    assert cache.load(str(root), ScanOptions('skip')) is None
+    for contents in [b'', b'not a snapshot', b'\x80\x04N.']:
+        with open(cache.path, 'wb') as f:
+            f.write(contents)
+        assert cache.load(str(root), ScanOptions()) is None
+        assert cache.scan(str(root)).stats.reused == 0
+
+
+def test_lazy_file_system_tree(tmp_path: pathlib.Path) -> None:
+    """Test that a lazy FileSystemTree lists folders only when they are
+    expanded or hit, refines its sizes in the background, and ends up the
+    same as a tree scanned all at once.
+    """
+    for folder in ['a/b/c', 'a/e', 'd']:
+        (tmp_path / folder).mkdir(parents=True)
+    for i, name in enumerate(['a/x', 'a/b/y', 'a/b/c/z', 'd/w', 'v']):
+        (tmp_path / name).write_text('x' * (10 * i + 1))
+    eager = FileSystemTree(str(tmp_path))
+    tree = FileSystemTree(str(tmp_path), lazy=True)
+
+    a = [sub for sub in tree._subtrees if sub._name == 'a'][0]
+    assert a._subtrees == []
+    assert a.get_suffix() == ' (folder)'
+    eager_a = [sub for sub in eager._subtrees if sub._name == 'a'][0]
+    assert tree.refresh_sizes(block=True)
+    assert a.data_size == eager_a.data_size
+    assert tree.data_size == eager.data_size
+
+    tree.update_rectangles((0, 0, 200, 100))
+    tree.expand()
+    hit = tree.get_tree_at_position((a.rect[0] + 1, a.rect[1] + 1))
+    assert hit is a
+    assert sorted(sub._name for sub in a._subtrees) == ['b', 'e', 'x']
+    assert [sub._subtrees for sub in a._subtrees if sub._name == 'b'] == [[]]
+
+    tree.expand_all()
+    assert _fs_shape(tree) == _fs_shape(eager)
+    tree.update_dirty_rectangles((0, 0, 200, 100))
+    eager.update_rectangles((0, 0, 200, 100))
+    eager.expand_all()
+    assert _all_rects(tree) == _all_rects(eager)
+    assert tree.get_rectangles() == eager.get_rectangles()
+
+
+def test_streamed_file_system_tree(tmp_path: pathlib.Path) -> None:
+    """Test that a streamed FileSystemTree reports its progress, adds the
+    folders the background scan lists a few at a time, and ends up the same
+    as a tree scanned all at once.
+    """
+    for i in range(4):
+        for folder in ['a{}/b/c'.format(i), 'a{}/e'.format(i)]:
+            (tmp_path / folder).mkdir(parents=True)
+        (tmp_path / 'a{}/b/c/z'.format(i)).write_text('x' * (i + 1))
+    (tmp_path / 'v').write_text('xyz')
+    eager = FileSystemTree(str(tmp_path))
+    tree = FileSystemTree(str(tmp_path), stream=True)
+    assert tree.get_scan_progress().startswith('Scanning: ')
+    tree.update_rectangles((0, 0, 200, 100))
+
+    tree.refresh_sizes(max_seconds=0)
+    assert tree.get_scan_progress() != ''
+    assert tree.refresh_sizes(block=True)
+    assert tree.get_scan_progress() == ''
+    assert not tree.refresh_sizes()
+    assert _fs_shape(tree) == _fs_shape(eager)
+    tree.expand_all()
+    tree.update_dirty_rectangles((0, 0, 200, 100))
+    eager.update_rectangles((0, 0, 200, 100))
+    eager.expand_all()
+    assert _all_rects(tree) == _all_rects(eager)
+
+
+def test_expand_all_while_streaming(tmp_path: pathlib.Path,
+                                   monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that expand_all on a streamed tree does not list folders
+    itself, and that the folders the stream adds under it afterwards are
+    expanded, unless it has been collapsed since.
+    """
+    for i in range(3):
+        (tmp_path / 'a{}/b/c'.format(i)).mkdir(parents=True)
+        (tmp_path / 'a{}/b/c/z'.format(i)).write_text('x' * (i + 1))
+        (tmp_path / 'a{}/y'.format(i)).write_text('y')
+    def fail(*_: object) -> None:
+        raise AssertionError('a folder was listed on this thread')
+
+    for collapsed in (False, True):
+        tree = FileSystemTree(str(tmp_path), stream=True)
+        tree.update_rectangles((0, 0, 200, 100))
+        tree.get_rectangles()
+        while not tree._lazy.stream.is_done():
+            time.sleep(0.01)
+        with monkeypatch.context() as m:
+            m.setattr(tm_trees, 'scan_pending', fail)
+            tree.expand_all()
+        assert tree._expanded
+        assert all(sub._subtrees == [] for sub in tree._subtrees)
+        if collapsed:
+            tree._subtrees[0].collapse()
+        assert tree.refresh_sizes(block=True)
+
+        assert list(tree._frontier) == tree._displayed_trees()
+        if collapsed:
+            assert not any(sub._expanded for sub in _preorder(tree))
+        else:
+            assert all(sub._expanded for sub in _preorder(tree)
+                       if sub._subtrees != [])
+            assert sorted(leaf._name for leaf in tree._displayed_trees()) \
+                == ['y', 'y', 'y', 'z', 'z', 'z']
+        tree.update_dirty_rectangles((0, 0, 200, 100))
+        assert sum(rect[2] * rect[3]
+                   for rect, _ in tree.get_rectangles()) == 200 * 100
+
+
+def test_changes_while_streaming(tmp_path: pathlib.Path) -> None:
+    """Test that changes inside folders a streamed tree has not added yet
+    are applied when they are added, even if the stream listed them before
+    the changes.
+    """
+    (tmp_path / 'a/sub/deep').mkdir(parents=True)
+    (tmp_path / 'a/sub/x').write_text('x' * 10)
+    (tmp_path / 'a/sub/deep/y').write_text('y')
+    tree = FileSystemTree(str(tmp_path), stream=True)
+    tree.update_rectangles((0, 0, 200, 100))
+    while not tree._lazy.stream.is_done():
+        time.sleep(0.01)
+
+    changes = Changes(str(tmp_path))
+    for name, size in [('a/sub/new', 5), ('a/sub/deep/y', 20)]:
+        (tmp_path / name).write_text('z' * size)
+        changes.add_changed(str(tmp_path / name))
+    assert not tree.apply_changes(changes)
+    assert tree.refresh_sizes(block=True)
+    assert tree.data_size == 10 + 5 + 20
+    assert _sorted_fs_shape(tree) == \
+        _sorted_fs_shape(FileSystemTree(str(tmp_path)))
+    assert tree._lazy.deferred == {}
+    tree.update_dirty_rectangles((0, 0, 200, 100))
+    assert sum(rect[2] * rect[3]
+               for rect, _ in tree.get_rectangles()) == 200 * 100
+
+
+def test_overflow_on_lazy_trees(tmp_path: pathlib.Path) -> None:
+    """Test that a lazy or streamed tree whose watcher lost changes is
+    scanned again the same way, with a new background scan.
+    """
+    for stream in (False, True):
+        root = tmp_path / str(stream)
+        for folder in ['a/b', 'd']:
+            (root / folder).mkdir(parents=True)
+        for i, name in enumerate(['a/x', 'a/b/y', 'd/w']):
+            (root / name).write_text('x' * (10 * i + 1))
+        tree = FileSystemTree(str(root), lazy=not stream, stream=stream)
+        tree.update_rectangles((0, 0, 200, 100))
+        tree.refresh_sizes(block=True)
+        old = tree._lazy
+
+        shutil.rmtree(str(root / 'd'))
+        (root / 'a/b/n').mkdir()
+        (root / 'a/b/n/f').write_text('x' * 100)
+        changes = Changes(str(root))
+        changes.overflowed = True
+        assert tree.apply_changes(changes)
+        assert old.pending == {}
+        assert tree._lazy is not old
+        assert (tree._lazy.stream is not None) == stream
+        assert sorted(sub._name for sub in tree._subtrees) == ['a']
+        assert tree._subtrees[0]._pending is not None
+
+        tree.refresh_sizes(block=True)
+        assert tree.data_size == 1 + 11 + 100
+        tree.expand_all()
+        assert _sorted_fs_shape(tree) == \
+            _sorted_fs_shape(FileSystemTree(str(root)))
+        tree.update_dirty_rectangles((0, 0, 200, 100))
+        assert sum(rect[2] * rect[3]
+                   for rect, _ in tree.get_rectangles()) == 200 * 100
+
+
+def test_pruned_file_system_tree(tmp_path: pathlib.Path) -> None:
+    """Test that scan options exclude entries, stop at a maximum depth and
+    fold small files together, keeping the size of every folder exact.
+    """
+    for folder in ['a/b/c', 'a/__pycache__', 'obj']:
+        (tmp_path / folder).mkdir(parents=True)
+    for name, size in [('a/x', 10), ('a/b/y', 20), ('a/b/c/z', 30),
+                       ('a/__pycache__/m.pyc', 40), ('a/w.pyc', 50)]:
+        (tmp_path / name).write_text('x' * size)
+    for i in range(100):
+        (tmp_path / 'obj' / '{}.o'.format(i)).write_text('y' * i)
+    options = ScanOptions(exclude=('__pycache__', '*.pyc'), max_depth=2,
+                          min_size=10, max_files=5)
+    tree = FileSystemTree(str(tmp_path), options)
+    assert tree.data_size == 10 + 20 + 30 + sum(range(100))
+
+    a, obj = sorted(tree._subtrees, key=lambda sub: sub._name)
+    assert sorted(sub._name for sub in a._subtrees) == ['b', 'x']
+    b = [sub for sub in a._subtrees if sub._name == 'b'][0]
+    assert b._subtrees == []
+    assert b.data_size == 50
+    assert b.get_suffix() == ' (folder)'
+    assert sorted(sub._name for sub in obj._subtrees) == \
+        ['(95 small files)', '95.o', '96.o', '97.o', '98.o', '99.o']
+    assert obj.data_size == sum(range(100))
+
+    tree.expand_all()
+    assert len(tree.get_rectangles()) == 8
+
+
+def test_folded_changes_in_root(tmp_path: pathlib.Path) -> None:
+    """Test that changes to the files directly in the watched folder are
+    applied when small files are folded together.
+    """
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a/x').write_text('x' * 50)
+    for i in range(20):
+        (tmp_path / '{}.o'.format(i)).write_text('y' * i)
+    options = ScanOptions(min_size=10, max_files=5)
+    tree = FileSystemTree(str(tmp_path), options)
+    tree.update_rectangles((0, 0, 200, 100))
+
+    changes = Changes(str(tmp_path))
+    for name, size in [('3.o', 0), ('19.o', 100), ('new', 70)]:
+        (tmp_path / name).write_text('z' * size)
+        changes.add_changed(str(tmp_path / name))
+    (tmp_path / '18.o').unlink()
+    changes.add_changed(str(tmp_path / '18.o'))
+    tree.apply_changes(changes, options)
+    assert _sorted_fs_shape(tree) == \
+        _sorted_fs_shape(FileSystemTree(str(tmp_path), options))
+
+
+def test_watched_file_system_tree(tmp_path: pathlib.Path) -> None:
+    """Test that applying the changes a FileSystemWatcher records, with
+    inotify where it is available and by polling, keeps a FileSystemTree
+    the same as a new scan of its folder.
+    """
+    def modify(root: pathlib.Path) -> None:
+        (root / 'a/x').write_text('longer contents')
+
+    def create(root: pathlib.Path) -> None:
+        (root / 'n/m').mkdir(parents=True)
+        (root / 'n/m/f').write_text('abc')
+
+    def rename(root: pathlib.Path) -> None:
+        (root / 'a/b').rename(root / 'd/bb')
+        (root / 'v').rename(root / 'd/bb/v')
+
+    def remove(root: pathlib.Path) -> None:
+        shutil.rmtree(str(root / 'big'))
+        (root / 'd/w').unlink()
+
+    def remove_and_rename(root: pathlib.Path) -> None:
+        (root / 'd/bb/c/z').unlink()
+        (root / 'd/bb').rename(root / 'a/moved')
+
+    changes = Changes(str(tmp_path))
+    changes.add_changed(os.path.join(str(tmp_path), 'd', 'bb', 'c', 'z'))
+    changes.add_moved(os.path.join(str(tmp_path), 'd', 'bb'),
+                      os.path.join(str(tmp_path), 'a', 'moved'))
+    assert changes.changed == {
+        os.path.join(str(tmp_path), 'a', 'moved', 'c', 'z')}
+
+    for use_inotify in [True, False]:
+        root = tmp_path / str(use_inotify)
+        for folder in ['a/b/c', 'd', 'big']:
+            (root / folder).mkdir(parents=True)
+        for i, name in enumerate(['a/x', 'a/b/y', 'a/b/c/z', 'd/w', 'v']):
+            (root / name).write_text('x' * (10 * i + 1))
+        for i in range(1000):
+            (root / 'big' / str(i)).write_text('y')
+        tree = FileSystemTree(str(root))
+        tree.update_rectangles((0, 0, 200, 100))
+        tree.expand_all()
+        watcher = FileSystemWatcher(str(root), poll_interval=0.05,
+                                    use_inotify=use_inotify)
+        watcher.wait_started()
+        try:
+            for change in [modify, create, rename, remove,
+                           remove_and_rename]:
+                change(root)
+                expected = _sorted_fs_shape(FileSystemTree(str(root)))
+                deadline = time.monotonic() + 10
+                while _sorted_fs_shape(tree) != expected and \
+                        time.monotonic() < deadline:
+                    time.sleep(0.02)
+                    tree.apply_changes(watcher.take_changes())
+                assert _sorted_fs_shape(tree) == expected
+        finally:
+            watcher.close()
+        tree.update_dirty_rectangles((0, 0, 200, 100))
+        assert sum(rect[2] * rect[3] for rect, _ in tree.get_rectangles()) \
+            == 200 * 100
+
+
+def test_watcher_starts_in_background(
+        tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a watcher is created without scanning or watching its
+    folder, which it does on its own thread.
+    """
+    (tmp_path / 'a').mkdir()
+    scanning = threading.Event()
+    release = threading.Event()
+    entry_table = fs_watch._entry_table
+
+    def blocked(path: str, options: ScanOptions) -> Dict[str, int]:
+        scanning.set()
+        release.wait()
+        return entry_table(path, options)
+
+    monkeypatch.setattr(fs_watch, '_entry_table', blocked)
+    for use_inotify in [True, False]:
+        scanning.clear()
+        release.clear()
+        watcher = FileSystemWatcher(str(tmp_path), poll_interval=0.05,
+                                    use_inotify=use_inotify)
+        try:
+            if watcher.method == 'poll':
+                assert scanning.wait(10)
+                assert not watcher._started.is_set()
+            release.set()
+            watcher.wait_started()
+            (tmp_path / 'a/x').write_text('x')
+            deadline = time.monotonic() + 10
+            changes = watcher.take_changes()
+            while changes.is_empty() and time.monotonic() < deadline:
+                time.sleep(0.02)
+                changes = watcher.take_changes()
+            assert os.path.join(str(tmp_path), 'a', 'x') in changes.changed
+        finally:
+            watcher.close()
+        (tmp_path / 'a/x').unlink()
+
+
+def test_watcher_falls_back_to_polling(tmp_path: pathlib.Path) -> None:
+    """Test that a watcher that cannot watch a new folder with inotify
+    reports an overflow and polls the folder from then on.
+    """
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a/x').write_text('x')
+    tree = FileSystemTree(str(tmp_path))
+    watcher = FileSystemWatcher(str(tmp_path), poll_interval=0.05)
+    watcher.wait_started()
+    if watcher.method != 'inotify':
+        watcher.close()
+        pytest.skip('inotify is not available')
+    watcher._watch_folder = lambda path: False
+    try:
+        (tmp_path / 'b').mkdir()
+        (tmp_path / 'b/y').write_text('yy')
+        deadline = time.monotonic() + 10
+        overflowed = False
+        while watcher.method != 'poll' and time.monotonic() < deadline:
+            time.sleep(0.02)
+            changes = watcher.take_changes()
+            overflowed |= changes.overflowed
+            tree.apply_changes(changes)
+        assert watcher.method == 'poll'
+        # Changes in the folder that could not be watched are still seen.
+        (tmp_path / 'b/z').write_text('zzz')
+        expected = _sorted_fs_shape(FileSystemTree(str(tmp_path)))
+        while _sorted_fs_shape(tree) != expected and \
+                time.monotonic() < deadline:
+            time.sleep(0.02)
+            changes = watcher.take_changes()
+            overflowed |= changes.overflowed
+            tree.apply_changes(changes)
+        assert overflowed
+        assert _sorted_fs_shape(tree) == expected
+    finally:
+        watcher.close()
+
+
+def test_snapshot_round_trip(tmp_path: pathlib.Path) -> None:
+    """Test that saving the JSON fixtures of paper trees to a snapshot and
+    loading them back gives the same trees, created only as they are
+    needed.
+    """
+    path = str(tmp_path / 'tree.snapshot')
+    for fixture in ['paper_init', 'paper_rect', 'paper_final',
+                    'year_paper_init', 'year_paper_rect', 'year_paper_final']:
+        with open(os.path.join(_DATA_DIR, fixture + '.json')) as f:
+            data = json.load(f)
+        tree = _paper_tree_from_json(data)
+        tree.save_snapshot(path)
+        loaded = TMTree.load_snapshot(path)
+        assert isinstance(loaded, PaperTree)
+
+        displayed = loaded._displayed_trees()
+        # Only the subtrees of the root and of expanded trees are created.
+        assert len(_preorder(loaded)) == 1 + sum(
+            len(t._subtrees) for t in _preorder(tree)
+            if t._expanded or t is tree)
+        assert [t._name for t in displayed] == \
+            [t._name for t in tree._displayed_trees()]
+        stubs = [t for t in displayed if t._stub is not None and
+                 t.rect[2] > 2 and t.rect[3] > 2]
+        if stubs:
+            centre = (stubs[0].rect[0] + stubs[0].rect[2] // 2,
+                      stubs[0].rect[1] + stubs[0].rect[3] // 2)
+            hit = loaded.get_tree_at_position(centre)
+            assert hit is stubs[0]
+            assert hit._subtrees != []
+            assert hit.get_suffix() == ' (category)'
+
+        loaded._list_subtrees(recursive=True)
+        assert _paper_tree_to_json(loaded) == _paper_tree_to_json(tree)
+
+    (tmp_path / 'files' / 'a').mkdir(parents=True)
+    (tmp_path / 'files' / 'a' / 'x.txt').write_text('hello')
+    (tmp_path / 'files' / 'y.txt').write_text('hi')
+    files = FileSystemTree(str(tmp_path / 'files'))
+    files.save_snapshot(path, rects=False)
+    loaded = TMTree.load_snapshot(path)
+    # A folder whose subtrees have not been created yet is still a folder.
+    a = [sub for sub in loaded._subtrees if sub._name == 'a'][0]
+    assert a._subtrees == []
+    assert a.get_suffix() == ' (folder)'
+    loaded._list_subtrees(recursive=True)
+    assert isinstance(loaded, FileSystemTree)
+    assert _fs_shape(loaded) == _fs_shape(files)
+
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot')
+    with pytest.raises(ValueError):
+        TMTree.load_snapshot(path)
+
+    # A snapshot cannot name a class that is not a tree, or import the
+    # module of one.
+    for class_name in ['subprocess:Popen', 'tm_trees:ScanOptions',
+                       'antigravity:TMTree']:
+        writer = snapshot.SnapshotWriter(class_name, 0, 0, False)
+        writer.add_node('x', 1, 1, 0, False, (0, 0, 0, 0), ())
+        writer.write(path)
+        with pytest.raises(ValueError):
+            TMTree.load_snapshot(path)
+    assert 'antigravity' not in sys.modules
+
+
+def test_array_store_matches_tmtree(tmp_path: pathlib.Path) -> None:
+    """Test that the NumPy-backed store computes the same data sizes,
+    rectangles, displayed leaves and hit tests as the TMTree it was built
+    from, including the path strings of FileSystemTrees.
+    """
+    pytest.importorskip('numpy')
+    from array_store import ArrayTreeStore
+
+    for seed in range(10):
+        tree = _random_tree(seed, depth=5, fanout=6)
+        rng = random.Random(seed)
+        for node in _preorder(tree):
+            if rng.random() < 0.7:
+                node.expand()
+        store = ArrayTreeStore(tree)
+        assert store.update_data_sizes() == tree.update_data_sizes()
+
+        for rect in [(0, 0, 800, 570), (3, 7, 120, 90), (0, 0, 5, 900)]:
+            tree.update_rectangles(rect)
+            store.update_rectangles(rect)
+            assert [node.rect for node in _preorder(tree)] == \
+                [store.view(int(i)).rect for i in store._dfs_order]
+            assert store.get_rectangles() == tree.get_rectangles()
+            for pos in [(rect[0] + 1, rect[1] + 1), (rect[0] + 60, 50)]:
+                leaf = tree.get_tree_at_position(pos)
+                view = store.get_tree_at_position(pos)
+                if leaf is None:
+                    assert view is None
+                else:
+                    assert view.get_path_string() == leaf.get_path_string()
+
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'x.txt').write_text('hello')
+    (tmp_path / 'y.txt').write_text('hi')
+    path = str(tmp_path / 'tree.snapshot')
+    FileSystemTree(str(tmp_path)).save_snapshot(path, rects=False)
+    for tree in [FileSystemTree(str(tmp_path)),
+                 FileSystemTree(str(tmp_path), lazy=True),
+                 TMTree.load_snapshot(path)]:
+        store = ArrayTreeStore(tree)
+        assert [store.view(int(i)).get_path_string()
+                for i in store._dfs_order] == \
+            [node.get_path_string() for node in _preorder(tree)]
+
+
+def test_streamed_paper_tree(tmp_path: pathlib.Path) -> None:
+    """Test that loading the papers one row at a time gives the same trees
+    as the JSON fixtures, with and without years, with the papers of each
+    category before its subcategories, and that deeply nested categories
+    can be loaded.
+    """
+    dataset = str(tmp_path / 'papers.csv')
+    with open(dataset, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['author', 'title', 'year', 'category', 'doi',
+                         'citations'])
+        writer.writerow(['A', 'p1', '2001', 'x: y', 'd1', '1'])
+        writer.writerow(['B', 'p2', '2002', 'x', 'd2', '2'])
+        writer.writerow(['C', 'p3', '2001', 'z', 'd3', '3'])
+        writer.writerow(['D', 'p4', '2001', ': '.join(['w'] * 5000), 'd4',
+                         '4'])
+    trees = papers._load_papers(dataset, by_year=False)
+    assert [_preorder_names(sub) for sub in trees[:2]] == \
+        [['x', 'p2', 'y', 'p1'], ['z', 'p3']]
+    assert [sub.data_size for sub in trees] == [3, 3, 4]
+    depth = 0
+    deepest = trees[2]
+    while deepest._subtrees != []:
+        deepest = deepest._subtrees[0]
+        depth += 1
+    assert (depth, deepest._name) == (5000, 'p4')
+    assert [sub._name for sub in papers._load_papers(dataset)] == \
+        ['2001', '2002']
+
+    for by_year, fixture in [(False, 'paper_init'),
+                             (True, 'year_paper_init')]:
+        tree = PaperTree('CS1', [], all_papers=True, by_year=by_year)
+        assert all(sub._by_year == by_year for sub in _preorder(tree)
+                   if sub._subtrees == [])
+
+        with open(os.path.join(_DATA_DIR, fixture + '.json')) as f:
+            expected = _paper_tree_from_json(json.load(f))
+        assert _paper_shape(tree) == _paper_shape(expected)
+
+
+def test_cached_paper_tree(tmp_path: pathlib.Path,
+                           monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a cached paper tree is loaded without reading the dataset,
+    and is built again when by_year or the contents of the dataset change.
+    """
+    dataset = str(tmp_path / 'papers.csv')
+    cache = str(tmp_path / 'papers.cache')
+    shutil.copy(papers.DATA_FILE, dataset)
+    monkeypatch.setattr(papers, 'DATA_FILE', dataset)
+    built = PaperTree('CS1', [], all_papers=True, by_year=False, cache=cache)
+    assert os.path.exists(cache)
+
+    def fail(*_: object) -> None:
+        raise AssertionError('the dataset was read')
+    with monkeypatch.context() as m:
+        m.setattr(papers, '_load_papers', fail)
+        loaded = PaperTree('CS1', [], all_papers=True, by_year=False,
+                           cache=cache)
+    assert all(sub._subtrees == [] and sub._stub is not None
+               for sub in loaded._subtrees)
+    loaded._list_subtrees(recursive=True)
+    assert _paper_tree_to_json(loaded) == _paper_tree_to_json(built)
+
+    by_year = PaperTree('CS1', [], all_papers=True, by_year=True, cache=cache)
+    assert len(by_year._subtrees) != len(built._subtrees)
+
+    # The same size and modification time, but one more citation of the
+    # last paper.
+    stat = os.stat(dataset)
+    with open(dataset, 'rb') as f:
+        data = f.read()
+    assert data.endswith(b',0')
+    with open(dataset, 'wb') as f:
+        f.write(data[:-1] + b'1')
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    changed = PaperTree('CS1', [], all_papers=True, by_year=True,
+                        cache=cache)
+    assert changed.data_size == by_year.data_size + 1
+
+
+def test_paper_dataset_groupings() -> None:
+    """Test that a PaperDataset groups the same paper trees in each
+    grouping, and gives the same trees as PaperTree for the groupings it
+    has.
+    """
+    dataset = papers.PaperDataset()
+    for grouping, by_year in [(('category',), False),
+                              (('year', 'category'), True)]:
+        tree = dataset.build(grouping)
+        expected = PaperTree('CS1', [], all_papers=True, by_year=by_year)
+        assert _paper_tree_to_json(tree) == _paper_tree_to_json(expected)
+
+    tree = dataset.build(('category', 'year'))
+    leaves = [t for t in _preorder(tree) if t._subtrees == []]
+    assert sorted(map(id, leaves)) == sorted(map(id, dataset.papers))
+    assert all(leaf._parent_tree._name.isdigit() for leaf in leaves)
+    assert tree.data_size == expected.data_size
+    tree.update_rectangles((0, 0, 200, 100))
+    tree.expand_all()
+    assert tree.get_tree_at_position((100, 50)) in leaves
+
+    tree = dataset.build(('initial', 'category'))
+    assert all(len(sub._name) <= 1 for sub in tree._subtrees)
+    assert all(leaf.get_path_string().split('\\')[1] ==
+               leaf._authors.strip()[:1].upper() for leaf in dataset.papers)
+    with pytest.raises(ValueError):
+        dataset.build(('author',))
+
+
+def test_squarified_layout_tiles_rect() -> None:
+    """Test that the squarified layout divides every rect among the subtrees
+    that have data without gaps or overlaps, in proportion to their size.
+    """
+    for seed in range(20):
+        tree = _random_tree(seed, depth=3, fanout=8)
+        tree.set_layout_strategy(squarified_layout)
+        tree.update_rectangles((5, 3, 317, 211))
+        for node in _preorder(tree):
+            subs = [sub for sub in node._subtrees if sub.data_size > 0]
+            if subs == []:
+                continue
+            x, y, width, height = node.rect
+            assert sum(sub.rect[2] * sub.rect[3] for sub in subs) == \
+                width * height
+            for i, sub in enumerate(subs):
+                sx, sy, sw, sh = sub.rect
+                assert x <= sx and sx + sw <= x + width
+                assert y <= sy and sy + sh <= y + height
+                for other in subs[i + 1:]:
+                    ox, oy, ow, oh = other.rect
+                    assert sx + sw <= ox or ox + ow <= sx or \
+                        sy + sh <= oy or oy + oh <= sy
+            if len(subs) > 1 and width * height > 0:
+                largest = max(subs, key=lambda sub: sub.data_size)
+                area = largest.rect[2] * largest.rect[3]
+                share = largest.data_size / node.data_size
+                assert abs(area - share * width * height) <= width + height
+
+
+def test_squarified_layout_is_squarer() -> None:
+    """Test that the squarified layout gives the paper tree leaves much closer
+    to square than slice-and-dice does.
+    """
+    tree = PaperTree('CS1', [], all_papers=True, by_year=False)
+    tree.expand_all()
+    ratios = []
+    for strategy in (None, squarified_layout):
+        if strategy is not None:
+            tree.set_layout_strategy(strategy)
+        tree.update_rectangles((0, 0, 800, 570))
+        shown = [rect for rect, _ in tree.get_rectangles()
+                 if rect[2] > 0 and rect[3] > 0]
+        ratios.append(sum(max(w / h, h / w) for _, _, w, h in shown) /
+                      len(shown))
+    assert ratios[1] < 2 < ratios[0]
+
+
+def test_squarified_dirty_rectangles_and_hit_test() -> None:
+    """Test that incremental relayout and get_tree_at_position also work with
+    the squarified layout.
+    """
+    for seed in range(10):
+        tree = _random_tree(seed)
+        twin = _random_tree(seed)
+        rng = random.Random(seed)
+        for node in _preorder(tree):
+            if rng.random() < 0.7:
+                node.expand()
+        for t in (tree, twin):
+            t._subtrees[0].set_layout_strategy(squarified_layout)
+            t.update_rectangles((0, 0, 120, 90))
+
+        rng = random.Random(seed)
+        for _ in range(20):
+            _apply_random_op(rng, tree)
+            tree.update_dirty_rectangles((0, 0, 120, 90))
+        rng = random.Random(seed)
+        for _ in range(20):
+            _apply_random_op(rng, twin)
+        twin.update_rectangles((0, 0, 120, 90))
+        assert _all_rects(tree) == _all_rects(twin)
+
+        for x in range(-1, 122, 2):
+            for y in range(-1, 92, 3):
+                assert tree.get_tree_at_position((x, y)) is \
+                    _scan_tree_at_position(tree, (x, y))
+
+
+##############################################################################
+# Helpers
+##############################################################################
+
+
+def _random_tree(seed: int, depth: int = 4, fanout: int = 5) -> _SimpleTree:
+    """Return a randomly shaped tree, built deterministically from <seed>.
+    """
+    rng = random.Random(seed)
+    counter = [0]
+
+    def build(level: int) -> _SimpleTree:
+        counter[0] += 1
+        name = 'n{}'.format(counter[0])
+        if level == depth or (level > 0 and rng.random() < 0.3):
+            return _SimpleTree(name, [], rng.choice([0, 1, 5, 100, 12345]))
+        children = [build(level + 1) for _ in range(rng.randint(1, fanout))]
+        return _SimpleTree(name, children)
+
+    return build(0)
+
+
+def _preorder(tree: TMTree) -> List[TMTree]:
+    """Return every node of <tree> in preorder.
+    """
+    result = [tree]
+    for sub in tree._subtrees:
+        result.extend(_preorder(sub))
+    return result
+
+
+def _all_rects(tree: TMTree) -> List[Tuple[str, Tuple[int, int, int, int]]]:
+    """Return the name and rect of every node of <tree> in preorder.
+    """
+    return [(node._name, node.rect) for node in _preorder(tree)]
+
+
+def _scan_tree_at_position(tree: TMTree, pos: Tuple[int, int]) -> \
+        Optional[TMTree]:
+    """Return the displayed leaf of <tree> at <pos> by checking every
+    subtree, breaking ties on shared edges by distance to the origin.
+    """
+    if tree.data_size == 0:
+        return None
+    x, y, width, height = tree.rect
+    if x <= pos[0] <= x + width and y <= pos[1] <= y + height and \
+            (tree._subtrees == [] or not tree._expanded):
+        return tree
+    leaves = [_scan_tree_at_position(sub, pos) for sub in tree._subtrees]
+    leaves = [leaf for leaf in leaves if leaf is not None]
+    if len(leaves) == 0:
+        return None
+    return min(leaves, key=lambda leaf: leaf.rect[0] ** 2 + leaf.rect[1] ** 2)
+
+
+def _uncached_path(tree: TMTree) -> str:
+    """Return the path string of <tree>, built by walking to the root.
+    """
+    names = []
+    current_tree = tree
+    while current_tree is not None:
+        names.append(current_tree._name)
+        current_tree = current_tree._parent_tree
+    return '/'.join(reversed(names))
+
+
+def _fs_shape(tree: TMTree) -> Tuple:
+    """Return the name, size and subtrees of <tree>, nested as tuples.
+    """
+    return (tree._name, tree.data_size,
+            tuple(_fs_shape(sub) for sub in tree._subtrees))
+
+
+def _sorted_fs_shape(tree: TMTree) -> Tuple:
+    """Return the name, size and subtrees of <tree>, nested as tuples, with
+    the subtrees of each tree sorted.
+    """
+    return (tree._name, tree.data_size,
+            tuple(sorted(_sorted_fs_shape(sub) for sub in tree._subtrees)))
+
+
+def _listdir_shape(path: str) -> Tuple:
+    """Return the name, size and subtrees of the file or folder at <path>,
+    nested as tuples, scanned the way FileSystemTree originally did.
+    """
+    if not os.path.isdir(path):
+        return (os.path.basename(path), os.path.getsize(path), ())
+    subtrees = tuple(_listdir_shape(os.path.join(path, f))
+                     for f in os.listdir(path))
+    if subtrees == ():
+        return (os.path.basename(path), os.path.getsize(path), ())
+    return (os.path.basename(path), sum(sub[1] for sub in subtrees),
+            subtrees)
+
+
+def _paper_tree_from_json(data: dict) -> PaperTree:
+    """Return the paper tree saved as <data> in a JSON fixture, with the
+    rects, sizes and expanded trees of the fixture.
+    """
+    name, (attributes, children) = list(data.items())[0]
+    authors, doi, rect, _, expanded, data_size, _ = attributes
+    subtrees = [_paper_tree_from_json({child: children[child]})
+                for child in children]
+    tree = PaperTree(name, subtrees, authors, doi, data_size)
+    tree.rect = tuple(rect)
+    tree._expanded = expanded
+    return tree
+
+
+def _paper_tree_to_json(tree: PaperTree) -> dict:
+    """Return <tree> in the form of the JSON fixtures, without colours.
+    """
+    parent = None if tree._parent_tree is None else tree._parent_tree._name
+    return {tree._name: [[tree._authors, tree._doi, list(tree.rect), parent,
+                          tree._expanded, tree.data_size],
+                         [_paper_tree_to_json(sub) for sub in tree._subtrees]]}
+
+
+def _paper_shape(tree: PaperTree) -> Tuple:
+    """Return the name, authors, DOI and size of every node of <tree>,
+    nested, with the subtrees of each node in sorted order.
+    """
+    return (tree._name, tree._authors, tree._doi, tree.data_size,
+            sorted(_paper_shape(sub) for sub in tree._subtrees))
+
+
+def _preorder_names(tree: TMTree) -> List[str]:
+    """Return the names of every node of <tree> in preorder.
+    """
+    return [node._name for node in _preorder(tree)]
+
+
+def _walk_rectangles(tree: TMTree) -> List[Tuple[Tuple[int, int, int, int],
+                                                Tuple[int, int, int]]]:
+    """Return the displayed rectangles of <tree> by walking every expanded
+    tree, without using the cached frontier.
+    """
+    if tree._expanded:
+        result = []
+        for sub in tree._subtrees:
+            result.extend(_walk_rectangles(sub))
+        return result
+    elif tree.data_size == 0:
+        return []
+    return [(tree.rect, tree._colour)]
+
+
+def _apply_random_op(rng: random.Random, tree: TMTree) -> None:
+    """Apply a random change_size or move to a node of <tree> chosen
+    using <rng>.
+    """
+    nodes = _preorder(tree)
+    leaves = [node for node in nodes if node._subtrees == []]
+    internal = [node for node in nodes if node._subtrees != []]
+    leaf = rng.choice(leaves)
+    if rng.random() < 0.6 or leaf._parent_tree is None:
+        leaf.change_size(rng.choice([0.01, -0.01, 0.5, -0.5, 3]))
+    else:
+        leaf.move(rng.choice(internal))
+
+
+if __name__ == '__main__':
+    import pytest
+    pytest.main(['tm_trees_test.py'])
@@ -17,10 +17,14 @@ concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
 """
-from typing import Optional, Tuple
+import time
+from typing import Callable, Optional, Tuple
 import pygame
-from tm_trees import TMTree, FileSystemTree
-from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree, slice_and_dice_layout, \
+    squarified_layout
+from papers import GROUPINGS, PaperDataset, PaperTree
+from fs_watch import FileSystemWatcher
+from instrumentation import add_nodes, end_frame, timed
 
 
 # Screen dimensions and coordinates
@@ -34,9 +38,27 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
+# The most seconds each frame spends adding the folders a background scan
+# has listed to the tree, so the window stays responsive during long scans.
+SCAN_BUDGET = 0.02
+# The most seconds between layouts of the folders a background scan adds,
+# when nothing else needs the tree laid out.
+LAYOUT_INTERVAL = 0.25
+# The file the paper tree is cached in, so that later runs do not read the
+# dataset again while it is unchanged.
+PAPER_CACHE = 'cs1_papers.cache'
 
-def run_visualisation(tree: TMTree) -> None:
+
+def run_visualisation(tree: TMTree,
+                      watcher: Optional[FileSystemWatcher] = None,
+                      regroup: Optional[Callable[[], TMTree]] = None) -> None:
     """Display an interactive graphical display of the given tree's treemap.
+
+    If <watcher> is not None, <tree> is a FileSystemTree of the folder it
+    watches, and is kept up to date with the changes it records.
+
+    If <regroup> is not None, pressing g replaces the tree shown with the
+    tree regroup() returns.
     """
 
     # Setup pygame
@@ -48,9 +70,10 @@ def run_visualisation(tree: TMTree) -> None:
     tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    event_loop(screen, tree, watcher, regroup)
 
 
+@timed('render_display')
 def render_display(screen: pygame.Surface, tree: Optional[TMTree],
                    selected_node: Optional[TMTree],
                    hover_node: Optional[TMTree]) -> None:
@@ -65,9 +88,12 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
 
     subscreen = screen.subsurface((0, 0, WIDTH, TREEMAP_HEIGHT))
 
-    for rect, colour in tree.get_rectangles():
+    drawn = 0
+    for rect, colour in tree.iter_rectangles():
         # Note that the arguments are in the opposite order
         pygame.draw.rect(subscreen, colour, rect)
+        drawn += 1
+    add_nodes(drawn)
 
     # add the hover rectangle
     if selected_node is not None:
@@ -75,7 +101,12 @@ def render_display(screen: pygame.Surface, tree: Optional[TMTree],
     if hover_node is not None:
         pygame.draw.rect(subscreen, (255, 255, 255), hover_node.rect, 2)
 
-    _render_text(screen, _get_display_text(selected_node))
+    text = _get_display_text(selected_node)
+    if isinstance(tree, FileSystemTree):
+        progress = tree.get_scan_progress()
+        if progress:
+            text = progress + '  ' + text
+    _render_text(screen, text)
 
     # This must be called *after* all other pygame functions have run.
     pygame.display.flip()
@@ -93,15 +124,27 @@ def _render_text(screen: pygame.Surface, text: str) -> None:
     screen.blit(text_surface, text_pos)
 
 
-def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
+def event_loop(screen: pygame.Surface, tree: TMTree,
+               watcher: Optional[FileSystemWatcher] = None,
+               regroup: Optional[Callable[[], TMTree]] = None) -> None:
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
     the next event, determines the event's type, and then updates the state
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends only when the user closes the window.
+
+    While instrumentation is enabled, each pass through the loop is recorded
+    as one frame.
+
+    If <watcher> is not None, the changes it recorded are applied to <tree>
+    once per frame, so that a burst of changes is laid out together.
+
+    If <regroup> is not None, pressing g replaces <tree> with regroup(),
+    laid out the same way.
     """
     selected_node = None
+    last_layout = time.perf_counter()
 
     while True:
         # Wait for an event
@@ -116,21 +159,39 @@ def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
             selected_node = \
                 _handle_click(event.button, event.pos, tree, selected_node)
 
+        elif event.type == pygame.KEYUP and event.key == pygame.K_l:
+            # Switch between the slice-and-dice and squarified layouts.
+            if tree.get_layout_strategy() is slice_and_dice_layout:
+                tree.set_layout_strategy(squarified_layout)
+            else:
+                tree.set_layout_strategy(slice_and_dice_layout)
+            tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+
+        elif event.type == pygame.KEYUP and event.key == pygame.K_g and \
+                regroup is not None:
+            # Switch to the next grouping of the same data.
+            layout = tree.get_layout_strategy()
+            tree = regroup()
+            tree.set_layout_strategy(layout)
+            tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+            selected_node = None
+            hover_node = None
+
         elif event.type == pygame.KEYUP and selected_node is not None:
             if event.key == pygame.K_UP:
                 selected_node.change_size(0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                tree.update_dirty_rectangles(
+                    (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
             elif event.key == pygame.K_DOWN:
                 selected_node.change_size(-0.01)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                tree.update_dirty_rectangles(
+                    (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
             elif event.key == pygame.K_m:
                 selected_node.move(hover_node)
-                tree.update_data_sizes()
-                tree.update_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+                tree.update_dirty_rectangles(
+                    (0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
 
             elif event.key == pygame.K_e:
                 selected_node.expand()
@@ -144,8 +205,25 @@ def event_loop(screen: pygame.Surface, tree: TMTree) -> None:
             elif event.key == pygame.K_x:
                 selected_node.collapse_all()
 
+        # Add what the background scan has found since the last frame. It
+        # is laid out with the next event, or after LAYOUT_INTERVAL, since
+        # laying out a large tree many times a second would make the window
+        # slow to respond.
+        if isinstance(tree, FileSystemTree):
+            tree.refresh_sizes(max_seconds=SCAN_BUDGET)
+        if watcher is not None:
+            changes = watcher.take_changes()
+            if not changes.is_empty():
+                tree.apply_changes(changes, watcher.options)
+        now = time.perf_counter()
+        if event.type != pygame.NOEVENT or \
+                now - last_layout >= LAYOUT_INTERVAL:
+            tree.update_dirty_rectangles((0, 0, WIDTH, HEIGHT - FONT_HEIGHT))
+            last_layout = now
+
         # Update display
         render_display(screen, tree, selected_node, hover_node)
+        end_frame()
 
 
 def _handle_click(button: int, pos: Tuple[int, int], tree: TMTree,
@@ -178,30 +256,73 @@ def _get_display_text(leaf: Optional[TMTree]) -> str:
         return leaf.get_path_string() + '  ({})'.format(leaf.data_size)
 
 
-def run_treemap_file_system(path: str) -> None:
+def run_treemap_file_system(path: str, lazy: bool = False,
+                            stream: bool = True, watch: bool = False) -> None:
     """Run a treemap visualisation for the given path's file structure.
 
-    Precondition: <path> is a valid path to a file or folder.
+    If <lazy>, start as soon as <path> itself is listed, listing each folder
+    when it is first expanded or pointed at, and refining folder sizes as
+    they are found in the background. Otherwise, if <stream>, start as soon
+    as <path> itself is listed, and add the other folders as a background
+    scan lists them, showing its progress in the text display.
+
+    If <watch>, keep the treemap up to date with the changes made under
+    <path> while it is shown.
+
+    Precondition: <path> is a valid path to a file or folder, and a folder
+    if <watch>.
     """
-    file_tree = FileSystemTree(path)
-    run_visualisation(file_tree)
+    watcher = FileSystemWatcher(path) if watch else None
+    file_tree = FileSystemTree(path, lazy=lazy, stream=stream and not lazy)
+    try:
+        run_visualisation(file_tree, watcher)
+    finally:
+        if watcher is not None:
+            watcher.close()
 
 
-def run_treemap_papers() -> None:
-    """Run a treemap visualization for CS Education research papers data.
+def run_treemap_papers(cache: Optional[str] = PAPER_CACHE) -> None:
+    """Run a treemap visualization for CS Education research papers data,
+    cached in the file at <cache>, unless it is None.
+
+    Pressing g groups the papers by the next grouping in GROUPINGS.
 
     You can try changing the value of the named argument by_year, but the
     others should stay the same.
     """
-    paper_tree = PaperTree('CS1', [], all_papers=True, by_year=False)
-    run_visualisation(paper_tree)
+    paper_tree = PaperTree('CS1', [], all_papers=True, by_year=False,
+                           cache=cache)
+    run_visualisation(paper_tree, regroup=_next_paper_grouping())
+
+
+def _next_paper_grouping() -> Callable[[], TMTree]:
+    """Return a function that returns the paper tree grouped by the next
+    grouping in GROUPINGS each time it is called, starting after the first,
+    by categories, which the tree is first shown with.
+
+    DATA_FILE is only read the first time the function is called, into a
+    PaperDataset that every later grouping is built from.
+    """
+    dataset = None
+    current = 0
+
+    def regroup() -> TMTree:
+        """Return the paper tree grouped by the next grouping.
+        """
+        nonlocal dataset, current
+        if dataset is None:
+            dataset = PaperDataset()
+        current = (current + 1) % len(GROUPINGS)
+        return dataset.build(GROUPINGS[current])
+    return regroup
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'pygame', 'tm_trees', 'papers'
+            'python_ta', 'typing', 'time', 'pygame', 'tm_trees', 'papers',
+            'fs_watch', 'instrumentation'
         ],
         'generated-members': 'pygame.*'
     })